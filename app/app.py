@@ -1,8 +1,29 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash
+from flask import (Flask, render_template, request, redirect, url_for, session, flash, jsonify, Response,
+                   stream_template, get_flashed_messages, abort)
+import bisect
+import csv
+import hashlib
+import io
+import os
 import sqlite3
-from datetime import datetime
-from werkzeug.security import generate_password_hash, check_password_hash
+from datetime import datetime, date, timezone
+from functools import partial
 from pathlib import Path
+from db import ACTIVE_BOOKING, HOLD_SECONDS, day_number, get_pool, get_writer, init_db, open_databases
+import occupancy
+import availability
+import booking
+from catalog import get_catalog
+from hashing import get_service as get_hashing, HashingBusy
+import payments
+import holds
+import properties
+import inventory
+import search_cache
+import rendering
+import metrics
+import slow_queries
+from werkzeug.http import is_resource_modified
 
 # Usar la misma lógica de ruta que db.py
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -10,17 +31,256 @@ DB_PATH = BASE_DIR / "hotel_reservas.db"
 
 app = Flask(__name__)
 app.secret_key = "dev-secret-key-change-me"
+# Índice de ocupación en memoria compartida (ver occupancy.py); desactivado por defecto
+app.config["OCCUPANCY_INDEX"] = os.environ.get("HOTEL_OCCUPANCY_INDEX") == "1"
+# Búsqueda paginada por room_number y renderizada en streaming
+app.config["SEARCH_PAGE_SIZE"] = 50
+app.config["SEARCH_STREAMING"] = True
+# Ficheros estáticos con huella en la URL
+STATIC_MAX_AGE = 365 * 24 * 3600
+# Bytecode de plantillas en disco, fragmentos por habitación y tiempos de render
+rendering.init_app(app)
+# Latencias por ruta y sentencias SQL por petición (GET /metrics)
+metrics.init_app(app)
+# Sentencias por encima de HOTEL_SLOW_QUERY_MS, con su plan, en logs/slow_queries.log
+slow_queries.install()
 
-def get_db():
-    conn = sqlite3.connect(str(DB_PATH), check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    return conn
+def get_router():
+    """Directorio de hoteles: DB_PATH guarda los usuarios y el mapa hotel -> shard"""
+    return properties.get_router(DB_PATH)
+
+def current_property():
+    """Hotel de la petición: parámetro `property` (URL o formulario) o el elegido en la sesión"""
+    code = request.values.get("property")
+    if code:
+        try:
+            return get_router().get(code)
+        except properties.UnknownProperty:
+            abort(404)
+    code = session.get("property", properties.DEFAULT_PROPERTY)
+    try:
+        return get_router().get(code)
+    except properties.UnknownProperty:
+        # Hotel dado de baja desde que se eligió
+        session.pop("property", None)
+        return get_router().get(properties.DEFAULT_PROPERTY)
+
+def db_path():
+    """Fichero SQLite del hotel de la petición"""
+    return current_property()["path"]
+
+def db_intent(intent):
+    """Declara si la vista lee ("read") o escribe ("write") en la base de datos.
+
+    get_db() entrega a las vistas de lectura una conexión mode=ro de su propio
+    pool, y a las de escritura el escritor único del proceso. Sin declaración
+    se asume escritura.
+    """
+    def decorator(view):
+        view.db_intent = intent
+        return view
+    return decorator
+
+def view_intent():
+    view = app.view_functions.get(request.endpoint)
+    return getattr(view, "db_intent", "write")
+
+def get_db(path=None, intent=None):
+    """Conexión para el hotel actual (o path) según la intención de la vista; devolverla con release_db()"""
+    path = path or db_path()
+    if (intent or view_intent()) == "read":
+        return get_pool(path, readonly=True).acquire()
+    return get_writer(path).acquire()
+
+def release_db(conn, path=None):
+    path = path or db_path()
+    writer = get_writer(path)
+    if writer.owns(conn):
+        writer.release(conn)
+    else:
+        get_pool(path, readonly=True).release(conn)
+
+def get_occupancy(path=None):
+    """Índice de ocupación compartido, o None si está desactivado"""
+    if not app.config.get("OCCUPANCY_INDEX"):
+        return None
+    return occupancy.get_index(path or db_path())
+
+def holds_released(path, conn, rows):
+    """Tras liberar retenciones caducadas, recalcula sus tramos en el índice y en la caché de búsqueda"""
+    index = get_occupancy(path)
+    catalog = get_catalog(conn, path)
+    for _, room_id, start_day, end_day in rows:
+        if index:
+            index.refresh(conn, room_id, start_day, end_day)
+        invalidate_search(path, catalog, [room_id], start_day, end_day)
+
+def get_sweeper(path=None):
+    """Barrido de retenciones caducadas del hotel en este proceso (arranca al primer uso)"""
+    path = path or db_path()
+    sweeper = holds.get_sweeper(path, on_release=partial(holds_released, path))
+    sweeper.start()
+    return sweeper
+
+@app.before_request
+def start_sweeper():
+    # El ETag de búsqueda y calendario sólo cambia cuando el barrido publica las
+    # retenciones liberadas: cada worker lo arranca en su primera petición al
+    # hotel, aunque sólo sirva búsquedas
+    if request.endpoint != "static":
+        get_sweeper()
+
+def mirror_session_user(conn):
+    """En un shard, copia el usuario de la sesión para la FK de bookings"""
+    if db_path() != DB_PATH:
+        user_id = session["user_id"]
+        properties.mirror_user(conn, user_id, session.get("username") or f"user{user_id}")
+
+def inventory_validators(*parts):
+    """ETag y Last-Modified de una página que depende del inventario del hotel y de `parts`.
+
+    Sólo lee memoria compartida (inventory.py) y la cookie de sesión: la
+    página lleva el usuario en la cabecera, así que también forma parte del ETag.
+    """
+    prop = current_property()
+    version, modified = inventory.current(prop["path"])
+    key = repr((version, prop["code"], session.get("user_id"), parts))
+    etag = hashlib.sha1(key.encode()).hexdigest()[:20]
+    return etag, datetime.fromtimestamp(modified, timezone.utc)
+
+def set_validators(response, etag, modified):
+    response.set_etag(etag)
+    response.last_modified = modified
+    # El navegador puede guardarla pero debe revalidar cada vez
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+def not_modified(etag, modified):
+    """304 si el cliente ya tiene esta versión (sin SQLite ni Jinja); si no, None"""
+    if session.get("_flashes"):
+        # Hay mensajes pendientes de mostrar: toca renderizar
+        return None
+    if is_resource_modified(request.environ, etag=etag, last_modified=modified):
+        return None
+    return set_validators(Response(status=304), etag, modified)
+
+def static_version(filename):
+    """Huella del contenido de un fichero estático (se recalcula si cambia su mtime)"""
+    path = os.path.join(app.static_folder, filename)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    cached = _static_versions.get(filename)
+    if cached is None or cached[0] != mtime:
+        with open(path, "rb") as handle:
+            cached = _static_versions[filename] = (mtime, hashlib.sha1(handle.read()).hexdigest()[:12])
+    return cached[1]
+
+_static_versions = {}
+
+@app.url_defaults
+def fingerprint_static(endpoint, values):
+    # url_for('static', filename=...) -> /static/style.css?v=<huella>
+    if endpoint == "static" and "filename" in values and "v" not in values:
+        version = static_version(values["filename"])
+        if version:
+            values["v"] = version
+
+@app.after_request
+def cache_static(response):
+    # Una URL con huella nunca cambia de contenido: caché de un año sin revalidar
+    if request.endpoint == "static" and request.args.get("v") and response.status_code == 200:
+        response.cache_control.public = True
+        response.cache_control.max_age = STATIC_MAX_AGE
+        response.cache_control.immutable = True
+        response.cache_control.no_cache = None
+    return response
+
+@app.context_processor
+def inject_property():
+    return {"current_property": current_property()}
+
+def available_page(conn, catalog, index, room_type, start_day, end_day, after, limit):
+    """Habitaciones libres del tipo con room_number > after, ordenadas; se pide una fila de más"""
+    room_ids = catalog.rooms_by_type.get(room_type)
+    if room_ids is None:
+        return []
+    if index and index.covers(start_day, end_day, room_ids):
+        # Las habitaciones del tipo ya están ordenadas por room_number
+        position = bisect.bisect_right(catalog.numbers_by_type[room_type], after)
+        available_rooms = []
+        while len(available_rooms) <= limit and position < len(room_ids):
+            candidates = room_ids[position:position + limit]
+            position += limit
+            free = index.available(candidates, start_day, end_day)
+            available_rooms.extend(catalog.room(int(room_id), room_type) for room_id in candidates[free])
+        return available_rooms[:limit + 1]
+
+    # Solapamiento [start, end): usa idx_bookings_room_days por cada habitación;
+    # paginación por clave (room_number > after).
+    # Nombre y precio salen del catálogo, sin join con room_types.
+    query = f"""
+    SELECT rooms.id
+    FROM rooms rooms
+    WHERE rooms.room_type_id = ? AND rooms.room_number > ?
+    AND NOT EXISTS (
+        SELECT 1 FROM bookings b
+        WHERE b.room_id = rooms.id AND b.end_day > ? AND b.start_day < ? AND {ACTIVE_BOOKING}
+    )
+    ORDER BY rooms.room_number
+    LIMIT ?
+    """
+    rows = conn.execute(query, (catalog.types[room_type]["id"], after, start_day, end_day, limit + 1))
+    return [catalog.room(row[0], room_type) for row in rows]
+
+def occupied_numbers(conn, catalog, index, start_day, end_day):
+    """Números de las habitaciones (de cualquier tipo) con alguna noche ocupada en [start, end), perezosos"""
+    if index and index.covers(start_day, end_day, [len(catalog.room_type_ids) - 1]):
+        return room_numbers(catalog, index.occupied(start_day, end_day).tolist())
+    # Índice cubriente (status, end_day, start_day, room_id): sin tocar rooms
+    query = f"""
+    SELECT b.room_id
+    FROM bookings b
+    WHERE b.status IN ('PENDING_PAYMENT', 'CONFIRMED')
+    AND b.end_day > ? AND b.start_day < ? AND {ACTIVE_BOOKING}
+    """
+    return room_numbers(catalog, (row[0] for row in conn.execute(query, (start_day, end_day))))
+
+def invalidate_search(path, catalog, room_ids, start_day, end_day):
+    """Tras cambiar la disponibilidad de room_ids en [start, end), expulsa sólo las búsquedas afectadas"""
+    cache = search_cache.get_cache(path)
+    for code in {catalog.type_code(int(room_id)) for room_id in room_ids}:
+        if code is not None:
+            cache.invalidate(code, start_day, end_day)
+
+def room_numbers(catalog, room_ids):
+    """Traduce room_ids a números de habitación sin volver a la base de datos"""
+    for room_id in room_ids:
+        if catalog.has_room(room_id):
+            yield catalog.room_numbers[room_id]
+
+def stream_and_release(conn, template, **context):
+    """Renderiza en streaming y devuelve la conexión al pool al terminar"""
+    stream = stream_template(template, **context)
+    # El generador termina fuera de la petición: se fija ya a qué pool vuelve
+    path = db_path()
+
+    def generate():
+        try:
+            yield from stream
+        finally:
+            release_db(conn, path)
+    return generate()
 
 @app.route("/")
 def index():
     return render_template("index.html")
 
 @app.route("/register", methods=["GET", "POST"])
+# El hash es lento: se calcula sin tener el escritor y sólo el INSERT pasa por él
+@db_intent("read")
 def register():
     if request.method == "POST":
         username = request.form.get("username", "").strip()
@@ -30,7 +290,7 @@ def register():
             flash("Usuario y contraseña requeridos", "error")
             return redirect(url_for("register"))
         
-        conn = get_db()
+        conn = get_db(DB_PATH)
         cur = conn.cursor()
         
         try:
@@ -39,33 +299,45 @@ def register():
                 flash("El usuario ya existe", "error")
                 return redirect(url_for("register"))
             
-            pwd_hash = generate_password_hash(password)
-            cur.execute("INSERT INTO users (username, password_hash) VALUES (?,?)", (username, pwd_hash))
-            conn.commit()
+            pwd_hash = get_hashing().hash(password)
+            with get_writer(DB_PATH).connection() as writer:
+                writer.execute("INSERT INTO users (username, password_hash) VALUES (?,?)", (username, pwd_hash))
+                writer.commit()
             flash("Registro exitoso. Inicia sesión.", "success")
             return redirect(url_for("login"))
+        except HashingBusy:
+            flash("Servicio ocupado, inténtalo de nuevo en unos segundos", "error")
+            return render_template("register.html"), 503
         except Exception as e:
             flash(f"Error en el registro: {str(e)}", "error")
             return redirect(url_for("register"))
         finally:
-            conn.close()
+            release_db(conn, DB_PATH)
     
     return render_template("register.html")
 
 @app.route("/login", methods=["GET", "POST"])
+@db_intent("read")
 def login():
     if request.method == "POST":
         username = request.form.get("username", "").strip()
         password = request.form.get("password", "").strip()
         
-        conn = get_db()
+        conn = get_db(DB_PATH)
         cur = conn.cursor()
         
         try:
             cur.execute("SELECT id, password_hash FROM users WHERE username = ?", (username,))
             row = cur.fetchone()
             
-            if row and check_password_hash(row["password_hash"], password):
+            hashing = get_hashing()
+            if row and hashing.verify(row["password_hash"], password):
+                if hashing.needs_rehash(row["password_hash"]):
+                    # Hash con parámetros antiguos: se actualiza ahora que conocemos la contraseña
+                    new_hash = hashing.rehash(password)
+                    with get_writer(DB_PATH).connection() as writer:
+                        writer.execute("UPDATE users SET password_hash = ? WHERE id = ?", (new_hash, row["id"]))
+                        writer.commit()
                 session["user_id"] = row["id"]
                 session["username"] = username
                 flash(f"Bienvenido, {username}!", "success")
@@ -73,11 +345,14 @@ def login():
             
             flash("Credenciales inválidas", "error")
             return redirect(url_for("login"))
+        except HashingBusy:
+            flash("Servicio ocupado, inténtalo de nuevo en unos segundos", "error")
+            return render_template("login.html"), 503
         except Exception as e:
             flash(f"Error en el login: {str(e)}", "error")
             return redirect(url_for("login"))
         finally:
-            conn.close()
+            release_db(conn, DB_PATH)
     
     return render_template("login.html")
 
@@ -88,48 +363,236 @@ def logout():
     return redirect(url_for("index"))
 
 @app.route("/search", methods=["GET", "POST"])
+@db_intent("read")
 def search():
-    if request.method == "POST":
-        start_date = request.form.get("start_date")
-        end_date = request.form.get("end_date")
-        room_type = request.form.get("room_type")
+    # GET (cacheable, con ETag) o POST desde formularios antiguos
+    params = request.form if request.method == "POST" else request.args
+    if request.method == "POST" or params.get("start_date"):
+        start_date = params.get("start_date")
+        end_date = params.get("end_date")
+        room_type = params.get("room_type")
+        after = params.get("after", "")
+        page_size = app.config["SEARCH_PAGE_SIZE"]
         
+        try:
+            start_day = day_number(start_date)
+            end_day = day_number(end_date)
+        except (TypeError, ValueError):
+            flash("Rango de fechas inválido", "error")
+            return redirect(url_for("index"))
+
+        validators = None
+        if request.method == "GET":
+            # Antes de consultar: lo que se sirva será al menos de esta versión
+            validators = inventory_validators("search", start_date, end_date, room_type, after, page_size)
+            cached = not_modified(*validators)
+            if cached is not None:
+                return cached
+
         conn = get_db()
-        cur = conn.cursor()
+        streaming = False
+        cache = search_cache.get_cache(db_path())
+
+        try:
+            # Antes de la instantánea: descuenta lo que otros procesos cambiaron
+            # hasta la versión publicada, y lo que se invalide después no se guardará
+            cache.sync(conn, inventory.current(db_path())[0])
+            token = cache.token()
+            # Una instantánea WAL para catálogo, libres y ocupadas (y el render en streaming)
+            conn.execute("BEGIN")
+            catalog = get_catalog(conn, db_path())
+            index = get_occupancy()
+            page = ("page", after, page_size)
+            version = catalog.version
+            available_rooms = cache.get(room_type, start_day, end_day, page, version)
+            if available_rooms is None:
+                available_rooms = available_page(conn, catalog, index, room_type, start_day, end_day,
+                                                 after, page_size)
+                cache.put(room_type, start_day, end_day, page, version, available_rooms, token)
+            # Las ocupadas no se cachean: se leen del cursor a medida que se renderizan
+            occupied = occupied_numbers(conn, catalog, index, start_day, end_day)
+
+            next_after = available_rooms[page_size - 1]["room_number"] if len(available_rooms) > page_size else None
+            context = dict(available_rooms=available_rooms[:page_size],
+                           occupied_rooms=occupied,
+                           next_after=next_after, start_date=start_date,
+                           end_date=end_date, room_type=room_type)
+
+            if not app.config["SEARCH_STREAMING"]:
+                response = app.make_response(render_template("search_results.html", **context))
+            else:
+                # Consumir los mensajes flash ahora: con streaming las cabeceras
+                # (y la cookie de sesión) salen antes de renderizar base.html
+                get_flashed_messages(with_categories=True)
+                streaming = True
+                response = Response(stream_and_release(conn, "search_results.html", **context))
+            if validators:
+                set_validators(response, *validators)
+            return response
+        finally:
+            if not streaming:
+                release_db(conn)
+
+    return redirect(url_for("index"))
+
+@app.route("/api/availability", methods=["POST"])
+@db_intent("read")
+def api_availability():
+    payload = request.get_json(silent=True)
+    try:
+        queries = availability.parse_queries(payload)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    conn = get_db()
+    cur = conn.cursor()
+    try:
+        results = availability.batch_availability(cur, queries, get_catalog(conn, db_path()), get_occupancy())
+        return jsonify({"results": results})
+    finally:
+        release_db(conn)
+
+@app.route("/api/availability/city", methods=["POST"])
+@db_intent("read")
+def api_availability_city():
+    """Disponibilidad en todos los hoteles de una ciudad: una consulta por shard, en paralelo"""
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return jsonify({"error": "Se esperaba un objeto JSON"}), 400
+    city = payload.get("city")
+    if not isinstance(city, str) or not city.strip():
+        return jsonify({"error": "Se requiere city"}), 400
+    city = city.strip()
+    try:
+        queries = availability.parse_queries([[payload.get("room_type"), payload.get("start_date"),
+                                               payload.get("end_date")]])
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
+    def search_property(prop):
+        path = prop["path"]
+        conn = get_db(path, intent="read")
         try:
-            query = """
-            SELECT rooms.id as room_id, rooms.room_number, rt.name as room_type_name, rt.price
-            FROM rooms rooms
-            JOIN room_types rt ON rooms.room_type_id = rt.id
-            WHERE rt.code = ?
-            AND rooms.id NOT IN (
-                SELECT room_id FROM bookings
-                WHERE NOT (date(end_date) <= date(?) OR date(start_date) >= date(?))
-            )
-            ORDER BY rooms.room_number
-            """
-            cur.execute(query, (room_type, start_date, end_date))
-            available_rooms = cur.fetchall()
-
-            query_occupied = """
-            SELECT rooms.room_number
-            FROM rooms rooms
-            JOIN bookings b ON rooms.id = b.room_id
-            WHERE date(b.start_date) <= date(?) AND date(b.end_date) >= date(?)
-            """
-            cur.execute(query_occupied, (end_date, start_date))
-            occupied_rooms = [row['room_number'] for row in cur.fetchall()]
-
-            return render_template("search_results.html", available_rooms=available_rooms, 
-                                   occupied_rooms=occupied_rooms, start_date=start_date, 
-                                   end_date=end_date, room_type=room_type)
+            result = availability.batch_availability(conn.cursor(), queries, get_catalog(conn, path),
+                                                     get_occupancy(path))[0]
         finally:
-            conn.close()
+            release_db(conn, path)
+        return dict(result, property=prop["code"], name=prop["name"])
+
+    router = get_router()
+    results = [result for result in router.fan_out(router.properties(city=city), search_property)
+               if result["available"]]
+    results.sort(key=lambda result: (result["price"] is None, result["price"]))
+    return jsonify({"city": city, "results": results})
 
+@app.route("/api/properties")
+def api_properties():
+    hotels = get_router().properties(city=request.args.get("city"))
+    return jsonify({"properties": [{"code": prop["code"], "name": prop["name"], "city": prop["city"]}
+                                   for prop in hotels]})
+
+@app.route("/property/<code>")
+def select_property(code):
+    try:
+        prop = get_router().get(code)
+    except properties.UnknownProperty:
+        flash("Hotel no encontrado", "error")
+        return redirect(url_for("index"))
+    session["property"] = prop["code"]
+    flash(f"Hotel seleccionado: {prop['name']}", "success")
     return redirect(url_for("index"))
 
+@app.route("/calendar")
+@db_intent("read")
+def calendar():
+    month = request.args.get("month") or date.today().strftime("%Y-%m")
+    output = request.args.get("format", "html")
+    try:
+        year, month_number = (int(part) for part in month.split("-"))
+        date(year, month_number, 1)
+    except ValueError:
+        flash("Mes inválido (use AAAA-MM)", "error")
+        return redirect(url_for("index"))
+
+    validators = inventory_validators("calendar", month, output)
+    cached = not_modified(*validators)
+    if cached is not None:
+        return cached
+
+    conn = get_db()
+    try:
+        room_numbers, dates, grid = occupancy.month_grid(conn, year, month_number)
+    finally:
+        release_db(conn)
+
+    if output == "json":
+        # Un carácter por noche: 0 libre, 1 pendiente de pago, 2 confirmada
+        response = jsonify({
+            "month": month,
+            "days": [d.isoformat() for d in dates],
+            "rooms": {number: "".join(map(str, row)) for number, row in zip(room_numbers, grid.tolist())},
+        })
+    elif output == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(["room_number"] + [d.isoformat() for d in dates])
+        for number, row in zip(room_numbers, grid.tolist()):
+            writer.writerow([number] + row)
+        response = Response(buffer.getvalue(), mimetype="text/csv",
+                            headers={"Content-Disposition": f"attachment; filename=ocupacion_{month}.csv"})
+    else:
+        response = app.make_response(render_template("calendar.html", month=month, dates=dates,
+                                                      rows=zip(room_numbers, grid.tolist())))
+    return set_validators(response, *validators)
+
+@app.route("/api/stats")
+def api_stats():
+    path = db_path()
+    return jsonify({"property": current_property()["code"], "pool": get_pool(path, readonly=True).stats(),
+                    "writer": get_writer(path).stats(), "hashing": get_hashing().stats(),
+                    "payments": payments.get_pipeline(path).stats(), "holds": get_sweeper(path).stats(),
+                    "inventory_version": inventory.current(path)[0],
+                    "search_cache": search_cache.get_cache(path).stats(), "rendering": rendering.stats(),
+                    "slow_queries": slow_queries.get_log().summary(10)})
+
+def metrics_gauges():
+    """Pools, esperas del escritor y cachés de cada hotel abierto en el proceso"""
+    pools, writers = open_databases()
+    codes = {str(prop["path"]): prop["code"] for prop in get_router().properties()}
+    connections, waits, max_waits, caches = [], [], [], []
+    for pool in pools:
+        labels = {"property": codes.get(str(pool.path), str(pool.path)),
+                  "mode": "read" if pool.readonly else "write"}
+        stats = pool.stats()
+        connections += [(dict(labels, state="idle"), stats["idle"]), (dict(labels, state="in_use"), stats["in_use"])]
+        if pool.readonly:
+            # Las búsquedas usan el pool de lectura: hay caché donde lo hay
+            cache = search_cache.get_cache(pool.path).stats()
+            caches += [({"property": labels["property"], "stat": stat}, cache[stat])
+                       for stat in ("entries", "hits", "misses", "evictions", "invalidations")]
+    for writer in writers:
+        labels = {"property": codes.get(str(writer.path), str(writer.path))}
+        stats = writer.stats()
+        waits.append((labels, stats["wait_seconds"]))
+        max_waits.append((labels, stats["max_wait_seconds"]))
+    fragments = rendering.fragments.stats()
+    return [
+        ("hotel_pool_connections", "Conexiones de los pools por estado", connections),
+        ("hotel_writer_wait_seconds", "Tiempo acumulado esperando el escritor", waits),
+        ("hotel_writer_max_wait_seconds", "Mayor espera por el escritor", max_waits),
+        ("hotel_search_cache", "Caché de búsqueda por hotel", caches),
+        ("hotel_fragment_cache", "Caché de fragmentos de plantilla",
+         [({"stat": stat}, fragments[stat]) for stat in ("entries", "hits", "misses", "evictions")]),
+    ]
+
+metrics.register_collector(metrics_gauges)
+
+@app.route("/metrics")
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
 @app.route("/book", methods=["POST"])
+@db_intent("write")
 def book():
     if "user_id" not in session:
         flash("Inicia sesión para reservar", "error")
@@ -143,18 +606,17 @@ def book():
     cur = conn.cursor()
     
     try:
-        cur.execute("""
-            SELECT rt.price
-            FROM rooms r JOIN room_types rt ON r.room_type_id = rt.id
-            WHERE r.id = ?
-        """, (room_id,))
-        row = cur.fetchone()
-        
-        if not row:
+        try:
+            room_id = int(room_id)
+        except (TypeError, ValueError):
+            room_id = -1
+        catalog = get_catalog(conn, db_path())
+        price = catalog.price(room_id)
+
+        if price is None:
             flash("Habitación no encontrada", "error")
             return redirect(url_for("index"))
 
-        price = row["price"]
         sd = datetime.strptime(start_date, "%Y-%m-%d")
         ed = datetime.strptime(end_date, "%Y-%m-%d")
         nights = (ed - sd).days
@@ -165,41 +627,139 @@ def book():
         
         total = price * nights
 
-        cur.execute("""
-            SELECT COUNT(1) as c FROM bookings
-            WHERE room_id = ? AND NOT (date(end_date) <= date(?) OR date(start_date) >= date(?))
-        """, (room_id, start_date, end_date))
-        
-        if cur.fetchone()["c"] > 0:
+        start_day = sd.toordinal()
+        end_day = ed.toordinal()
+
+        mirror_session_user(conn)
+        booking_id = booking.reserve(conn, session["user_id"], room_id, start_date, end_date,
+                                     start_day, end_day, total)
+        if booking_id is None:
             flash("La habitación ya no está disponible en ese rango", "error")
             return redirect(url_for("index"))
+        inventory.publish(conn, db_path())
+        invalidate_search(db_path(), catalog, [room_id], start_day, end_day)
 
-        cur.execute("""
-            INSERT INTO bookings (user_id, room_id, start_date, end_date, total_price, status)
-            VALUES (?,?,?,?,?,?)
-        """, (session["user_id"], room_id, start_date, end_date, total, "PENDING_PAYMENT"))
-        conn.commit()
+        index = get_occupancy()
+        if index:
+            index.mark(room_id, start_day, end_day, "PENDING_PAYMENT")
+        get_sweeper()
 
-        booking_id = cur.lastrowid
-        return render_template("booking.html", booking_id=booking_id, total=total)
+        return render_template("booking.html", booking_id=booking_id, total=total,
+                               hold_minutes=HOLD_SECONDS // 60)
     finally:
-        conn.close()
+        release_db(conn)
+
+@app.route("/api/book/group", methods=["POST"])
+@db_intent("write")
+def api_book_group():
+    if "user_id" not in session:
+        return jsonify({"error": "Inicia sesión para reservar"}), 401
+
+    payload = request.get_json(silent=True) or {}
+    try:
+        start_date = payload.get("start_date")
+        end_date = payload.get("end_date")
+        start_day = day_number(start_date)
+        end_day = day_number(end_date)
+    except (TypeError, ValueError):
+        return jsonify({"error": "Fecha inválida"}), 400
+    if end_day <= start_day:
+        return jsonify({"error": "Rango de fechas inválido"}), 400
+
+    conn = get_db()
+    try:
+        mirror_session_user(conn)
+        try:
+            allocated = booking.reserve_many(conn, session["user_id"], start_date, end_date, start_day, end_day,
+                                             room_type=payload.get("room_type"),
+                                             quantity=payload.get("quantity"),
+                                             room_ids=payload.get("room_ids"))
+        except (TypeError, ValueError) as e:
+            return jsonify({"error": str(e)}), 400
+        if allocated is None:
+            return jsonify({"error": "No hay suficientes habitaciones disponibles en ese rango"}), 409
+        inventory.publish(conn, db_path())
+        invalidate_search(db_path(), get_catalog(conn, db_path()), [room_id for _, room_id, _, _ in allocated],
+                          start_day, end_day)
+
+        index = get_occupancy()
+        if index:
+            for _, room_id, _, _ in allocated:
+                index.mark(room_id, start_day, end_day, "PENDING_PAYMENT")
+        get_sweeper()
+
+        bookings = [{"booking_id": booking_id, "room_number": room_number, "total": total}
+                    for booking_id, _, room_number, total in allocated]
+        return jsonify({"bookings": bookings, "total": sum(b["total"] for b in bookings)}), 201
+    finally:
+        release_db(conn)
 
 @app.route("/pay", methods=["POST"])
+# Sólo lee la reserva: el cobro lo escribe el worker de pagos con el escritor del proceso
+@db_intent("read")
 def pay():
     booking_id = request.form.get("booking_id")
     conn = get_db()
     cur = conn.cursor()
     
     try:
-        cur.execute("INSERT INTO payments (booking_id, amount, status, created_at) VALUES (?,?,?,datetime('now'))",
-                    (booking_id, 0, "APPROVED"))
-        cur.execute("UPDATE bookings SET status = 'CONFIRMED' WHERE id = ?", (booking_id,))
-        conn.commit()
-        flash("Pago simulado aprobado. Reserva confirmada.", "success")
+        cur.execute("SELECT id, room_id, start_day, end_day FROM bookings WHERE id = ?", (booking_id,))
+        row = cur.fetchone()
+        if not row:
+            flash("Reserva no encontrada", "error")
+            return redirect(url_for("index"))
+    finally:
+        release_db(conn)
+
+    # El cobro lo confirma el worker de pagos en un commit agrupado; un segundo
+    # envío de la misma reserva se une al pago en curso o encuentra el ya hecho
+    future = payments.get_pipeline(db_path()).submit(row["id"])
+    try:
+        result = future.result(timeout=payments.PAYMENT_WAIT)
+    except TimeoutError:
+        flash("Pago en proceso. Consulta el estado de la reserva en unos segundos.", "info")
+        return redirect(url_for("index"))
+    except sqlite3.Error:
+        # El lote no llegó a confirmarse (base ocupada o bloqueada, integridad...): no hubo cobro
+        flash("El pago no se ha procesado. Inténtalo de nuevo.", "error")
         return redirect(url_for("index"))
+
+    if result == payments.NOT_PAYABLE:
+        flash("La reserva ha caducado o no admite pago", "error")
+        return redirect(url_for("index"))
+
+    index = get_occupancy()
+    if index:
+        index.mark(row["room_id"], row["start_day"], row["end_day"], "CONFIRMED")
+    if result == payments.ALREADY_PAID:
+        flash("Esta reserva ya estaba pagada. No se ha realizado un nuevo cobro.", "success")
+    else:
+        flash("Pago simulado aprobado. Reserva confirmada.", "success")
+    return redirect(url_for("index"))
+
+@app.route("/pay/status/<int:booking_id>")
+@db_intent("read")
+def pay_status(booking_id):
+    conn = get_db()
+    try:
+        row = conn.execute("""
+            SELECT b.status, p.status AS payment_status, p.amount, p.created_at
+            FROM bookings b
+            LEFT JOIN payments p ON p.booking_id = b.id
+            WHERE b.id = ?
+        """, (booking_id,)).fetchone()
     finally:
-        conn.close()
+        release_db(conn)
+    if row is None:
+        return jsonify({"error": "Reserva no encontrada"}), 404
+
+    payment = None
+    if row["payment_status"] is not None:
+        payment = {"status": row["payment_status"], "amount": row["amount"], "created_at": row["created_at"]}
+    return jsonify({"booking_id": booking_id, "status": row["status"], "payment": payment,
+                    "queued": payments.get_pipeline(db_path()).is_pending(booking_id)})
 
 if __name__ == "__main__":
+    init_db()
+    get_sweeper()
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,197 @@
+"""Punto de entrada ASGI para servir la app con un servidor asíncrono.
+
+    uvicorn asgi:application --app-dir app
+
+El bucle de eventos recibe el cuerpo de la petición y envía la respuesta sin
+ocupar hilos, así miles de clientes lentos o inactivos cuestan sólo una
+corrutina cada uno. Sólo el trabajo real (SQLite, hash de contraseñas, Jinja)
+pasa por un ThreadPoolExecutor acotado, reutilizando las mismas vistas,
+plantillas y validaciones de app.py (/search, /book, /pay y el resto).
+
+La respuesta se envía trozo a trozo (la búsqueda en streaming no se acumula
+en memoria): el bucle de eventos pide cada trozo al executor y lo envía él
+mismo, así un hilo sólo se ocupa mientras la vista produce, nunca esperando a
+un cliente que lee despacio, y no se pide el siguiente hasta enviar el
+anterior. El límite de admisión cubre la llamada a la vista, que es donde
+está el trabajo. El cuerpo de la petición se limita a HOTEL_ASGI_MAX_BODY
+bytes (413 por encima).
+"""
+import asyncio
+import contextvars
+import io
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from app import app as flask_app, get_sweeper
+from db import init_db
+
+ASGI_WORKERS = int(os.environ.get("HOTEL_ASGI_WORKERS", min(32, (os.cpu_count() or 1) + 4)))
+# Peticiones aceptadas a la espera de un hilo; por encima se responde 503
+ASGI_MAX_PENDING = int(os.environ.get("HOTEL_ASGI_MAX_PENDING", 1024))
+ASGI_MAX_BODY = int(os.environ.get("HOTEL_ASGI_MAX_BODY", 1024 * 1024))
+
+_executor = ThreadPoolExecutor(max_workers=ASGI_WORKERS, thread_name_prefix="hotel-asgi")
+_pending = None
+
+
+class BodyTooLarge(Exception):
+    pass
+
+
+def build_environ(scope, body):
+    """Traduce el scope HTTP de ASGI a un environ WSGI"""
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "REMOTE_ADDR": client[0],
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for raw_name, raw_value in scope.get("headers", []):
+        name = raw_name.decode("latin-1").upper().replace("-", "_")
+        value = raw_value.decode("latin-1")
+        if name == "CONTENT_TYPE":
+            key = "CONTENT_TYPE"
+        elif name == "CONTENT_LENGTH":
+            key = "CONTENT_LENGTH"
+        else:
+            key = f"HTTP_{name}"
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def call_flask(environ):
+    """Ejecuta la vista de Flask (en un hilo del executor): (status, headers, trozos ya escritos, iterable)"""
+    response = {"written": []}
+
+    def start_response(status, headers, exc_info=None):
+        response.update(status=int(status.split(" ", 1)[0]), headers=headers)
+        # write() de WSGI: sólo lo usan aplicaciones antiguas, se envía antes del iterable
+        return response["written"].append
+
+    iterable = flask_app.wsgi_app(environ, start_response)
+    return response["status"], response["headers"], response["written"], iterable
+
+
+_DONE = object()
+
+
+async def stream_response(send, loop, context, environ):
+    """Llama a la vista y envía su respuesta trozo a trozo; cada trozo se produce en el executor.
+
+    Todo corre en el mismo contextvars.Context (el contexto de petición de
+    Flask vive en él) aunque cada trozo lo genere un hilo distinto.
+    """
+    async with _pending:
+        status, headers, written, iterable = await loop.run_in_executor(_executor, context.run, call_flask,
+                                                                        environ)
+    try:
+        await send({"type": "http.response.start", "status": status, "headers": encode_headers(headers)})
+        for chunk in written:
+            if chunk:
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        chunks = iter(iterable)
+        while True:
+            chunk = await loop.run_in_executor(_executor, context.run, next, chunks, _DONE)
+            if chunk is _DONE:
+                break
+            if chunk:
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+    finally:
+        if hasattr(iterable, "close"):
+            # Libera lo que retenga el iterable (p. ej. la conexión de la búsqueda en streaming)
+            await loop.run_in_executor(_executor, context.run, iterable.close)
+
+
+async def read_body(receive, limit):
+    """Cuerpo completo de la petición, None si el cliente se fue; BodyTooLarge por encima de limit"""
+    body = []
+    size = 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > limit:
+            raise BodyTooLarge()
+        body.append(chunk)
+        if not message.get("more_body", False):
+            return b"".join(body)
+
+
+def declared_length(scope):
+    for name, value in scope.get("headers", []):
+        if name.lower() == b"content-length":
+            try:
+                return int(value)
+            except ValueError:
+                return None
+    return None
+
+
+def encode_headers(headers):
+    return [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers]
+
+
+async def send_response(send, status, headers, body):
+    await send({"type": "http.response.start", "status": status, "headers": encode_headers(headers)})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            # Igual que run_app.bat: esquema al día antes de atender peticiones
+            init_db()
+            get_sweeper()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            _executor.shutdown(wait=True)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    global _pending
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    try:
+        if (declared_length(scope) or 0) > ASGI_MAX_BODY:
+            raise BodyTooLarge()
+        body = await read_body(receive, ASGI_MAX_BODY)
+    except BodyTooLarge:
+        await send_response(send, 413, [("Content-Type", "text/plain; charset=utf-8")],
+                            "Petición demasiado grande".encode("utf-8"))
+        return
+    if body is None:
+        return
+
+    if _pending is None:
+        _pending = asyncio.Semaphore(ASGI_WORKERS + ASGI_MAX_PENDING)
+    if _pending.locked():
+        await send_response(send, 503, [("Content-Type", "text/plain; charset=utf-8"),
+                                        ("Retry-After", "1")], "Servidor ocupado".encode("utf-8"))
+        return
+
+    loop = asyncio.get_running_loop()
+    await stream_response(send, loop, contextvars.Context(), build_environ(scope, body))
@@ -0,0 +1,97 @@
+"""Disponibilidad por lotes: muchas consultas (tipo, rango) en una sola pasada."""
+from db import ACTIVE_BOOKING, day_number
+
+# Cada consulta usa 4 parámetros; SQLite admite 32766 variables por sentencia
+MAX_QUERIES = 500
+
+
+def parse_queries(payload):
+    """Normaliza el cuerpo JSON a una lista de (room_type, start_date, end_date, start_day, end_day).
+
+    Acepta {"queries": [...]} o directamente la lista; cada elemento puede ser
+    un objeto con room_type/start_date/end_date o una tupla de tres valores.
+    Lanza ValueError con un mensaje para el cliente si algo no es válido.
+    """
+    items = payload.get("queries") if isinstance(payload, dict) else payload
+    if not isinstance(items, list) or not items:
+        raise ValueError("Se requiere una lista de consultas")
+    if len(items) > MAX_QUERIES:
+        raise ValueError(f"Máximo {MAX_QUERIES} consultas por llamada")
+
+    queries = []
+    for position, item in enumerate(items):
+        if isinstance(item, dict):
+            room_type, start_date, end_date = (item.get("room_type"), item.get("start_date"),
+                                               item.get("end_date"))
+        elif isinstance(item, (list, tuple)) and len(item) == 3:
+            room_type, start_date, end_date = item
+        else:
+            raise ValueError(f"Consulta {position} inválida")
+        try:
+            start_day = day_number(start_date)
+            end_day = day_number(end_date)
+        except (TypeError, ValueError):
+            raise ValueError(f"Consulta {position}: fecha inválida")
+        if end_day <= start_day:
+            raise ValueError(f"Consulta {position}: rango de fechas inválido")
+        queries.append((room_type, start_date, end_date, start_day, end_day))
+    return queries
+
+
+def batch_from_sql(cur, queries):
+    """Una sola consulta SQL para todo el lote: room_ids libres por consulta"""
+    values = ",".join(["(?,?,?,?)"] * len(queries))
+    params = []
+    for position, (room_type, _, _, start_day, end_day) in enumerate(queries):
+        params.extend((position, room_type, start_day, end_day))
+
+    cur.execute(f"""
+        WITH q(pos, code, start_day, end_day) AS (VALUES {values})
+        SELECT q.pos, rooms.id
+        FROM q
+        JOIN room_types rt ON rt.code = q.code
+        JOIN rooms rooms ON rooms.room_type_id = rt.id
+        WHERE NOT EXISTS (
+            SELECT 1 FROM bookings b
+            WHERE b.room_id = rooms.id AND b.end_day > q.start_day AND b.start_day < q.end_day
+            AND {ACTIVE_BOOKING}
+        )
+    """, params)
+
+    free = [[] for _ in queries]
+    for position, room_id in cur:
+        free[position].append(room_id)
+    return free
+
+
+def batch_from_index(index, rooms_by_type, queries):
+    """Resuelve el lote con el índice de ocupación; None si algún rango no está cubierto"""
+    free = []
+    for room_type, _, _, start_day, end_day in queries:
+        room_ids = rooms_by_type.get(room_type, [])
+        if not index.covers(start_day, end_day, room_ids):
+            return None
+        mask = index.available(room_ids, start_day, end_day)
+        free.append([int(room_id) for room_id, is_free in zip(room_ids, mask) if is_free])
+    return free
+
+
+def batch_availability(cur, queries, catalog, index=None):
+    """Respuesta compacta: una entrada por consulta con las habitaciones libres"""
+    free = batch_from_index(index, catalog.rooms_by_type, queries) if index else None
+    if free is None:
+        free = batch_from_sql(cur, queries)
+
+    results = []
+    for (room_type, start_date, end_date, start_day, end_day), room_ids in zip(queries, free):
+        rooms = sorted(catalog.room_numbers[room_id] for room_id in room_ids)
+        price = catalog.types.get(room_type, {}).get("price")
+        results.append({
+            "room_type": room_type,
+            "start_date": start_date,
+            "end_date": end_date,
+            "available": rooms,
+            "price": price,
+            "total": price * (end_day - start_day) if price is not None else None,
+        })
+    return results
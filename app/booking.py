@@ -0,0 +1,151 @@
+"""Motor de reservas: comprobación de solapamiento e INSERT en una sola transacción.
+
+BEGIN IMMEDIATE toma el bloqueo de escritura de SQLite antes de leer, así dos
+peticiones (de cualquier proceso) no pueden pasar ambas la comprobación. Dentro
+del proceso las reservas ya llegan en fila por el escritor único
+(db.get_writer), que sustituyó a los antiguos locks por franja de room_id: con
+una sola conexión de escritura no podían avanzar en paralelo.
+"""
+import random
+import sqlite3
+import time
+
+from db import ACTIVE_BOOKING, HOLD_SECONDS
+
+MAX_RETRIES = 5
+RETRY_DELAY = 0.02      # segundos; se duplica en cada reintento
+
+
+def is_busy(error):
+    """True si el error es SQLITE_BUSY/SQLITE_LOCKED (vale la pena reintentar)"""
+    return getattr(error, "sqlite_errorcode", None) in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED) \
+        or "locked" in str(error)
+
+
+def with_retry(conn, work):
+    """Ejecuta work(conn) dentro de BEGIN IMMEDIATE ... COMMIT con reintentos acotados.
+
+    Un SQLITE_BUSY/LOCKED en cualquier punto (BEGIN, dentro de work o en el
+    COMMIT) deshace la transacción y la repite entera; work debe poder
+    ejecutarse de nuevo desde cero.
+    """
+    for attempt in range(MAX_RETRIES):
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            result = work(conn)
+            conn.commit()
+            return result
+        except sqlite3.OperationalError as e:
+            if conn.in_transaction:
+                conn.rollback()
+            if not is_busy(e) or attempt == MAX_RETRIES - 1:
+                raise
+        except BaseException:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        time.sleep(RETRY_DELAY * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+
+def has_conflict(conn, room_id, start_day, end_day):
+    row = conn.execute(f"""
+        SELECT 1 FROM bookings b
+        WHERE b.room_id = ? AND b.end_day > ? AND b.start_day < ? AND {ACTIVE_BOOKING}
+        LIMIT 1
+    """, (room_id, start_day, end_day)).fetchone()
+    return row is not None
+
+
+def reserve(conn, user_id, room_id, start_date, end_date, start_day, end_day, total):
+    """Crea una reserva PENDING_PAYMENT que retiene la habitación HOLD_SECONDS.
+
+    Devuelve su id, o None si la habitación está ocupada.
+    """
+
+    def work(conn):
+        if has_conflict(conn, room_id, start_day, end_day):
+            return None
+        cur = conn.execute("""
+            INSERT INTO bookings (user_id, room_id, start_date, end_date, start_day, end_day, total_price, status,
+                                  hold_expires_at)
+            VALUES (?,?,?,?,?,?,?,?,?)
+        """, (user_id, room_id, start_date, end_date, start_day, end_day, total, "PENDING_PAYMENT",
+              int(time.time()) + HOLD_SECONDS))
+        return cur.lastrowid
+
+    return with_retry(conn, work)
+
+
+MAX_GROUP_SIZE = 500
+
+
+def reserve_many(conn, user_id, start_date, end_date, start_day, end_day,
+                 room_type=None, quantity=None, room_ids=None):
+    """Reserva de grupo todo-o-nada; devuelve [(booking_id, room_id, room_number, total)] o None.
+
+    Con room_ids reserva exactamente esas habitaciones; con room_type/quantity
+    asigna las primeras libres por número. Precios, comprobación e INSERT
+    (executemany) van en la misma transacción BEGIN IMMEDIATE.
+    """
+    nights = end_day - start_day
+    if room_ids is not None:
+        # JSON true/false son int para isinstance: no valen como habitación ni como cantidad
+        if isinstance(room_ids, str) or any(isinstance(room_id, bool) for room_id in room_ids):
+            raise ValueError("Habitación inválida")
+        room_ids = sorted({int(room_id) for room_id in room_ids})
+        if not 0 < len(room_ids) <= MAX_GROUP_SIZE:
+            raise ValueError("Cantidad de habitaciones inválida")
+    elif not room_type or type(quantity) is not int or not 0 < quantity <= MAX_GROUP_SIZE:
+        raise ValueError("Se requiere room_type y una cantidad válida")
+
+    def allocate(conn):
+        if room_ids is not None:
+            placeholders = ",".join("?" * len(room_ids))
+            rooms = conn.execute(f"""
+                SELECT r.id, r.room_number, rt.price
+                FROM rooms r JOIN room_types rt ON r.room_type_id = rt.id
+                WHERE r.id IN ({placeholders})
+            """, room_ids).fetchall()
+            if len(rooms) != len(room_ids):
+                raise ValueError("Habitación no encontrada")
+            busy = conn.execute(f"""
+                SELECT 1 FROM bookings b
+                WHERE b.room_id IN ({placeholders}) AND b.end_day > ? AND b.start_day < ? AND {ACTIVE_BOOKING}
+                LIMIT 1
+            """, room_ids + [start_day, end_day]).fetchone()
+            if busy:
+                return None
+        else:
+            rooms = conn.execute(f"""
+                SELECT r.id, r.room_number, rt.price
+                FROM rooms r JOIN room_types rt ON r.room_type_id = rt.id
+                WHERE rt.code = ?
+                AND NOT EXISTS (
+                    SELECT 1 FROM bookings b
+                    WHERE b.room_id = r.id AND b.end_day > ? AND b.start_day < ? AND {ACTIVE_BOOKING}
+                )
+                ORDER BY r.room_number
+                LIMIT ?
+            """, (room_type, start_day, end_day, quantity)).fetchall()
+            if len(rooms) < quantity:
+                return None
+
+        expires = int(time.time()) + HOLD_SECONDS
+        conn.executemany("""
+            INSERT INTO bookings (user_id, room_id, start_date, end_date, start_day, end_day, total_price, status,
+                                  hold_expires_at)
+            VALUES (?,?,?,?,?,?,?,?,?)
+        """, [(user_id, room[0], start_date, end_date, start_day, end_day, room[2] * nights, "PENDING_PAYMENT",
+               expires) for room in rooms])
+
+        # Sin solapamientos vigentes, la fila nueva es la de mayor id por habitación
+        # (puede quedar una retención caducada del mismo usuario y rango)
+        placeholders = ",".join("?" * len(rooms))
+        ids = dict(conn.execute(f"""
+            SELECT room_id, id FROM bookings
+            WHERE user_id = ? AND start_day = ? AND end_day = ? AND room_id IN ({placeholders})
+            ORDER BY id
+        """, [user_id, start_day, end_day] + [room[0] for room in rooms]).fetchall())
+        return [(ids[room[0]], room[0], room[1], room[2] * nights) for room in rooms]
+
+    return with_retry(conn, allocate)
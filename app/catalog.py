@@ -0,0 +1,84 @@
+"""Caché en proceso del catálogo (rooms + room_types).
+
+El catálogo cambia muy de vez en cuando, así que se carga una vez en tablas
+compactas y se valida en cada uso contra meta.catalog_version, que los
+triggers de init_db incrementan ante cualquier cambio en rooms o room_types.
+Así una edición hecha desde cualquier proceso llega a todos los workers.
+"""
+import threading
+
+import numpy as np
+
+import db
+
+
+class Catalog:
+    """Tablas de consulta indexadas por room_id y por código de tipo"""
+
+    def __init__(self, version, room_types, rooms):
+        self.version = version
+        # code -> {"id", "code", "name", "price"}
+        self.types = {row["code"]: dict(row) for row in room_types}
+        type_by_id = self.type_codes = {row["id"]: row["code"] for row in room_types}
+
+        size = max([row["id"] for row in rooms], default=0) + 1
+        self.room_type_ids = np.full(size, -1, dtype=np.int32)
+        self.prices = np.zeros(size, dtype=np.float64)
+        self.room_numbers = [None] * size
+        by_type = {code: [] for code in self.types}
+        for row in rooms:
+            room_id = row["id"]
+            code = type_by_id[row["room_type_id"]]
+            self.room_type_ids[room_id] = row["room_type_id"]
+            self.prices[room_id] = self.types[code]["price"]
+            self.room_numbers[room_id] = row["room_number"]
+            by_type[code].append(room_id)
+        # Ordenadas por room_number, igual que los listados de búsqueda
+        self.rooms_by_type = {code: np.array(ids, dtype=np.int64) for code, ids in by_type.items()}
+        self.numbers_by_type = {code: [self.room_numbers[i] for i in ids] for code, ids in by_type.items()}
+
+    def has_room(self, room_id):
+        return 0 <= room_id < len(self.room_type_ids) and self.room_type_ids[room_id] >= 0
+
+    def price(self, room_id):
+        """Precio por noche de una habitación, o None si no existe"""
+        return float(self.prices[room_id]) if self.has_room(room_id) else None
+
+    def type_code(self, room_id):
+        """Código del tipo de una habitación, o None si no existe"""
+        return self.type_codes[int(self.room_type_ids[room_id])] if self.has_room(room_id) else None
+
+    def room(self, room_id, code):
+        """Fila equivalente a la del join rooms/room_types usada por las plantillas"""
+        room_type = self.types[code]
+        return {"room_id": room_id, "room_number": self.room_numbers[room_id],
+                "room_type_name": room_type["name"], "price": room_type["price"]}
+
+
+def current_version(conn):
+    row = conn.execute("SELECT value FROM meta WHERE key = 'catalog_version'").fetchone()
+    return row[0] if row else 0
+
+
+def load(conn):
+    version = current_version(conn)
+    room_types = conn.execute("SELECT id, code, name, price FROM room_types").fetchall()
+    rooms = conn.execute("SELECT id, room_number, room_type_id FROM rooms ORDER BY room_number").fetchall()
+    return Catalog(version, room_types, rooms)
+
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+def get_catalog(conn, db_path=db.DB_PATH):
+    """Catálogo vigente: una lectura de meta por llamada, recarga sólo si cambió"""
+    key = str(db_path)
+    version = current_version(conn)
+    catalog = _catalogs.get(key)
+    if catalog is None or catalog.version != version:
+        with _catalogs_lock:
+            catalog = _catalogs.get(key)
+            if catalog is None or catalog.version != version:
+                catalog = _catalogs[key] = load(conn)
+    return catalog
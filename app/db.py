@@ -1,36 +1,370 @@
-import sqlite3, os, pathlib
+import sqlite3, os, pathlib, queue, sys, threading, time
+from contextlib import contextmanager
+from datetime import date
 
 BASE = pathlib.Path(__file__).resolve().parent.parent
 DB_PATH = BASE / "hotel_reservas.db"
 
-def connect():
-    conn = sqlite3.connect(str(DB_PATH), check_same_thread=False)
+# julianday('0001-01-01') - 1 == 1721424.5; restarlo da el mismo número que date.toordinal()
+ORDINAL_OFFSET = 1721424.5
+
+def day_number(value):
+    """Convierte una fecha 'YYYY-MM-DD' (o date) en número de día entero comparable"""
+    if isinstance(value, date):
+        return value.toordinal()
+    return date.fromisoformat(value).toordinal()
+
+# Se aplican una vez por conexión; WAL permite leer mientras otro proceso escribe
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA cache_size = -20000",
+)
+STATEMENT_CACHE = 256   # sentencias preparadas que sqlite3 guarda por conexión
+POOL_SIZE = 16          # conexiones libres que se conservan por base de datos
+# Segundos que una reserva PENDING_PAYMENT retiene la habitación sin pagar
+HOLD_SECONDS = int(os.environ.get("HOTEL_HOLD_SECONDS", 15 * 60))
+
+# Epoch actual en segundos dentro de SQL; unixepoch() exige SQLite 3.38 y esto funciona en cualquiera
+NOW_EPOCH = "CAST(strftime('%s', 'now') AS INTEGER)"
+
+# Reserva (alias b) que bloquea la habitación: confirmada o retención vigente.
+# Una retención caducada deja de contar aunque el barrido aún no la haya liberado.
+ACTIVE_BOOKING = ("(b.status = 'CONFIRMED' OR (b.status = 'PENDING_PAYMENT' "
+                  f"AND (b.hold_expires_at IS NULL OR b.hold_expires_at > {NOW_EPOCH})))")
+
+# Las conexiones de sólo lectura no pueden cambiar journal_mode ni synchronous
+READONLY_PRAGMAS = tuple(p for p in PRAGMAS if "journal_mode" not in p and "synchronous" not in p) \
+    + ("PRAGMA query_only = ON",)
+
+# Funciones observer(conn, sql, parameters, seconds) avisadas de cada sentencia (ver metrics.py).
+# seconds es el tiempo dentro de SQLite: execute más la lectura de filas hasta
+# agotar el cursor (o cerrarlo, reutilizarlo o descartarlo)
+_observers = []
+
+def add_statement_observer(observer):
+    if observer not in _observers:
+        _observers.append(observer)
+
+def _notify(conn, sql, parameters, seconds):
+    for observer in _observers:
+        observer(conn, sql, parameters, seconds)
+
+class Cursor(sqlite3.Cursor):
+    # [sql, parameters, segundos acumulados] de la sentencia con filas por leer
+    _pending = None
+
+    def execute(self, sql, parameters=()):
+        if self._pending is not None:
+            self._flush()
+        if not _observers:
+            return super().execute(sql, parameters)
+        started = time.perf_counter()
+        try:
+            super().execute(sql, parameters)
+        except BaseException:
+            _notify(self.connection, sql, parameters, time.perf_counter() - started)
+            raise
+        seconds = time.perf_counter() - started
+        if self.description is None:
+            # Sin filas que leer (INSERT, UPDATE, PRAGMA de escritura...)
+            _notify(self.connection, sql, parameters, seconds)
+        else:
+            self._pending = [sql, parameters, seconds]
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        if self._pending is not None:
+            self._flush()
+        if not _observers:
+            return super().executemany(sql, seq_of_parameters)
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            # Los parámetros pueden ser un generador ya consumido: no se pasan
+            _notify(self.connection, sql, None, time.perf_counter() - started)
+
+    def __next__(self):
+        pending = self._pending
+        if pending is None:
+            return super().__next__()
+        started = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            pending[2] += time.perf_counter() - started
+            self._flush()
+            raise
+        pending[2] += time.perf_counter() - started
+        return row
+
+    def fetchone(self):
+        pending = self._pending
+        if pending is None:
+            return super().fetchone()
+        started = time.perf_counter()
+        row = super().fetchone()
+        pending[2] += time.perf_counter() - started
+        if row is None:
+            self._flush()
+        return row
+
+    def fetchmany(self, size=None):
+        pending = self._pending
+        size = self.arraysize if size is None else size
+        if pending is None:
+            return super().fetchmany(size)
+        started = time.perf_counter()
+        rows = super().fetchmany(size)
+        pending[2] += time.perf_counter() - started
+        if len(rows) < size:
+            self._flush()
+        return rows
+
+    def fetchall(self):
+        pending = self._pending
+        if pending is None:
+            return super().fetchall()
+        started = time.perf_counter()
+        rows = super().fetchall()
+        pending[2] += time.perf_counter() - started
+        self._flush()
+        return rows
+
+    def close(self):
+        if self._pending is not None:
+            self._flush()
+        super().close()
+
+    def __del__(self):
+        # conn.execute(...).fetchone() suelta el cursor sin agotarlo
+        if self._pending is not None:
+            try:
+                self._flush()
+            except Exception:
+                pass
+
+    def _flush(self):
+        sql, parameters, seconds = self._pending
+        self._pending = None
+        _notify(self.connection, sql, parameters, seconds)
+
+class Connection(sqlite3.Connection):
+    """Conexión cuyas sentencias (execute y lectura de filas) se miden si hay observadores registrados"""
+
+    def cursor(self, factory=Cursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+def connect(path=DB_PATH, readonly=False):
+    """Conexión configurada; readonly=True abre con mode=ro (lecturas de una instantánea WAL)"""
+    if readonly:
+        target, pragmas = pathlib.Path(path).resolve().as_uri() + "?mode=ro", READONLY_PRAGMAS
+    else:
+        target, pragmas = str(path), PRAGMAS
+    conn = sqlite3.connect(target, check_same_thread=False, timeout=5.0,
+                           cached_statements=STATEMENT_CACHE, uri=readonly, factory=Connection)
     conn.row_factory = sqlite3.Row
+    for pragma in pragmas:
+        conn.execute(pragma)
     return conn
 
-def init_db():
-    conn = connect()
-    cur = conn.cursor()
+class ConnectionPool:
+    """Conexiones ya configuradas que se reutilizan entre peticiones.
+
+    Cada hilo toma una conexión libre (o crea una) y la devuelve al terminar,
+    así en régimen estable hay una conexión por hilo worker y no se paga la
+    apertura del fichero ni el parseo del esquema en cada petición.
+    """
+
+    def __init__(self, path=DB_PATH, size=POOL_SIZE, readonly=False):
+        self.path = path
+        self.size = size
+        self.readonly = readonly
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._stats = {"created": 0, "reused": 0, "released": 0, "discarded": 0, "in_use": 0}
+
+    def _count(self, key, delta=1):
+        with self._lock:
+            self._stats[key] += delta
+
+    def acquire(self):
+        try:
+            conn = self._idle.get_nowait()
+            self._count("reused")
+        except queue.Empty:
+            conn = connect(self.path, readonly=self.readonly)
+            self._count("created")
+        self._count("in_use")
+        return conn
+
+    def release(self, conn):
+        self._count("in_use", -1)
+        if conn.in_transaction:
+            conn.rollback()
+        if self._idle.qsize() < self.size:
+            self._idle.put(conn)
+            self._count("released")
+        else:
+            conn.close()
+            self._count("discarded")
+
+    def close_all(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["idle"] = self._idle.qsize()
+        return stats
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool(path=DB_PATH, readonly=False):
+    """Pool compartido del proceso para una base de datos (de lectura o de lectura/escritura)"""
+    key = (str(path), readonly)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(path, readonly=readonly)
+        return pool
+
+class Writer:
+    """Única conexión de escritura del proceso para una base de datos.
+
+    Las escrituras del proceso se ponen en fila en este lock en vez de pelear
+    por el bloqueo de SQLite desde muchas conexiones; las lecturas van por el
+    pool de sólo lectura y nunca lo esperan. Reentrante: un hilo que ya tiene
+    el escritor puede volver a pedirlo.
+    """
+
+    def __init__(self, path=DB_PATH):
+        self.path = path
+        self._conn = None
+        self._lock = threading.RLock()
+        self._depth = 0     # sólo lo toca el hilo que tiene el lock
+        self._stats_lock = threading.Lock()
+        self._stats = {"acquired": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0}
+
+    def acquire(self):
+        started = time.perf_counter()
+        self._lock.acquire()
+        waited = time.perf_counter() - started
+        with self._stats_lock:
+            self._stats["acquired"] += 1
+            self._stats["wait_seconds"] += waited
+            self._stats["max_wait_seconds"] = max(self._stats["max_wait_seconds"], waited)
+        try:
+            if self._conn is None:
+                self._conn = connect(self.path)
+        except BaseException:
+            self._lock.release()
+            raise
+        self._depth += 1
+        return self._conn
+
+    def release(self, conn):
+        self._depth -= 1
+        try:
+            # Sólo la salida más externa deshace lo que quedara sin confirmar
+            if self._depth == 0 and conn.in_transaction:
+                conn.rollback()
+        finally:
+            self._lock.release()
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def owns(self, conn):
+        return conn is not None and conn is self._conn
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
 
-    cur.executescript("""
-    PRAGMA foreign_keys = ON;
+    def stats(self):
+        with self._stats_lock:
+            return dict(self._stats)
+
+_writers = {}
+
+def open_databases():
+    """Pools y escritores abiertos en el proceso: ([ConnectionPool], [Writer])"""
+    with _pools_lock:
+        return list(_pools.values()), list(_writers.values())
+
+def get_writer(path=DB_PATH):
+    """Escritor del proceso para una base de datos"""
+    key = str(path)
+    with _pools_lock:
+        writer = _writers.get(key)
+        if writer is None:
+            writer = _writers[key] = Writer(path)
+        return writer
+
+def forget(path):
+    """Cierra y olvida los pools y el escritor de una base (p. ej. al borrar un shard)"""
+    with _pools_lock:
+        pools = [_pools.pop((str(path), readonly), None) for readonly in (False, True)]
+        writer = _writers.pop(str(path), None)
+    for pool in pools:
+        if pool is not None:
+            pool.close_all()
+    if writer is not None:
+        writer.close()
+
+ROOM_TYPES = (
+    (1, "simple", "Simple", 80.0),
+    (2, "doble", "Doble", 120.0),
+    (3, "suite", "Suite", 220.0),
+)
+ROOMS = tuple((f"{i}", 1 if i < 105 else (2 if i < 108 else 3)) for i in range(101, 111))
+
+def create_schema(cur):
+    """Tablas base y datos iniciales (sólo al crear la base)"""
+    cur.execute("""
     CREATE TABLE IF NOT EXISTS users (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         username TEXT UNIQUE NOT NULL,
         password_hash TEXT NOT NULL
-    );
+    )""")
+    cur.execute("""
     CREATE TABLE IF NOT EXISTS room_types (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         code TEXT UNIQUE NOT NULL,
         name TEXT NOT NULL,
         price REAL NOT NULL
-    );
+    )""")
+    cur.execute("""
     CREATE TABLE IF NOT EXISTS rooms (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         room_number TEXT UNIQUE NOT NULL,
         room_type_id INTEGER NOT NULL,
         FOREIGN KEY (room_type_id) REFERENCES room_types(id) ON DELETE CASCADE
-    );
+    )""")
+    cur.execute("""
     CREATE TABLE IF NOT EXISTS bookings (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         user_id INTEGER NOT NULL,
@@ -39,9 +373,13 @@ def init_db():
         end_date TEXT NOT NULL,
         total_price REAL NOT NULL,
         status TEXT NOT NULL,
+        start_day INTEGER NOT NULL DEFAULT 0,
+        end_day INTEGER NOT NULL DEFAULT 0,
+        hold_expires_at INTEGER,
         FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
         FOREIGN KEY (room_id) REFERENCES rooms(id) ON DELETE CASCADE
-    );
+    )""")
+    cur.execute("""
     CREATE TABLE IF NOT EXISTS payments (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         booking_id INTEGER NOT NULL,
@@ -49,19 +387,272 @@ def init_db():
         status TEXT NOT NULL,
         created_at TEXT NOT NULL,
         FOREIGN KEY (booking_id) REFERENCES bookings(id) ON DELETE CASCADE
-    );
+    )""")
+    cur.executemany("INSERT OR IGNORE INTO room_types (id, code, name, price) VALUES (?,?,?,?)", ROOM_TYPES)
+    cur.executemany("INSERT OR IGNORE INTO rooms (room_number, room_type_id) VALUES (?,?)", ROOMS)
+
+def migrate_booking_days(cur):
+    """Añade start_day/end_day a bases antiguas y crea los índices de solapamiento.
+
+    Las consultas de disponibilidad comparan enteros en lugar de date(...), lo que
+    permite a SQLite buscar por índice en vez de recorrer toda la tabla.
+    """
+    cur.execute("PRAGMA table_info(bookings)")
+    columns = {row[1] for row in cur.fetchall()}
+    if "start_day" not in columns or "end_day" not in columns:
+        if "start_day" not in columns:
+            cur.execute("ALTER TABLE bookings ADD COLUMN start_day INTEGER NOT NULL DEFAULT 0")
+        if "end_day" not in columns:
+            cur.execute("ALTER TABLE bookings ADD COLUMN end_day INTEGER NOT NULL DEFAULT 0")
+
+        # Rellenar las reservas existentes a partir de las fechas en texto
+        cur.execute(f"""
+            UPDATE bookings
+            SET start_day = CAST(julianday(start_date) - {ORDINAL_OFFSET} AS INTEGER),
+                end_day = CAST(julianday(end_date) - {ORDINAL_OFFSET} AS INTEGER)
+        """)
+
+    # end_day primero: las reservas históricas (end_day <= inicio buscado) quedan
+    # fuera del rango del índice, así el coste no crece con el historial.
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_bookings_room_days
+        ON bookings (room_id, end_day, start_day)
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_bookings_status_end
+        ON bookings (status, end_day, start_day, room_id)
     """)
 
-    cur.execute("INSERT OR IGNORE INTO room_types (id, code, name, price) VALUES (1,'simple','Simple', 80.0)")
-    cur.execute("INSERT OR IGNORE INTO room_types (id, code, name, price) VALUES (2,'doble','Doble', 120.0)")
-    cur.execute("INSERT OR IGNORE INTO room_types (id, code, name, price) VALUES (3,'suite','Suite', 220.0)")
+def migrate_catalog_version(cur):
+    """Tabla meta con catalog_version y triggers que la incrementan.
+
+    Cualquier INSERT/UPDATE/DELETE sobre rooms o room_types (desde la app o a
+    mano) cambia la versión, y catalog.get_catalog() recarga su caché.
+    """
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        )
+    """)
+    cur.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('catalog_version', 1)")
+    for table in ("rooms", "room_types"):
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            cur.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_{event.lower()}_catalog
+                AFTER {event} ON {table}
+                BEGIN
+                    UPDATE meta SET value = value + 1 WHERE key = 'catalog_version';
+                END
+            """)
+
+def migrate_inventory_version(cur):
+    """meta.inventory_version: la incrementa cualquier cambio en bookings.
+
+    Las páginas de disponibilidad la usan como validador HTTP (ver inventory.py).
+    """
+    cur.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('inventory_version', 1)")
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        cur.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_bookings_{event.lower()}_inventory
+            AFTER {event} ON bookings
+            BEGIN
+                UPDATE meta SET value = value + 1 WHERE key = 'inventory_version';
+            END
+        """)
+
+def migrate_payment_idempotency(cur):
+    """Un único pago por reserva: índice único sobre payments(booking_id).
+
+    Las bases creadas antes de este índice pueden tener pagos duplicados por
+    doble envío del formulario. Se conserva el primero de cada reserva y los
+    demás no se borran: pasan a payments_duplicates (con la fecha del traslado)
+    para que contabilidad los revise, y se avisa por stderr de las reservas afectadas.
+    """
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS payments_duplicates (
+        payment_id INTEGER PRIMARY KEY,
+        booking_id INTEGER NOT NULL,
+        amount REAL NOT NULL,
+        status TEXT NOT NULL,
+        created_at TEXT NOT NULL,
+        moved_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )""")
+    duplicates = "SELECT id FROM payments WHERE id NOT IN (SELECT MIN(id) FROM payments GROUP BY booking_id)"
+    cur.execute(f"""
+        INSERT INTO payments_duplicates (payment_id, booking_id, amount, status, created_at)
+        SELECT id, booking_id, amount, status, created_at FROM payments WHERE id IN ({duplicates})
+    """)
+    moved = cur.rowcount
+    if moved > 0:
+        cur.execute(f"SELECT DISTINCT booking_id FROM payments WHERE id IN ({duplicates}) ORDER BY booking_id")
+        booking_ids = ", ".join(str(row[0]) for row in cur.fetchall())
+        print(f"Aviso: {moved} pagos duplicados movidos a payments_duplicates (reservas {booking_ids})",
+              file=sys.stderr)
+        cur.execute(f"DELETE FROM payments WHERE id IN ({duplicates})")
+    cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_payments_booking ON payments (booking_id)")
+
+def migrate_hold_expiry(cur):
+    """Columna hold_expires_at (epoch en segundos) e índice parcial de retenciones.
+
+    Las retenciones ya existentes reciben el plazo completo desde ahora. El
+    índice sólo contiene filas PENDING_PAYMENT, así el barrido no recorre el
+    histórico de reservas confirmadas.
+    """
+    cur.execute("PRAGMA table_info(bookings)")
+    columns = {row[1] for row in cur.fetchall()}
+    if "hold_expires_at" not in columns:
+        cur.execute("ALTER TABLE bookings ADD COLUMN hold_expires_at INTEGER")
+        cur.execute(f"""
+            UPDATE bookings SET hold_expires_at = {NOW_EPOCH} + ?
+            WHERE status = 'PENDING_PAYMENT' AND hold_expires_at IS NULL
+        """, (HOLD_SECONDS,))
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_bookings_hold_expiry
+        ON bookings (hold_expires_at) WHERE status = 'PENDING_PAYMENT'
+    """)
+
+def migrate_properties(cur):
+    """Tabla properties del directorio: código de hotel -> fichero de su shard.
+
+    db_file NULL significa que el hotel vive en la propia base del directorio
+    (la propiedad "central", con los datos anteriores a la división).
+    """
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS properties (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            code TEXT UNIQUE NOT NULL,
+            name TEXT NOT NULL,
+            city TEXT,
+            db_file TEXT
+        )
+    """)
+    cur.execute("INSERT OR IGNORE INTO properties (id, code, name) VALUES (1, 'central', 'Hotel Central')")
+
+# Filas de inventory_changes que se conservan; un proceso que se quede más atrás vacía su caché
+INVENTORY_CHANGES_KEPT = 4096
+# Estados que ocupan la habitación (ACTIVE_BOOKING añade la caducidad de la retención)
+BLOCKING_STATUSES = "('PENDING_PAYMENT', 'CONFIRMED')"
+
+def migrate_inventory_changes(cur):
+    """Tabla inventory_changes: habitación y tramo de cada cambio de disponibilidad en bookings.
+
+    La llenan triggers, así que también recoge lo que se edite a mano. Cuando
+    cambia la versión de inventario publicada, cada proceso lee las filas nuevas
+    y expulsa de su caché de búsqueda sólo las entradas de ese tipo y rango
+    (search_cache.SearchCache.sync). Pagar una retención no cambia la
+    disponibilidad y no se anota.
+    """
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS inventory_changes (
+            id INTEGER PRIMARY KEY,
+            room_id INTEGER NOT NULL,
+            start_day INTEGER NOT NULL,
+            end_day INTEGER NOT NULL
+        )
+    """)
+    prune = ("DELETE FROM inventory_changes "
+             f"WHERE id <= (SELECT MAX(id) FROM inventory_changes) - {INVENTORY_CHANGES_KEPT};")
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_bookings_insert_changes
+        AFTER INSERT ON bookings WHEN NEW.status IN {BLOCKING_STATUSES}
+        BEGIN
+            INSERT INTO inventory_changes (room_id, start_day, end_day)
+            VALUES (NEW.room_id, NEW.start_day, NEW.end_day);
+            {prune}
+        END
+    """)
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_bookings_delete_changes
+        AFTER DELETE ON bookings WHEN OLD.status IN {BLOCKING_STATUSES}
+        BEGIN
+            INSERT INTO inventory_changes (room_id, start_day, end_day)
+            VALUES (OLD.room_id, OLD.start_day, OLD.end_day);
+            {prune}
+        END
+    """)
+    moved = "NEW.room_id IS NOT OLD.room_id OR NEW.start_day IS NOT OLD.start_day OR NEW.end_day IS NOT OLD.end_day"
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_bookings_update_changes
+        AFTER UPDATE ON bookings
+        WHEN {moved} OR NEW.hold_expires_at IS NOT OLD.hold_expires_at
+            OR (NEW.status IN {BLOCKING_STATUSES}) IS NOT (OLD.status IN {BLOCKING_STATUSES})
+        BEGIN
+            INSERT INTO inventory_changes (room_id, start_day, end_day)
+            VALUES (OLD.room_id, OLD.start_day, OLD.end_day);
+            INSERT INTO inventory_changes (room_id, start_day, end_day)
+            SELECT NEW.room_id, NEW.start_day, NEW.end_day WHERE {moved};
+            {prune}
+        END
+    """)
+
+def shard_path(directory, db_file):
+    """Ruta de un shard; db_file es relativo a la carpeta del directorio"""
+    directory = pathlib.Path(directory)
+    return directory if db_file is None else directory.parent / db_file
+
+# Migraciones en orden: (user_version que dejan, función, sólo en el directorio).
+# Todas son idempotentes: las bases anteriores al versionado (user_version 0)
+# pasan por todas sin perder nada. Añadir siempre al final.
+MIGRATIONS = (
+    (1, create_schema, False),
+    (2, migrate_booking_days, False),
+    (3, migrate_catalog_version, False),
+    (4, migrate_inventory_version, False),
+    (5, migrate_payment_idempotency, False),
+    (6, migrate_hold_expiry, False),
+    (7, migrate_properties, True),
+    (8, migrate_inventory_changes, False),
+)
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def migrate(conn, directory=True):
+    """Aplica las migraciones pendientes en una sola transacción; devuelve las versiones aplicadas"""
+    if schema_version(conn) >= SCHEMA_VERSION:
+        return []
+    cur = conn.cursor()
+    # BEGIN IMMEDIATE: si dos procesos arrancan a la vez, el segundo espera y ve la versión nueva
+    cur.execute("BEGIN IMMEDIATE")
+    try:
+        current = schema_version(conn)
+        applied = []
+        for version, migration, directory_only in MIGRATIONS:
+            if version > current:
+                if directory or not directory_only:
+                    migration(cur)
+                applied.append(version)
+        if applied:
+            cur.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return applied
+
+def init_db(path=DB_PATH, directory=True):
+    """Crea o actualiza el esquema de path.
 
-    for i in range(101, 111):
-        cur.execute("INSERT OR IGNORE INTO rooms (room_number, room_type_id) VALUES (?,?)",
-                    (f"{i}", 1 if i < 105 else (2 if i < 108 else 3)))
+    Si PRAGMA user_version ya es SCHEMA_VERSION no ejecuta ningún DDL; si no,
+    aplica sólo las migraciones que faltan. Con directory=True la base es
+    además el directorio de propiedades y se inicializan también los shards
+    registrados en ella.
+    """
+    conn = connect(path)
+    try:
+        migrate(conn, directory)
+        shards = []
+        if directory:
+            shards = [row[0] for row in conn.execute("SELECT db_file FROM properties WHERE db_file IS NOT NULL")]
+    finally:
+        conn.close()
 
-    conn.commit()
-    conn.close()
+    for db_file in shards:
+        shard = shard_path(path, db_file)
+        shard.parent.mkdir(parents=True, exist_ok=True)
+        init_db(shard, directory=False)
 
 if __name__ == "__main__":
     init_db()
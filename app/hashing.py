@@ -0,0 +1,122 @@
+"""Servicio de hash de contraseñas fuera de los hilos de petición.
+
+generate_password_hash/check_password_hash son CPU puro y retienen el GIL;
+en un pico de logins dejarían sin CPU a /search. Aquí se ejecutan en un pool
+de procesos con un número acotado de trabajos en curso: si está lleno se
+rechaza al momento (HashingBusy) en lugar de encolar sin límite. Un trabajo
+ocupa su hueco hasta que el proceso termina, aunque quien lo pidió ya se haya
+cansado de esperar.
+
+Configuración por variables de entorno:
+    HOTEL_HASH_WORKERS      procesos del pool (0 = en el propio hilo)
+    HOTEL_HASH_QUEUE_LIMIT  trabajos que pueden esperar además de los activos
+    HOTEL_HASH_METHOD       método y factor de trabajo de werkzeug
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+HASH_WORKERS = int(os.environ.get("HOTEL_HASH_WORKERS", os.cpu_count() or 1))
+HASH_QUEUE_LIMIT = int(os.environ.get("HOTEL_HASH_QUEUE_LIMIT", HASH_WORKERS * 4))
+HASH_METHOD = os.environ.get("HOTEL_HASH_METHOD", "scrypt:32768:8:1")
+HASH_TIMEOUT = 30
+
+
+class HashingBusy(Exception):
+    """El pool de hash está saturado; el cliente debe reintentar"""
+
+
+class HashingService:
+    def __init__(self, workers=HASH_WORKERS, queue_limit=HASH_QUEUE_LIMIT, method=HASH_METHOD):
+        self.workers = workers
+        self.method = method
+        self._prefix = None     # method con todos los parámetros, tal como lo escribe werkzeug
+        self._slots = threading.BoundedSemaphore(max(workers, 1) + queue_limit)
+        self._executor = None
+        self._lock = threading.Lock()
+        self._stats = {"hashed": 0, "verified": 0, "rejected": 0, "rehashed": 0}
+
+    def _pool(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    # spawn: hacer fork de un servidor con hilos puede heredar locks tomados
+                    context = multiprocessing.get_context("spawn")
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+        return self._executor
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            self._count("rejected")
+            raise HashingBusy()
+        if self.workers == 0:
+            try:
+                return fn(*args)
+            finally:
+                self._slots.release()
+        try:
+            future = self._pool().submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        # El hueco se libera cuando el trabajo acaba de verdad, no al agotar HASH_TIMEOUT
+        future.add_done_callback(lambda _: self._slots.release())
+        return future.result(timeout=HASH_TIMEOUT)
+
+    def hash(self, password):
+        result = self._run(generate_password_hash, password, self.method)
+        self._count("hashed")
+        return result
+
+    def verify(self, stored_hash, password):
+        result = self._run(check_password_hash, stored_hash, password)
+        self._count("verified")
+        return result
+
+    def prefix(self):
+        """Método con todos sus parámetros ("scrypt" -> "scrypt:32768:8:1"), como lo guarda werkzeug"""
+        if self._prefix is None:
+            self._prefix = self._run(generate_password_hash, "", self.method).split("$", 1)[0]
+        return self._prefix
+
+    def needs_rehash(self, stored_hash):
+        """True si el hash guardado usa otro método o factor de trabajo"""
+        return stored_hash.split("$", 1)[0] != self.prefix()
+
+    def rehash(self, password):
+        """Nuevo hash con los parámetros actuales (tras un login correcto)"""
+        result = self.hash(password)
+        self._count("rehashed")
+        return result
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["workers"] = self.workers
+        return stats
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_service():
+    """Servicio compartido del proceso"""
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = HashingService()
+    return _service
@@ -0,0 +1,135 @@
+"""Caducidad de las retenciones PENDING_PAYMENT.
+
+Cada reserva sin pagar lleva hold_expires_at; las consultas de disponibilidad
+ya ignoran las caducadas (db.ACTIVE_BOOKING), así que el barrido no es
+necesario para la corrección: sólo las pasa a EXPIRED para que dejen de
+recorrerse, actualiza el índice de ocupación y publica la versión de
+inventario, con la que todos los workers (no sólo el que barre) descartan las
+búsquedas cacheadas mientras la retención contaba. Trabaja por lotes
+pequeños, cada uno en su propia transacción corta, a través del índice
+parcial idx_bookings_hold_expiry.
+
+    HOTEL_HOLD_SECONDS         duración de la retención (db.HOLD_SECONDS)
+    HOTEL_HOLD_SWEEP_INTERVAL  segundos entre pasadas del barrido
+"""
+import os
+import threading
+import time
+
+import db
+import inventory
+from booking import with_retry
+
+SWEEP_INTERVAL = float(os.environ.get("HOTEL_HOLD_SWEEP_INTERVAL", 30))
+SWEEP_BATCH = 500
+
+# Sin INDEXED BY el planificador puede preferir idx_bookings_status_end, que
+# recorre todas las pendientes en lugar del tramo ya caducado
+EXPIRED_HOLDS = f"""
+    SELECT id, room_id, start_day, end_day FROM bookings INDEXED BY idx_bookings_hold_expiry
+    WHERE status = 'PENDING_PAYMENT' AND hold_expires_at <= {db.NOW_EPOCH}
+    ORDER BY hold_expires_at
+    LIMIT ?
+"""
+
+
+def release_expired(conn, limit=SWEEP_BATCH):
+    """Pasa a EXPIRED hasta `limit` retenciones caducadas; devuelve [(id, room_id, start_day, end_day)]"""
+
+    def work(conn):
+        rows = conn.execute(EXPIRED_HOLDS, (limit,)).fetchall()
+        conn.executemany("UPDATE bookings SET status = 'EXPIRED' WHERE id = ?", [(row[0],) for row in rows])
+        return rows
+
+    return with_retry(conn, work)
+
+
+class HoldSweeper:
+    """Hilo de fondo que libera retenciones caducadas cada `interval` segundos"""
+
+    def __init__(self, path=db.DB_PATH, interval=SWEEP_INTERVAL, batch=SWEEP_BATCH, on_release=None):
+        self.path = path
+        self.interval = interval
+        self.batch = batch
+        # on_release(conn, rows) tras cada lote, p. ej. para refrescar el índice de ocupación
+        self.on_release = on_release
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats = {"runs": 0, "released": 0, "last_released": 0, "max_released": 0,
+                       "last_run_seconds": 0.0, "last_run_at": None, "errors": 0}
+
+    def _release_batch(self, conn):
+        rows = release_expired(conn, self.batch)
+        if rows:
+            inventory.publish(conn, self.path)
+            if self.on_release is not None:
+                self.on_release(conn, rows)
+        return rows
+
+    def sweep(self, conn=None):
+        """Una pasada completa, lote a lote; devuelve cuántas retenciones liberó.
+
+        Sin conn cada lote toma el escritor del proceso y lo suelta al acabar,
+        así las reservas no esperan a que termine toda la pasada.
+        """
+        started = time.perf_counter()
+        released = 0
+        writer = db.get_writer(self.path)
+        while True:
+            if conn is not None:
+                rows = self._release_batch(conn)
+            else:
+                with writer.connection() as batch_conn:
+                    rows = self._release_batch(batch_conn)
+            released += len(rows)
+            if len(rows) < self.batch:
+                break
+        with self._lock:
+            self._stats["runs"] += 1
+            self._stats["released"] += released
+            self._stats["last_released"] = released
+            self._stats["max_released"] = max(self._stats["max_released"], released)
+            self._stats["last_run_seconds"] = time.perf_counter() - started
+            self._stats["last_run_at"] = int(time.time())
+        return released
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name="hotel-holds", daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while True:
+            try:
+                self.sweep()
+            except Exception:
+                with self._lock:
+                    self._stats["errors"] += 1
+            if self._stop.wait(self.interval):
+                return
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["running"] = self._thread is not None and self._thread.is_alive()
+        return stats
+
+
+_sweepers = {}
+_sweepers_lock = threading.Lock()
+
+
+def get_sweeper(path=db.DB_PATH, on_release=None):
+    """Barrido del proceso para una base de datos (se arranca con start())"""
+    key = str(path)
+    with _sweepers_lock:
+        sweeper = _sweepers.get(key)
+        if sweeper is None:
+            sweeper = _sweepers[key] = HoldSweeper(path, on_release=on_release)
+        return sweeper
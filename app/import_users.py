@@ -0,0 +1,118 @@
+"""Importación masiva de usuarios desde CSV.
+
+    python app/import_users.py usuarios.csv [--batch-size 5000] [--workers 8]
+
+El CSV lleva cabecera con `username` y `password` (texto plano, se hashea) o
+`password_hash` (ya hasheado, se inserta tal cual). Se lee por lotes sin cargar
+el fichero en memoria; cada lote se hashea en paralelo en un pool de procesos
+y se inserta con executemany en una transacción. Los usuarios ya existentes
+(o repetidos en el fichero) se cuentan como duplicados.
+"""
+import argparse
+import csv
+import json
+import multiprocessing
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from werkzeug.security import generate_password_hash
+
+import db
+from hashing import HASH_METHOD, HASH_WORKERS
+
+BATCH_SIZE = 5000
+
+
+def read_batches(rows, batch_size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def import_users(csv_path, db_path=db.DB_PATH, batch_size=BATCH_SIZE, workers=HASH_WORKERS,
+                 method=HASH_METHOD):
+    """Importa el CSV y devuelve {"read", "inserted", "duplicates", "invalid", "seconds"}"""
+    stats = {"read": 0, "inserted": 0, "duplicates": 0, "invalid": 0}
+    hash_password = partial(generate_password_hash, method=method)
+    executor = None
+    if workers > 0:
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+    conn = db.connect(db_path)
+    started = time.perf_counter()
+    try:
+        with open(csv_path, newline="", encoding="utf-8") as handle:
+            reader = csv.DictReader(handle)
+            prehashed = "password_hash" in (reader.fieldnames or [])
+            for batch in read_batches(reader, batch_size):
+                stats["read"] += len(batch)
+                candidates = {}
+                for row in batch:
+                    username = (row.get("username") or "").strip()
+                    secret = (row.get("password_hash") if prehashed else row.get("password")) or ""
+                    if not username or not secret.strip():
+                        stats["invalid"] += 1
+                    elif username in candidates:
+                        stats["duplicates"] += 1
+                    else:
+                        candidates[username] = secret if prehashed else secret.strip()
+
+                # No se hashea lo que ya existe (p. ej. al relanzar una importación)
+                existing = {row[0] for row in conn.execute(
+                    "SELECT username FROM users WHERE username IN (SELECT value FROM json_each(?))",
+                    (json.dumps(list(candidates)),))}
+                stats["duplicates"] += len(existing)
+                users = [username for username in candidates if username not in existing]
+                secrets = [candidates[username] for username in users]
+
+                if not prehashed:
+                    if executor is not None:
+                        chunksize = max(1, len(secrets) // (workers * 4))
+                        secrets = list(executor.map(hash_password, secrets, chunksize=chunksize))
+                    else:
+                        secrets = [hash_password(secret) for secret in secrets]
+
+                before = conn.total_changes
+                with conn:
+                    conn.executemany("""
+                        INSERT INTO users (username, password_hash) VALUES (?, ?)
+                        ON CONFLICT(username) DO NOTHING
+                    """, zip(users, secrets))
+                inserted = conn.total_changes - before
+                stats["inserted"] += inserted
+                stats["duplicates"] += len(users) - inserted
+    finally:
+        conn.close()
+        if executor is not None:
+            executor.shutdown()
+
+    stats["seconds"] = time.perf_counter() - started
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Importación masiva de usuarios desde CSV")
+    parser.add_argument("csv_path")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=HASH_WORKERS,
+                        help="procesos para hashear (0 = sin pool)")
+    parser.add_argument("--db", default=str(db.DB_PATH), help="ruta de la base de datos")
+    args = parser.parse_args()
+
+    db.init_db(args.db)
+    stats = import_users(args.csv_path, args.db, args.batch_size, args.workers)
+    rate = stats["read"] / stats["seconds"] if stats["seconds"] else 0
+    print(f"Leídos: {stats['read']}  insertados: {stats['inserted']}  "
+          f"duplicados: {stats['duplicates']}  inválidos: {stats['invalid']}")
+    print(f"{stats['seconds']:.1f}s  ({rate:.0f} filas/s)")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,124 @@
+"""Versión del inventario (bookings) legible sin tocar SQLite.
+
+meta.inventory_version la incrementan triggers sobre bookings, así que
+cualquier reserva, pago o retención caducada la cambia. Tras cada commit el
+proceso que escribió la publica en un pequeño segmento de memoria compartida;
+las páginas que dependen del inventario derivan de ahí su ETag y
+Last-Modified y pueden responder 304 sin abrir una conexión.
+
+    python app/inventory.py publish   # tras modificar bookings a mano
+"""
+import hashlib
+import os
+import struct
+import sys
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import db
+
+# version, modified_at (epoch en segundos)
+HEADER = struct.Struct("<qq")
+SEGMENT_SIZE = 64
+
+_TRACKED = os.name == "posix"
+
+
+def segment_name(db_path):
+    digest = hashlib.sha1(str(db_path).encode()).hexdigest()[:12]
+    return f"hotel_inv_{digest}"
+
+
+def read_version(conn):
+    row = conn.execute("SELECT value FROM meta WHERE key = 'inventory_version'").fetchone()
+    return row[0] if row else 0
+
+
+class InventoryVersion:
+    """(version, modified_at) de una base de datos en memoria compartida"""
+
+    def __init__(self, shm):
+        self.shm = shm
+        self._lock = threading.Lock()
+
+    @classmethod
+    def open(cls, name):
+        """Se adjunta al segmento o lo crea (vacío) si aún no existe"""
+        try:
+            shm = shared_memory.SharedMemory(name=name)
+        except FileNotFoundError:
+            try:
+                shm = shared_memory.SharedMemory(name=name, create=True, size=SEGMENT_SIZE)
+            except FileExistsError:
+                shm = shared_memory.SharedMemory(name=name)
+        # Igual que el índice de ocupación: el segmento sobrevive a los workers
+        if _TRACKED:
+            resource_tracker.unregister(shm._name, "shared_memory")
+        return cls(shm)
+
+    def current(self):
+        return HEADER.unpack_from(self.shm.buf, 0)
+
+    def publish(self, version):
+        """Guarda la versión leída de SQLite; Last-Modified avanza al menos un segundo por cambio.
+
+        Se guarda tal cual (no el máximo) para que restaurar una copia de la
+        base también cambie el ETag.
+        """
+        with self._lock:
+            current, modified = self.current()
+            if version != current:
+                HEADER.pack_into(self.shm.buf, 0, version, max(int(time.time()), modified + 1))
+
+    def close(self):
+        self.shm.close()
+
+
+_versions = {}
+_versions_lock = threading.Lock()
+
+
+def get_version(db_path=db.DB_PATH):
+    """Segmento de versión de db_path; al abrirlo en el proceso se sincroniza con SQLite"""
+    key = str(db_path)
+    version = _versions.get(key)
+    if version is None:
+        with _versions_lock:
+            version = _versions.get(key)
+            if version is None:
+                version = InventoryVersion.open(segment_name(key))
+                conn = db.connect(db_path, readonly=True)
+                try:
+                    version.publish(read_version(conn))
+                finally:
+                    conn.close()
+                _versions[key] = version
+    return version
+
+
+def current(db_path=db.DB_PATH):
+    """(version, modified_at) sin consultar SQLite"""
+    return get_version(db_path).current()
+
+
+def publish(conn, db_path=db.DB_PATH):
+    """Publica la versión tras un commit que tocó bookings (conn ve ya el commit)"""
+    get_version(db_path).publish(read_version(conn))
+
+
+def main():
+    if sys.argv[1:] != ["publish"]:
+        print(__doc__)
+        return 1
+    conn = db.connect(db.DB_PATH, readonly=True)
+    try:
+        publish(conn)
+    finally:
+        conn.close()
+    print("Versión de inventario:", current()[0])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
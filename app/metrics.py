@@ -0,0 +1,188 @@
+"""Métricas del proceso en formato de texto de Prometheus (GET /metrics).
+
+Por petición: latencia por ruta (histograma), peticiones por ruta, método y
+estado, y cuántas sentencias SQL lanzó y cuánto tardaron. Por sentencia:
+contadores globales por tipo (SELECT, INSERT, ...), también de los hilos de
+fondo (pagos, retenciones). Las conexiones de db.connect() avisan a
+observe_statement() de cada sentencia al agotar su cursor, con el tiempo del
+execute más el de leer las filas; registrar cuesta un par de sumas bajo un
+lock, y el texto sólo se genera cuando alguien lee /metrics. Los indicadores
+de pools, cachés y esperas de escritura se leen en ese momento de los
+colectores registrados con register_collector().
+"""
+import bisect
+import os
+import threading
+import time
+
+from flask import g, request
+
+import db
+
+ENABLED = os.environ.get("HOTEL_METRICS", "1") != "0"
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+STATEMENT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def collect(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_labels(self.labels, key)} {value}" for key, value in values]
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}   # labels -> [cuentas por bucket..., +Inf, suma]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                series = self._values[labels] = [0] * (len(self.buckets) + 2)
+            series[position] += 1
+            series[-1] += value
+
+    def collect(self):
+        with self._lock:
+            values = sorted((key, list(series)) for key, series in self._values.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        names = self.labels + ("le",)
+        for key, series in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(names, key + (bound,))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, key)} {series[-1]}")
+            lines.append(f"{self.name}_count{_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+requests_total = Counter("hotel_http_requests_total", "Peticiones HTTP por ruta, método y estado",
+                         ("route", "method", "status"))
+request_seconds = Histogram("hotel_http_request_duration_seconds", "Duración de las peticiones por ruta",
+                            ("route",))
+request_statements = Histogram("hotel_request_sql_statements", "Sentencias SQL por petición",
+                               ("route",), STATEMENT_BUCKETS)
+request_sql_seconds = Histogram("hotel_request_sql_seconds", "Tiempo en SQL por petición", ("route",))
+
+
+class StatementCounter:
+    """Sentencias y segundos por tipo; una sola suma bajo lock por sentencia"""
+
+    def __init__(self):
+        self._values = {}   # op -> [sentencias, segundos]
+        self._ops = {}      # sql -> op (las sentencias de la app son cadenas fijas)
+        self._lock = threading.Lock()
+
+    def observe(self, sql, seconds):
+        op = self._ops.get(sql)
+        if op is None:
+            words = sql.split(None, 1)
+            op = words[0].upper() if words else "OTHER"
+            if len(self._ops) < 10000:
+                self._ops[sql] = op
+        with self._lock:
+            values = self._values.get(op)
+            if values is None:
+                values = self._values[op] = [0, 0.0]
+            values[0] += 1
+            values[1] += seconds
+
+    def collect(self):
+        with self._lock:
+            values = sorted((op, list(pair)) for op, pair in self._values.items())
+        lines = ["# HELP hotel_sql_statements_total Sentencias SQL ejecutadas por tipo",
+                 "# TYPE hotel_sql_statements_total counter"]
+        lines += [f'hotel_sql_statements_total{{op="{op}"}} {count}' for op, (count, _) in values]
+        lines += ["# HELP hotel_sql_seconds_total Tiempo en execute() por tipo de sentencia",
+                  "# TYPE hotel_sql_seconds_total counter"]
+        lines += [f'hotel_sql_seconds_total{{op="{op}"}} {seconds}' for op, (_, seconds) in values]
+        return lines
+
+
+statements = StatementCounter()
+METRICS = (requests_total, request_seconds, request_statements, request_sql_seconds, statements)
+
+_collectors = []
+_local = threading.local()
+
+
+def register_collector(collector):
+    """collector() -> [(nombre, ayuda, [(dict de etiquetas, valor)])], leídos como gauges en cada scrape"""
+    _collectors.append(collector)
+
+
+def observe_statement(conn, sql, parameters, seconds):
+    """Observador de db.Connection: cuenta la sentencia (y la suma a la petición en curso del hilo)"""
+    statements.observe(sql, seconds)
+    current = getattr(_local, "request", None)
+    if current is not None:
+        current[0] += 1
+        current[1] += seconds
+
+
+def _before_request():
+    g._metrics_started = time.perf_counter()
+    _local.request = [0, 0.0]
+
+
+def _after_request(response):
+    started = g.pop("_metrics_started", None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        request_seconds.observe(time.perf_counter() - started, route)
+        requests_total.inc(route, request.method, str(response.status_code))
+        count, seconds = getattr(_local, "request", None) or (0, 0.0)
+        request_statements.observe(count, route)
+        request_sql_seconds.observe(seconds, route)
+    _local.request = None
+    return response
+
+
+def init_app(app):
+    """Mide cada petición y cada sentencia SQL; sin efecto con HOTEL_METRICS=0"""
+    if not ENABLED:
+        return
+    db.add_statement_observer(observe_statement)
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+
+
+def render():
+    """Todas las métricas en formato de exposición de texto 0.0.4"""
+    lines = []
+    for metric in METRICS:
+        lines += metric.collect()
+    for collector in _collectors:
+        for name, help, samples in collector():
+            lines += [f"# HELP {name} {help}", f"# TYPE {name} gauge"]
+            for labels, value in samples:
+                lines.append(f"{name}{_labels(tuple(labels), tuple(labels.values()))} {value}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,415 @@
+"""Índice de ocupación habitación × día en memoria compartida.
+
+Cada celda de la matriz guarda el estado de una habitación en una noche
+(0 libre, 1 pendiente de pago, 2 confirmada) y, aparte, cuándo caduca la
+retención de las pendientes: igual que db.ACTIVE_BOOKING, una retención
+caducada deja de ocupar aunque el barrido aún no la haya liberado. El segmento vive en
+multiprocessing.shared_memory, así todos los workers leen la misma copia y
+una consulta de disponibilidad es un slice + reducción en NumPy. La ventana de
+días avanza sola: se reconstruye cuando su origen queda ROLL_DAYS por detrás.
+
+Uso como comando:
+    python app/occupancy.py rebuild   # reconstruye desde bookings
+    python app/occupancy.py check     # compara con la base de datos
+"""
+import hashlib
+import os
+import struct
+import sys
+import threading
+import time
+from datetime import date
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+import db
+
+FREE, PENDING, CONFIRMED = 0, 1, 2
+STATUS_CODES = {"PENDING_PAYMENT": PENDING, "CONFIRMED": CONFIRMED}
+
+HORIZON_DAYS = 730      # dos años por delante
+PAST_DAYS = 7           # margen para búsquedas que empiezan unos días atrás
+ROLL_DAYS = 30          # la ventana se reconstruye cuando su origen queda este retraso por detrás de hoy
+ROW_HEADROOM = 64       # habitaciones nuevas sin tener que redimensionar
+
+# origin, days, rows, state
+HEADER = struct.Struct("<qqqq")
+HEADER_SIZE = 64
+BUILDING, READY, RETIRED = 0, 1, 2
+# Cambia con la disposición del segmento: los workers nuevos no se adjuntan a uno de otro formato
+SEGMENT_FORMAT = 2
+# Caducidad (epoch en segundos) de una retención sin hold_expires_at: no caduca
+NEVER = np.iinfo(np.uint32).max
+
+# Sólo en POSIX el resource_tracker registra los segmentos compartidos
+_TRACKED = os.name == "posix"
+
+
+def expand_intervals(rows, origin, days, row_ids, start_days, end_days, codes):
+    """Expande intervalos [start, end) a una matriz rows × days sin bucles por día.
+
+    Cada estado usa un array de diferencias (+1 al entrar, -1 al salir) cuya
+    suma acumulada indica las noches cubiertas; si se solapan gana el código
+    más alto (confirmada sobre pendiente).
+    """
+    grid = np.zeros((rows, days), dtype=np.uint8)
+    lo = np.clip(np.asarray(start_days) - origin, 0, days)
+    hi = np.clip(np.asarray(end_days) - origin, 0, days)
+    codes = np.asarray(codes, dtype=np.uint8)
+    for code in (PENDING, CONFIRMED):
+        selected = (codes == code) & (lo < hi)
+        if not selected.any():
+            continue
+        diff = np.zeros((rows, days + 1), dtype=np.int32)
+        np.add.at(diff, (row_ids[selected], lo[selected]), 1)
+        np.add.at(diff, (row_ids[selected], hi[selected]), -1)
+        grid[np.cumsum(diff[:, :days], axis=1) > 0] = code
+    return grid
+
+
+def expand_expiry(rows, origin, days, row_ids, start_days, end_days, codes, expires):
+    """Caducidad por celda de las retenciones PENDING (0 en el resto); un bucle por retención, que son pocas"""
+    expiry = np.zeros((rows, days), dtype=np.uint32)
+    lo = np.clip(np.asarray(start_days) - origin, 0, days)
+    hi = np.clip(np.asarray(end_days) - origin, 0, days)
+    for i in np.flatnonzero((np.asarray(codes) == PENDING) & (lo < hi)):
+        cells = expiry[row_ids[i], lo[i]:hi[i]]
+        np.maximum(cells, expires[i], out=cells)
+    return expiry
+
+
+def hold_expiry(value):
+    """hold_expires_at de SQLite como celda del índice"""
+    return NEVER if value is None else min(int(value), NEVER)
+
+
+def month_grid(conn, year, month):
+    """Calendario de un mes: (room_numbers, lista de fechas, matriz rooms × days).
+
+    Una única consulta por rango sobre bookings; la expansión a días es
+    vectorizada con expand_intervals.
+    """
+    first = date(year, month, 1)
+    following = date(year + month // 12, month % 12 + 1, 1)
+    origin, days = first.toordinal(), (following - first).days
+
+    cur = conn.cursor()
+    cur.execute("SELECT id, room_number FROM rooms ORDER BY room_number")
+    rooms = cur.fetchall()
+    position = np.full(max([room[0] for room in rooms], default=0) + 1, -1, dtype=np.int64)
+    for row, room in enumerate(rooms):
+        position[room[0]] = row
+
+    cur.execute(f"""
+        SELECT b.room_id, b.start_day, b.end_day, b.status FROM bookings b
+        WHERE b.status IN ('PENDING_PAYMENT', 'CONFIRMED')
+        AND b.end_day > ? AND b.start_day < ? AND {db.ACTIVE_BOOKING}
+    """, (origin, origin + days))
+    bookings = cur.fetchall()
+    room_ids = np.array([b[0] for b in bookings], dtype=np.int64)
+    row_ids = position[np.minimum(room_ids, len(position) - 1)]
+    keep = (room_ids < len(position)) & (row_ids >= 0)
+    grid = expand_intervals(
+        len(rooms), origin, days, row_ids[keep],
+        np.array([b[1] for b in bookings], dtype=np.int64)[keep],
+        np.array([b[2] for b in bookings], dtype=np.int64)[keep],
+        np.array([STATUS_CODES[b[3]] for b in bookings], dtype=np.uint8)[keep],
+    )
+    dates = [date.fromordinal(origin + offset) for offset in range(days)]
+    return [room[1] for room in rooms], dates, grid
+
+
+def segment_name(db_path):
+    """Nombre del segmento compartido para una base de datos concreta"""
+    digest = hashlib.sha1(str(db_path).encode()).hexdigest()[:12]
+    return f"hotel_occ{SEGMENT_FORMAT}_{digest}"
+
+
+def expiry_offset(rows, days):
+    """Desplazamiento de la matriz de caducidades (uint32 alineado) tras la de estados"""
+    return HEADER_SIZE + (rows * days + 3) // 4 * 4
+
+
+class OccupancyIndex:
+    """Matrices rooms × days (estado y caducidad de la retención) sobre un segmento de memoria compartida"""
+
+    def __init__(self, shm):
+        self.shm = shm
+        origin, days, rows, _ = HEADER.unpack_from(shm.buf, 0)
+        self.origin = origin
+        self.days = days
+        self.rows = rows
+        self.grid = np.ndarray((rows, days), dtype=np.uint8, buffer=shm.buf, offset=HEADER_SIZE)
+        self.expires = np.ndarray((rows, days), dtype=np.uint32, buffer=shm.buf,
+                                  offset=expiry_offset(rows, days))
+        self._lock = threading.Lock()
+
+    @classmethod
+    def create(cls, conn, name, origin=None, days=HORIZON_DAYS):
+        """Crea el segmento, lo llena desde bookings y lo marca como listo"""
+        if origin is None:
+            origin = window_origin()
+        cur = conn.cursor()
+        cur.execute("SELECT COALESCE(MAX(id), 0) FROM rooms")
+        rows = cur.fetchone()[0] + 1 + ROW_HEADROOM
+
+        shm = shared_memory.SharedMemory(name=name, create=True, size=expiry_offset(rows, days) + 4 * rows * days)
+        # El segmento pertenece a la base de datos, no a este proceso: se borra
+        # sólo con drop_index()/rebuild, no cuando termina el worker que lo creó.
+        _untrack(shm)
+        HEADER.pack_into(shm.buf, 0, origin, days, rows, BUILDING)
+        index = cls(shm)
+        try:
+            index.build(conn)
+        except Exception:
+            index.close()
+            shm.unlink()
+            raise
+        index._set_state(READY)
+        return index
+
+    @classmethod
+    def attach(cls, name):
+        """Se conecta a un segmento existente creado por otro proceso"""
+        shm = shared_memory.SharedMemory(name=name)
+        # En Python < 3.13 el resource_tracker borraría el segmento al salir
+        # de cualquier proceso que sólo lo está leyendo.
+        _untrack(shm)
+        return cls(shm)
+
+    @property
+    def state(self):
+        return HEADER.unpack_from(self.shm.buf, 0)[3]
+
+    def _set_state(self, state):
+        HEADER.pack_into(self.shm.buf, 0, self.origin, self.days, self.rows, state)
+
+    def _load(self, conn):
+        """Calcula las matrices completas (estado, caducidad) desde bookings en arrays aparte"""
+        cur = conn.cursor()
+        cur.execute(f"""
+            SELECT b.room_id, b.start_day, b.end_day, b.status, b.hold_expires_at FROM bookings b
+            WHERE b.status IN ('PENDING_PAYMENT', 'CONFIRMED')
+            AND b.end_day > ? AND b.start_day < ? AND {db.ACTIVE_BOOKING}
+        """, (self.origin, self.origin + self.days))
+        rows = cur.fetchall()
+        room_ids = np.array([row[0] for row in rows], dtype=np.int64)
+        keep = room_ids < self.rows
+        columns = (
+            self.rows, self.origin, self.days, room_ids[keep],
+            np.array([row[1] for row in rows], dtype=np.int64)[keep],
+            np.array([row[2] for row in rows], dtype=np.int64)[keep],
+            np.array([STATUS_CODES[row[3]] for row in rows], dtype=np.uint8)[keep],
+        )
+        expires = np.array([hold_expiry(row[4]) for row in rows], dtype=np.uint32)[keep]
+        return expand_intervals(*columns), expand_expiry(*columns, expires)
+
+    def build(self, conn):
+        """Reconstruye el contenido (el tamaño del segmento no cambia)"""
+        grid, expires = self._load(conn)
+        with self._lock:
+            self.grid[:] = grid
+            self.expires[:] = expires
+
+    def stale(self, today=None):
+        """True si los días pasados ya le han comido ROLL_DAYS de horizonte y toca mover la ventana"""
+        return window_origin(today) - self.origin >= ROLL_DAYS
+
+    def covers(self, start_day, end_day, room_ids=None):
+        """True si el rango (y las habitaciones) caben dentro del índice"""
+        if start_day < self.origin or end_day > self.origin + self.days:
+            return False
+        if room_ids is not None and len(room_ids) and int(np.max(room_ids)) >= self.rows:
+            return False
+        return self.state == READY
+
+    def mark(self, room_id, start_day, end_day, status, expires_at=None):
+        """Registra una reserva recién confirmada en la base de datos.
+
+        Para una retención, expires_at es su hold_expires_at; sin él se toma el
+        plazo completo desde ahora, que nunca es anterior al que guardó SQLite.
+        """
+        room_id = int(room_id)
+        if room_id >= self.rows:
+            return
+        lo = max(start_day, self.origin) - self.origin
+        hi = min(end_day, self.origin + self.days) - self.origin
+        if status == "PENDING_PAYMENT" and expires_at is None:
+            expires_at = int(time.time()) + db.HOLD_SECONDS
+        if lo < hi:
+            with self._lock:
+                self.grid[room_id, lo:hi] = STATUS_CODES.get(status, FREE)
+                self.expires[room_id, lo:hi] = hold_expiry(expires_at) if status == "PENDING_PAYMENT" else 0
+
+    def refresh(self, conn, room_id, start_day, end_day):
+        """Recalcula un tramo de una habitación desde bookings (p. ej. al liberar una retención)"""
+        room_id = int(room_id)
+        lo = max(start_day, self.origin)
+        hi = min(end_day, self.origin + self.days)
+        if room_id >= self.rows or lo >= hi:
+            return
+        segment = np.zeros(hi - lo, dtype=np.uint8)
+        expiry = np.zeros(hi - lo, dtype=np.uint32)
+        for start, end, status, expires_at in conn.execute(f"""
+            SELECT b.start_day, b.end_day, b.status, b.hold_expires_at FROM bookings b
+            WHERE b.room_id = ? AND b.end_day > ? AND b.start_day < ? AND {db.ACTIVE_BOOKING}
+        """, (room_id, lo, hi)):
+            cells = slice(max(start, lo) - lo, min(end, hi) - lo)
+            np.maximum(segment[cells], STATUS_CODES[status], out=segment[cells])
+            if status == "PENDING_PAYMENT":
+                np.maximum(expiry[cells], hold_expiry(expires_at), out=expiry[cells])
+        with self._lock:
+            self.grid[room_id, lo - self.origin:hi - self.origin] = segment
+            self.expires[room_id, lo - self.origin:hi - self.origin] = expiry
+
+    def blocked(self, rows, lo, hi, now=None):
+        """Celdas que ocupan la habitación: confirmadas o retenciones aún vigentes"""
+        now = int(time.time()) if now is None else now
+        grid = self.grid[rows, lo:hi]
+        return (grid == CONFIRMED) | ((grid == PENDING) & (self.expires[rows, lo:hi] > now))
+
+    def available(self, room_ids, start_day, end_day):
+        """Máscara booleana: qué room_ids están libres todo el rango [start, end)"""
+        room_ids = np.asarray(room_ids, dtype=np.int64)
+        return ~self.blocked(room_ids, start_day - self.origin, end_day - self.origin).any(axis=1)
+
+    def occupied(self, start_day, end_day):
+        """room_ids con al menos una noche ocupada en [start, end)"""
+        return np.flatnonzero(self.blocked(slice(None), start_day - self.origin, end_day - self.origin).any(axis=1))
+
+    def check(self, conn):
+        """Lista de room_ids cuya fila no coincide con la base de datos (una retención caducada cuenta como libre)"""
+        now = int(time.time())
+        expected, _ = self._load(conn)
+        current = np.where(self.blocked(slice(None), 0, self.days, now), self.grid, FREE)
+        return np.flatnonzero((expected != current).any(axis=1)).tolist()
+
+    def retire(self):
+        """Marca el segmento como obsoleto para que los workers se reconecten"""
+        self._set_state(RETIRED)
+
+    def close(self):
+        self.grid = None
+        self.expires = None
+        self.shm.close()
+
+
+def window_origin(today=None):
+    """Primer día de la ventana para hoy (o para el ordinal `today`)"""
+    today = date.today().toordinal() if today is None else today
+    return today - PAST_DAYS
+
+
+def _untrack(shm):
+    if _TRACKED:
+        resource_tracker.unregister(shm._name, "shared_memory")
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(db_path=db.DB_PATH, today=None):
+    """Índice del proceso para db_path: se adjunta al segmento o lo crea.
+
+    Con el paso de los días la ventana [origin, origin + days) se queda atrás;
+    cuando su origen lleva ROLL_DAYS de retraso el primer worker que lo nota la
+    reconstruye con origen en hoy - PAST_DAYS y los demás se reconectan.
+    """
+    key = str(db_path)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is not None and index.state == RETIRED:
+            index.close()
+            index = None
+        if index is None:
+            index = _open(key, db_path, today)
+        if index.stale(today):
+            index = _roll(key, db_path, index, today)
+        _indexes[key] = index
+        return index
+
+
+def _open(key, db_path, today):
+    name = segment_name(key)
+    try:
+        return OccupancyIndex.attach(name)
+    except FileNotFoundError:
+        conn = db.connect(db_path)
+        try:
+            return OccupancyIndex.create(conn, name, origin=window_origin(today))
+        except FileExistsError:
+            # Otro worker lo creó entre el attach y el create
+            return OccupancyIndex.attach(name)
+        finally:
+            conn.close()
+
+
+def _roll(key, db_path, index, today):
+    """Sustituye un segmento con la ventana atrasada por uno centrado en hoy"""
+    index.close()
+    name = segment_name(key)
+    try:
+        current = OccupancyIndex.attach(name)
+    except FileNotFoundError:
+        current = None
+    if current is not None:
+        if not current.stale(today) and current.state != RETIRED:
+            # Otro worker ya lo movió
+            return current
+        current.retire()
+        current.close()
+        try:
+            shm = shared_memory.SharedMemory(name=name)
+        except FileNotFoundError:
+            pass
+        else:
+            shm.close()
+            shm.unlink()
+    return _open(key, db_path, today)
+
+
+def drop_index(db_path=db.DB_PATH):
+    """Cierra y elimina el segmento compartido de db_path"""
+    key = str(db_path)
+    with _indexes_lock:
+        index = _indexes.pop(key, None)
+        if index is None:
+            try:
+                index = OccupancyIndex.attach(segment_name(key))
+            except FileNotFoundError:
+                return
+        index.retire()
+        index.close()
+        try:
+            shm = shared_memory.SharedMemory(name=segment_name(key))
+        except FileNotFoundError:
+            return
+        shm.close()
+        shm.unlink()
+
+
+def rebuild(db_path=db.DB_PATH):
+    """Recrea el segmento desde cero (p. ej. tras añadir habitaciones)"""
+    drop_index(db_path)
+    return get_index(db_path)
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "check"
+    if command == "rebuild":
+        index = rebuild()
+        print(f"Índice reconstruido: {index.rows} filas × {index.days} días")
+    elif command == "check":
+        index = get_index()
+        conn = db.connect()
+        mismatches = index.check(conn)
+        conn.close()
+        if mismatches:
+            print("Habitaciones desincronizadas:", mismatches)
+            sys.exit(1)
+        print("Índice consistente con la base de datos")
+    else:
+        print("Uso: python app/occupancy.py [rebuild|check]")
+        sys.exit(2)
@@ -0,0 +1,130 @@
+"""Confirmación de pagos con commits agrupados e idempotencia por reserva.
+
+Las peticiones encolan (booking_id) y esperan su resultado; un hilo de fondo
+vacía la cola por lotes y confirma cada lote en una sola transacción, así el
+coste de fsync se reparte entre todos los pagos del lote. El índice único
+idx_payments_booking garantiza un solo pago por reserva aunque el cliente
+envíe el formulario dos veces.
+"""
+import queue
+import threading
+from concurrent.futures import Future
+
+import db
+import inventory
+from booking import with_retry
+
+BATCH_SIZE = 256
+BATCH_LINGER = 0.005    # segundos esperando más pagos antes de confirmar el lote
+PAYMENT_WAIT = 2.0      # lo que la petición espera antes de responder "en proceso"
+
+CONFIRMED = "CONFIRMED"
+ALREADY_PAID = "ALREADY_PAID"
+NOT_PAYABLE = "NOT_PAYABLE"
+
+
+class PaymentPipeline:
+    def __init__(self, path=db.DB_PATH, batch_size=BATCH_SIZE, linger=BATCH_LINGER):
+        self.path = path
+        self.batch_size = batch_size
+        self.linger = linger
+        self._queue = queue.Queue()
+        self._pending = {}          # booking_id -> Future, para no encolar dos veces
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stats = {"batches": 0, "confirmed": 0, "duplicates": 0, "rejected": 0}
+
+    def submit(self, booking_id):
+        """Encola el pago de una reserva; devuelve un Future con el resultado"""
+        booking_id = int(booking_id)
+        with self._lock:
+            future = self._pending.get(booking_id)
+            if future is not None:
+                return future
+            future = self._pending[booking_id] = Future()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="hotel-payments", daemon=True)
+                self._thread.start()
+        self._queue.put(booking_id)
+        return future
+
+    def is_pending(self, booking_id):
+        with self._lock:
+            return int(booking_id) in self._pending
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get(timeout=self.linger))
+            except queue.Empty:
+                break
+        return batch
+
+    def _commit(self, conn, batch):
+        def work(conn):
+            results = {}
+            for booking_id in batch:
+                # Una retención caducada ya no reserva la habitación: no se cobra
+                row = conn.execute(f"SELECT total_price, {db.ACTIVE_BOOKING} AS active FROM bookings b WHERE id = ?",
+                                   (booking_id,)).fetchone()
+                if row is None or not row["active"]:
+                    results[booking_id] = NOT_PAYABLE
+                    continue
+                cur = conn.execute("""
+                    INSERT INTO payments (booking_id, amount, status, created_at)
+                    VALUES (?, ?, 'APPROVED', datetime('now'))
+                    ON CONFLICT(booking_id) DO NOTHING
+                """, (booking_id, row["total_price"]))
+                if cur.rowcount == 0:
+                    results[booking_id] = ALREADY_PAID
+                    continue
+                conn.execute("UPDATE bookings SET status = 'CONFIRMED' WHERE id = ?", (booking_id,))
+                results[booking_id] = CONFIRMED
+            return results
+
+        return with_retry(conn, work)
+
+    def _run(self):
+        writer = db.get_writer(self.path)
+        while True:
+            batch = self._next_batch()
+            try:
+                # El escritor del proceso sólo se toma durante el commit del lote
+                with writer.connection() as conn:
+                    results = self._commit(conn, batch)
+                    inventory.publish(conn, self.path)
+                error = None
+            except Exception as e:
+                results, error = {}, e
+            with self._lock:
+                self._stats["batches"] += 1
+                for booking_id in batch:
+                    future = self._pending.pop(booking_id)
+                    if error is not None:
+                        future.set_exception(error)
+                        continue
+                    result = results[booking_id]
+                    key = {CONFIRMED: "confirmed", ALREADY_PAID: "duplicates"}.get(result, "rejected")
+                    self._stats[key] += 1
+                    future.set_result(result)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["queued"] = len(self._pending)
+        return stats
+
+
+_pipelines = {}
+_pipelines_lock = threading.Lock()
+
+
+def get_pipeline(path=db.DB_PATH):
+    """Pipeline de pagos del proceso para una base de datos"""
+    key = str(path)
+    with _pipelines_lock:
+        pipeline = _pipelines.get(key)
+        if pipeline is None:
+            pipeline = _pipelines[key] = PaymentPipeline(path)
+        return pipeline
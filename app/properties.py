@@ -0,0 +1,183 @@
+"""Varios hoteles de la cadena, cada uno en su propio fichero SQLite.
+
+La base principal (db.DB_PATH) hace de directorio: guarda los usuarios y la
+tabla properties, que asocia cada código de hotel a su shard. Cada hotel tiene
+así su propio bloqueo de escritura y su propio WAL, y las reservas de hoteles
+distintos no se esperan entre sí. El hotel "central" vive en la propia base
+del directorio.
+
+    python app/properties.py add norte "Hotel Norte" --city Lima
+    python app/properties.py list
+"""
+import argparse
+import os
+import re
+import sqlite3
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import db
+
+DEFAULT_PROPERTY = "central"
+SHARD_DIR = "shards"    # relativo a la carpeta del directorio
+FANOUT_WORKERS = int(os.environ.get("HOTEL_FANOUT_WORKERS", 8))
+CODE_PATTERN = re.compile(r"^[a-z0-9][a-z0-9_-]{0,31}$")
+
+
+class UnknownProperty(KeyError):
+    """Código de hotel que no está en el directorio"""
+
+
+class Router:
+    """Traduce códigos de hotel a rutas de shard.
+
+    El mapa se lee del directorio la primera vez y queda en memoria; sólo se
+    vuelve a leer al dar de alta un hotel, al pedir un código desconocido (puede
+    venir de otro proceso) o con reload().
+    """
+
+    def __init__(self, directory=db.DB_PATH):
+        self.directory = Path(directory)
+        self._properties = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        pool = db.get_pool(self.directory, readonly=True)
+        conn = pool.acquire()
+        try:
+            rows = conn.execute("SELECT code, name, city, db_file FROM properties ORDER BY id").fetchall()
+        finally:
+            pool.release(conn)
+        return {row["code"]: {"code": row["code"], "name": row["name"], "city": row["city"],
+                              "path": db.shard_path(self.directory, row["db_file"])}
+                for row in rows}
+
+    def reload(self):
+        properties = self._load()
+        with self._lock:
+            self._properties = properties
+        return properties
+
+    def _cached(self):
+        properties = self._properties
+        return properties if properties is not None else self.reload()
+
+    def get(self, code):
+        """Datos de un hotel ({"code", "name", "city", "path"}); UnknownProperty si no existe"""
+        prop = self._cached().get(code)
+        if prop is None:
+            if not CODE_PATTERN.match(code or ""):
+                raise UnknownProperty(code)
+            # Puede haberse dado de alta desde otro proceso
+            prop = self.reload().get(code)
+            if prop is None:
+                raise UnknownProperty(code)
+        return prop
+
+    def path_for(self, code):
+        return self.get(code)["path"]
+
+    def properties(self, city=None):
+        """Hoteles del directorio, opcionalmente de una ciudad (del mapa en memoria)"""
+        properties = self._cached().values()
+        if city is not None:
+            city = city.strip().lower()
+            properties = [prop for prop in properties if (prop["city"] or "").lower() == city]
+        return list(properties)
+
+    def provision(self, code, name, city=None):
+        """Da de alta un hotel: crea su shard con el esquema completo y lo registra"""
+        if not CODE_PATTERN.match(code or ""):
+            raise ValueError("Código de hotel inválido (minúsculas, dígitos, '-' o '_')")
+        db_file = f"{SHARD_DIR}/hotel_{code}.db"
+        path = db.shard_path(self.directory, db_file)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        db.init_db(path, directory=False)
+
+        conn = db.connect(self.directory)
+        try:
+            with conn:
+                conn.execute("INSERT INTO properties (code, name, city, db_file) VALUES (?, ?, ?, ?)",
+                             (code, name, city, db_file))
+        finally:
+            conn.close()
+        self.reload()
+        return path
+
+    def fan_out(self, properties, work):
+        """Ejecuta work(prop) en paralelo sobre varios hoteles; resultados en el mismo orden"""
+        properties = list(properties)
+        if len(properties) <= 1:
+            return [work(prop) for prop in properties]
+        return list(_fanout_executor().map(work, properties))
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _fanout_executor():
+    # Un hilo por shard consultado: sqlite3 suelta el GIL mientras ejecuta la consulta
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=FANOUT_WORKERS, thread_name_prefix="hotel-fanout")
+        return _executor
+
+
+def mirror_user(conn, user_id, username):
+    """Copia mínima del usuario en un shard para que se cumpla la FK de bookings.
+
+    Las credenciales sólo viven en el directorio; la copia lleva un hash
+    inutilizable. Sólo escribe (y confirma) la primera vez.
+    """
+    if conn.execute("SELECT 1 FROM users WHERE id = ?", (user_id,)).fetchone() is None:
+        with conn:
+            conn.execute("INSERT OR IGNORE INTO users (id, username, password_hash) VALUES (?, ?, '!')",
+                         (user_id, username))
+
+
+_routers = {}
+_routers_lock = threading.Lock()
+
+
+def get_router(directory=db.DB_PATH):
+    """Router del proceso para un directorio"""
+    key = str(directory)
+    with _routers_lock:
+        router = _routers.get(key)
+        if router is None:
+            router = _routers[key] = Router(directory)
+        return router
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hoteles de la cadena (shards SQLite)")
+    parser.add_argument("--db", default=str(db.DB_PATH), help="base de datos del directorio")
+    commands = parser.add_subparsers(dest="command", required=True)
+    add = commands.add_parser("add", help="crea el shard de un hotel nuevo")
+    add.add_argument("code")
+    add.add_argument("name")
+    add.add_argument("--city")
+    commands.add_parser("list", help="lista los hoteles y sus ficheros")
+    args = parser.parse_args()
+
+    db.init_db(args.db)
+    router = get_router(args.db)
+    if args.command == "add":
+        try:
+            path = router.provision(args.code, args.name, args.city)
+        except (ValueError, sqlite3.IntegrityError) as e:
+            print(f"No se pudo crear el hotel: {e}")
+            return 1
+        print(f"Hotel {args.code} creado en {path}")
+    else:
+        for prop in router.properties():
+            print(f"{prop['code']:<16} {prop['name']:<24} {prop['city'] or '-':<16} {prop['path']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,141 @@
+"""Render de plantillas: bytecode en disco, fragmentos cacheados y tiempos.
+
+- El bytecode compilado de cada plantilla se guarda en HOTEL_TEMPLATE_CACHE
+  (por defecto .template_cache/), así que un worker recién arrancado no vuelve
+  a compilar; Jinja lo descarta solo cuando cambia el fuente.
+- Los bloques repetidos por habitación de search_results.html se renderizan
+  una vez por (hotel, habitación, fechas) y se reutilizan desde una LRU.
+- Cada render completo registra su duración por plantilla (/api/stats).
+
+    python app/rendering.py compile   # precompila todas las plantillas
+"""
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from flask import before_render_template, template_rendered
+from jinja2 import FileSystemBytecodeCache
+from markupsafe import Markup
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+TEMPLATE_CACHE_DIR = Path(os.environ.get("HOTEL_TEMPLATE_CACHE", BASE_DIR / ".template_cache"))
+FRAGMENT_CACHE_SIZE = int(os.environ.get("HOTEL_FRAGMENT_CACHE_SIZE", 4096))
+ROOM_FRAGMENT = "_room.html"
+
+
+class FragmentCache:
+    """LRU de trozos de HTML ya renderizados"""
+
+    def __init__(self, size=FRAGMENT_CACHE_SIZE):
+        self.size = size
+        self._fragments = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, key, render):
+        """Fragmento de key; si no está, render() lo produce y se guarda"""
+        with self._lock:
+            fragment = self._fragments.get(key)
+            if fragment is not None:
+                self._fragments.move_to_end(key)
+                self._stats["hits"] += 1
+                return fragment
+            self._stats["misses"] += 1
+        # Se renderiza sin el lock: dos hilos pueden hacerlo a la vez, el resultado es el mismo
+        fragment = Markup(render())
+        if self.size > 0:
+            with self._lock:
+                self._fragments[key] = fragment
+                while len(self._fragments) > self.size:
+                    self._fragments.popitem(last=False)
+                    self._stats["evictions"] += 1
+        return fragment
+
+    def clear(self):
+        with self._lock:
+            self._fragments.clear()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, entries=len(self._fragments), size=self.size)
+
+
+class RenderStats:
+    """Renders completos por plantilla: número, tiempo total y máximo"""
+
+    def __init__(self):
+        self._templates = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds):
+        with self._lock:
+            entry = self._templates.setdefault(name, {"renders": 0, "total_ms": 0.0, "max_ms": 0.0})
+            entry["renders"] += 1
+            entry["total_ms"] += seconds * 1000
+            entry["max_ms"] = max(entry["max_ms"], seconds * 1000)
+
+    def stats(self):
+        with self._lock:
+            return {name: dict(entry, avg_ms=entry["total_ms"] / entry["renders"])
+                    for name, entry in self._templates.items()}
+
+
+fragments = FragmentCache()
+timings = RenderStats()
+
+
+def _render_started(sender, template, context, **extra):
+    # El contexto viaja hasta template_rendered, también en streaming
+    context["_render_started"] = time.perf_counter()
+
+
+def _render_finished(sender, template, context, **extra):
+    started = context.get("_render_started")
+    if started is not None:
+        timings.record(template.name, time.perf_counter() - started)
+
+
+def init_app(app):
+    """Activa la caché de bytecode, room_fragment() en las plantillas y la medición de tiempos"""
+    TEMPLATE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(str(TEMPLATE_CACHE_DIR))
+
+    def room_fragment(room, property_code, start_date, end_date):
+        """<li> de una habitación libre con su formulario de reserva"""
+        key = (property_code, room["room_id"], room["room_number"], room["room_type_name"], room["price"],
+               start_date, end_date)
+        return fragments.get(key, lambda: app.jinja_env.get_template(ROOM_FRAGMENT).render(
+            room=room, property_code=property_code, start_date=start_date, end_date=end_date))
+
+    app.jinja_env.globals["room_fragment"] = room_fragment
+    before_render_template.connect(_render_started, app)
+    template_rendered.connect(_render_finished, app)
+
+
+def stats():
+    return {"templates": timings.stats(), "fragments": fragments.stats()}
+
+
+def precompile(env):
+    """Compila todas las plantillas para dejar su bytecode en la caché"""
+    names = env.list_templates()
+    for name in names:
+        env.get_template(name)
+    return names
+
+
+def main():
+    if sys.argv[1:] != ["compile"]:
+        print(__doc__)
+        return 1
+    from app import app
+    names = precompile(app.jinja_env)
+    print(f"{len(names)} plantillas compiladas en {TEMPLATE_CACHE_DIR}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,200 @@
+"""Caché LRU en proceso de los resultados de búsqueda.
+
+Cada entrada corresponde a una clave (room_type, start_day, end_day) y guarda
+las páginas ya calculadas para ese rango. Una reserva de una habitación de
+tipo T sobre [D1, D2) sólo expulsa las entradas de T (y las de ALL_TYPES, que
+listan habitaciones de todos los tipos) cuyo rango se solapa con [D1, D2); el
+resto de la caché sigue caliente.
+
+El proceso que escribe invalida en el acto su propia caché. Lo que escriben
+otros workers o la línea de comandos llega por la tabla inventory_changes
+(db.migrate_inventory_changes): antes de leer, sync() compara la versión de
+inventario publicada en memoria compartida con la última vista y, sólo si
+cambió, aplica las filas nuevas con la misma invalidación por rango. Así una
+página nunca sale de la caché bajo un ETag de una versión posterior a los
+cambios que ya descontó. Cada entrada lleva además la versión del catálogo
+con la que se calculó; otra versión cuenta como fallo.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+import db
+
+CACHE_SIZE = int(os.environ.get("HOTEL_SEARCH_CACHE_SIZE", 1024))
+CACHE_TTL = float(os.environ.get("HOTEL_SEARCH_CACHE_TTL", 30))
+# Entradas que no dependen del tipo (p. ej. la lista de habitaciones ocupadas)
+ALL_TYPES = "*"
+# Invalidaciones recordadas para descartar resultados calculados antes de ellas
+RECENT_INVALIDATIONS = 256
+
+
+# Cambios posteriores al último aplicado, con el tipo de la habitación
+CHANGES = """
+    SELECT c.id, t.code, c.start_day, c.end_day
+    FROM inventory_changes c
+    LEFT JOIN rooms r ON r.id = c.room_id
+    LEFT JOIN room_types t ON t.id = r.room_type_id
+    WHERE c.id > ?
+    ORDER BY c.id
+"""
+
+
+class _Entry:
+    __slots__ = ("version", "expires", "parts")
+
+    def __init__(self, version, expires):
+        self.version = version
+        self.expires = expires
+        self.parts = {}
+
+
+class SearchCache:
+    """LRU de (room_type, start_day, end_day) -> {parte: valor} con TTL e invalidación por rango"""
+
+    def __init__(self, size=CACHE_SIZE, ttl=CACHE_TTL, clock=time.monotonic):
+        self.size = size
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._by_type = {}
+        self._generation = 0
+        self._recent = deque(maxlen=RECENT_INVALIDATIONS)
+        # Versión de inventario y última fila de inventory_changes ya aplicadas
+        self._inventory_version = None
+        self._last_change = None
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+
+    def sync(self, conn, inventory_version):
+        """Aplica los cambios de inventario de cualquier proceso; sólo consulta SQLite si la versión cambió.
+
+        Hay que llamarla antes de token() y fuera de la transacción de la
+        búsqueda, para que lo que se lea después ya los incluya.
+        """
+        with self._lock:
+            if inventory_version == self._inventory_version:
+                return
+            last = self._last_change
+        if last is None:
+            # Primera vez en el proceso: la caché aún no tiene nada anterior
+            changes, newest = [], conn.execute("SELECT COALESCE(MAX(id), 0) FROM inventory_changes").fetchone()[0]
+        else:
+            changes = conn.execute(CHANGES, (last,)).fetchall()
+            newest = changes[-1][0] if changes else last
+        if changes and changes[0][0] != last + 1:
+            # Las filas que faltaban ya se podaron: no se sabe qué cambió
+            self.clear()
+        else:
+            for _, room_type, start_day, end_day in changes:
+                # Sin tipo la habitación ya no existe y el cambio de catálogo caduca sus entradas
+                if room_type is not None:
+                    self.invalidate(room_type, start_day, end_day)
+        with self._lock:
+            if self._last_change is None or newest > self._last_change:
+                self._last_change = newest
+            self._inventory_version = inventory_version
+
+    def token(self):
+        """Marca a tomar antes de leer de la base de datos; put() la usa para no guardar datos viejos"""
+        with self._lock:
+            return self._generation
+
+    def get(self, room_type, start_day, end_day, part, version):
+        """Valor guardado o None si no existe, caducó o se calculó con otra version"""
+        key = (room_type, start_day, end_day)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry.version != version or entry.expires <= self.clock()):
+                self._stats["expirations"] += 1
+                self._remove(key)
+                entry = None
+            value = entry.parts.get(part) if entry is not None else None
+            if value is None:
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return value
+
+    def put(self, room_type, start_day, end_day, part, version, value, token):
+        """Guarda value salvo que desde token se haya invalidado un rango que lo afecte"""
+        if self.size <= 0:
+            return
+        key = (room_type, start_day, end_day)
+        with self._lock:
+            if self._stale(key, token):
+                return
+            entry = self._entries.get(key)
+            if entry is None or entry.version != version:
+                if entry is not None:
+                    self._remove(key)
+                entry = self._entries[key] = _Entry(version, self.clock() + self.ttl)
+                self._by_type.setdefault(room_type, set()).add(key)
+                while len(self._entries) > self.size:
+                    self._remove(next(iter(self._entries)))
+                    self._stats["evictions"] += 1
+            entry.parts[part] = value
+            self._entries.move_to_end(key)
+
+    def invalidate(self, room_type, start_day, end_day):
+        """Expulsa las entradas de room_type (y de ALL_TYPES) que se solapan con [start_day, end_day)"""
+        with self._lock:
+            self._generation += 1
+            self._recent.append((self._generation, room_type, start_day, end_day))
+            evicted = 0
+            for code in (room_type, ALL_TYPES):
+                for key in [key for key in self._by_type.get(code, ()) if _overlaps(key, start_day, end_day)]:
+                    self._remove(key)
+                    evicted += 1
+            self._stats["invalidations"] += evicted
+            return evicted
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._recent.clear()
+            self._entries.clear()
+            self._by_type.clear()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries), size=self.size, ttl=self.ttl)
+
+    def _stale(self, key, token):
+        if token == self._generation:
+            return False
+        # Se olvidaron invalidaciones posteriores a token (o hubo un clear): no arriesgar
+        if not self._recent or self._recent[0][0] > token + 1:
+            return True
+        room_type, start_day, end_day = key
+        return any(generation > token and (code == room_type or room_type == ALL_TYPES)
+                   and _overlaps(key, lo, hi)
+                   for generation, code, lo, hi in self._recent)
+
+    def _remove(self, key):
+        del self._entries[key]
+        keys = self._by_type.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_type[key[0]]
+
+
+def _overlaps(key, start_day, end_day):
+    return key[1] < end_day and start_day < key[2]
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(db_path=db.DB_PATH):
+    """Caché de búsqueda del proceso para una base de datos (un hotel)"""
+    key = str(db_path)
+    with _caches_lock:
+        cache = _caches.get(key)
+        if cache is None:
+            cache = _caches[key] = SearchCache()
+        return cache
@@ -0,0 +1,241 @@
+"""Generador de bases de datos de hotel a escala de producción.
+
+    python app/seed.py hotel_grande.db --rooms 50000 --bookings 10000000 --seed 7
+
+Crea una base nueva con tipos de habitación, habitaciones, usuarios, reservas
+y pagos con distribuciones realistas:
+
+- estacionalidad: más ocupación en verano y fin de año, y estancias más
+  largas en temporada alta;
+- duración de estancia de 1 a 14 noches, concentrada en 1-3;
+- antelación (lead time) exponencial; los pagos llevan la fecha de reserva;
+- clientes habituales: unos pocos usuarios acumulan muchas reservas;
+- sin solapamientos por habitación: cada habitación recorre su calendario.
+
+Para que 10M de reservas se generen en minutos, la carga desactiva el diario
+y la sincronización, inserta con executemany en transacciones grandes y crea
+índices y triggers al final, reutilizando las migraciones de db.py. La misma
+semilla (y --today) produce exactamente la misma base.
+"""
+import argparse
+import functools
+import math
+import random
+import sqlite3
+import sys
+import time
+from datetime import date, datetime, timezone
+from pathlib import Path
+
+import db
+
+BATCH_SIZE = 100_000
+ROOMS_PER_FLOOR = 50
+# Reparto de tipos (simple, doble, suite) y precio relativo por temporada
+TYPE_WEIGHTS = (50, 35, 15)
+MEAN_STAY = 2.2
+MEAN_GAP = 1.6          # noches libres medias entre reservas en temporada media
+MEAN_LEAD_DAYS = 30
+FUTURE_DAYS = 180       # las reservas llegan hasta ~6 meses por delante de --today
+
+# Durante la carga: sin diario ni fsync, en memoria y con bloqueo exclusivo
+LOAD_PRAGMAS = (
+    "PRAGMA journal_mode = OFF",
+    "PRAGMA synchronous = OFF",
+    "PRAGMA foreign_keys = OFF",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -262144",
+    "PRAGMA locking_mode = EXCLUSIVE",
+)
+
+
+@functools.lru_cache(maxsize=None)
+def season(day):
+    """Factor de demanda de un día (ordinal): ~1.35 a mediados de julio, ~0.65 en febrero"""
+    doy = date.fromordinal(day).timetuple().tm_yday
+    summer = math.cos(2 * math.pi * (doy - 196) / 365.25)
+    christmas = 0.25 if doy >= 355 or doy <= 5 else 0.0
+    return 1.0 + 0.35 * summer + christmas
+
+
+def deferred_objects(conn):
+    """Índices (salvo los de UNIQUE/PRIMARY KEY) y triggers que se crean después de la carga"""
+    return [(kind, name) for kind, name in conn.execute("""
+        SELECT type, name FROM sqlite_master
+        WHERE type IN ('index', 'trigger') AND name NOT LIKE 'sqlite_autoindex_%'
+    """)]
+
+
+def rebuild_deferred(conn):
+    """Vuelve a crear índices y triggers con las mismas migraciones que init_db (salvo la inicial)"""
+    cur = conn.cursor()
+    for version, migration, directory_only in db.MIGRATIONS:
+        if version > 1 and not directory_only:
+            migration(cur)
+
+
+def generate_rooms(rng, rooms):
+    for i in range(rooms):
+        floor, position = divmod(i, ROOMS_PER_FLOOR)
+        yield (i + 1, f"{floor + 1:04d}{position + 1:02d}", rng.choices((1, 2, 3), TYPE_WEIGHTS)[0])
+
+
+def generate_bookings(rng, rooms, bookings, users, today, prices, room_types):
+    """(booking, payment o None) en orden de id; cada habitación recorre su calendario sin solaparse"""
+    today_epoch = int(datetime(today.year, today.month, today.day, tzinfo=timezone.utc).timestamp())
+    today = today.toordinal()
+    per_room, extra = divmod(bookings, rooms)
+    # Historial hacia atrás lo bastante largo para que las reservas terminen en torno a hoy + FUTURE_DAYS
+    span = int((per_room + 1) * (MEAN_STAY + MEAN_GAP))
+    booking_id = 0
+    for room_id in range(1, rooms + 1):
+        price = prices[room_types[room_id - 1]]
+        day = today + FUTURE_DAYS - span + int(rng.random() * (MEAN_STAY + MEAN_GAP) * 4)
+        for _ in range(per_room + (room_id <= extra)):
+            demand = season(day)
+            day += int(rng.expovariate(demand / MEAN_GAP))
+            demand = season(day)
+            nights = min(14, 1 + int(rng.expovariate(1 / ((MEAN_STAY - 1) * demand))))
+            start_day, end_day = day, day + nights
+            day = end_day
+            booked_day = start_day - int(rng.expovariate(1 / MEAN_LEAD_DAYS))
+            # Clientes habituales: los ids bajos concentran las reservas
+            user_id = 1 + int(users * rng.random() ** 3)
+            total = round(price * nights * (0.75 + 0.25 * demand), 2)
+
+            roll = rng.random()
+            expires = None
+            if end_day <= today:
+                status = "CONFIRMED" if roll < 0.85 else ("CANCELLED" if roll < 0.93 else "EXPIRED")
+            elif booked_day >= today - 1 and roll < 0.3:
+                # Reservado en las últimas horas y aún sin pagar
+                status, expires = "PENDING_PAYMENT", today_epoch + int(rng.random() * db.HOLD_SECONDS)
+            else:
+                status = "CONFIRMED" if roll < 0.92 else "CANCELLED"
+            booked_day = min(booked_day, today)
+
+            booking_id += 1
+            start_date = date.fromordinal(start_day).isoformat()
+            end_date = date.fromordinal(end_day).isoformat()
+            payment = None
+            if status == "CONFIRMED":
+                payment = (booking_id, total, "APPROVED", f"{date.fromordinal(booked_day).isoformat()} 12:00:00")
+            yield (booking_id, user_id, room_id, start_date, end_date, total, status,
+                   start_day, end_day, expires), payment
+
+
+def check_sizes(rooms, bookings, users, batch_size):
+    """ValueError con un mensaje claro si algún tamaño no es válido"""
+    if rooms < 1:
+        raise ValueError("rooms debe ser al menos 1")
+    if bookings < 0:
+        raise ValueError("bookings no puede ser negativo")
+    if users is not None and users < 1:
+        raise ValueError("users debe ser al menos 1")
+    if batch_size < 1:
+        raise ValueError("batch_size debe ser al menos 1")
+
+
+def seed_database(path, rooms=1000, bookings=100_000, users=None, seed=1, today=None, batch_size=BATCH_SIZE,
+                  progress=None):
+    """Crea en path (que no debe existir) una base sintética; devuelve recuentos y segundos"""
+    check_sizes(rooms, bookings, users, batch_size)
+    path = Path(path)
+    if path.exists():
+        raise FileExistsError(path)
+    users = users or max(100, bookings // 20)
+    today = today or date.today()
+    rng = random.Random(seed)
+    started = time.perf_counter()
+
+    db.init_db(path, directory=False)
+    conn = sqlite3.connect(str(path), isolation_level=None)
+    try:
+        # journal_mode = OFF exige salir antes de WAL
+        conn.execute("PRAGMA journal_mode = DELETE")
+        for pragma in LOAD_PRAGMAS:
+            conn.execute(pragma)
+        for kind, name in deferred_objects(conn):
+            conn.execute(f"DROP {kind.upper()} {name}")
+
+        conn.execute("BEGIN")
+        conn.execute("DELETE FROM rooms")
+        prices = {row[0]: row[1] for row in conn.execute("SELECT id, price FROM room_types")}
+        room_rows = list(generate_rooms(rng, rooms))
+        conn.executemany("INSERT INTO rooms (id, room_number, room_type_id) VALUES (?, ?, ?)", room_rows)
+        conn.executemany("INSERT INTO users (id, username, password_hash) VALUES (?, ?, '!')",
+                         ((i, f"guest{i:08d}") for i in range(1, users + 1)))
+        conn.execute("COMMIT")
+
+        counts = {"rooms": rooms, "users": users, "bookings": 0, "payments": 0}
+        rows = generate_bookings(rng, rooms, bookings, users, today, prices, [row[2] for row in room_rows])
+        while True:
+            batch = [row for _, row in zip(range(batch_size), rows)]
+            if not batch:
+                break
+            payments = [payment for _, payment in batch if payment is not None]
+            conn.execute("BEGIN")
+            conn.executemany("""
+                INSERT INTO bookings (id, user_id, room_id, start_date, end_date, total_price, status,
+                                      start_day, end_day, hold_expires_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (booking for booking, _ in batch))
+            conn.executemany("INSERT INTO payments (booking_id, amount, status, created_at) VALUES (?, ?, ?, ?)",
+                             payments)
+            conn.execute("COMMIT")
+            counts["bookings"] += len(batch)
+            counts["payments"] += len(payments)
+            if progress:
+                progress(counts["bookings"], bookings)
+
+        conn.execute("BEGIN")
+        rebuild_deferred(conn)
+        conn.execute("COMMIT")
+        conn.execute("ANALYZE")
+        conn.execute("PRAGMA locking_mode = NORMAL")
+        conn.execute("PRAGMA journal_mode = WAL")
+    finally:
+        conn.close()
+    counts["seconds"] = time.perf_counter() - started
+    return counts
+
+
+def count(minimum):
+    """Tipo de argparse: entero >= minimum"""
+    def parse(text):
+        value = int(text)
+        if value < minimum:
+            raise argparse.ArgumentTypeError(f"debe ser un entero >= {minimum}")
+        return value
+    return parse
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Genera una base de hotel sintética y reproducible")
+    parser.add_argument("path", help="fichero SQLite a crear (no debe existir)")
+    parser.add_argument("--rooms", type=count(1), default=1000)
+    parser.add_argument("--bookings", type=count(0), default=100_000)
+    parser.add_argument("--users", type=count(1), help="por defecto, una por cada 20 reservas")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--today", type=date.fromisoformat, default=date.today(),
+                        help="fecha de referencia AAAA-MM-DD (fíjela para reproducir una base)")
+    parser.add_argument("--batch-size", type=count(1), default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    def progress(done, total):
+        print(f"\r{done}/{total} reservas", end="", flush=True)
+
+    try:
+        counts = seed_database(args.path, args.rooms, args.bookings, args.users, args.seed, args.today,
+                               args.batch_size, progress)
+    except FileExistsError:
+        print(f"{args.path} ya existe")
+        return 1
+    print(f"\nHabitaciones: {counts['rooms']}  usuarios: {counts['users']}  reservas: {counts['bookings']}  "
+          f"pagos: {counts['payments']}")
+    print(f"{counts['seconds']:.1f}s  ({counts['bookings'] / counts['seconds']:.0f} reservas/s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,212 @@
+"""Registro de consultas lentas con su plan de ejecución.
+
+Con HOTEL_SLOW_QUERY_MS definido, toda sentencia lanzada por una conexión de
+db.connect() que tarde más de esos milisegundos (execute más la lectura de sus
+filas) se anota con su SQL normalizado (literales y listas IN reducidos a ?),
+la forma de los parámetros (tipos, no valores), la duración y su EXPLAIN
+QUERY PLAN. Los registros van, en JSON por línea, a un fichero rotativo
+(HOTEL_SLOW_QUERY_LOG) y se agregan en memoria por huella (hash del SQL
+normalizado) para /api/stats.
+
+Sin la variable no se registra ningún observador; con ella, por debajo del
+umbral sólo cuesta una comparación. El plan se pide una vez por huella y se
+guarda en su agregado, que como mucho son MAX_FINGERPRINTS; `scan` marca los
+planes que recorren una tabla entera, como hacía el NOT IN con date() de la
+búsqueda original.
+
+    python app/slow_queries.py summary [fichero]   # agrega un log por huella
+"""
+import hashlib
+import json
+import logging
+import logging.handlers
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from pathlib import Path
+
+import db
+
+THRESHOLD_MS = float(os.environ["HOTEL_SLOW_QUERY_MS"]) if os.environ.get("HOTEL_SLOW_QUERY_MS") else None
+LOG_PATH = Path(os.environ.get("HOTEL_SLOW_QUERY_LOG", db.BASE / "logs" / "slow_queries.log"))
+LOG_MAX_BYTES = 5 * 1024 * 1024
+LOG_BACKUPS = 5
+MAX_FINGERPRINTS = 500
+EXPLAINABLE = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE", "REPLACE")
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"(?<![\w?])-?\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize(sql):
+    """SQL sin literales ni espacios redundantes: misma consulta, mismo texto"""
+    sql = _STRING.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    sql = _SPACES.sub(" ", sql).strip()
+    return _IN_LIST.sub("(?, ...)", sql)
+
+
+def fingerprint(normalized):
+    return hashlib.sha1(normalized.encode()).hexdigest()[:16]
+
+
+def parameter_shape(parameters):
+    """Tipos de los parámetros enlazados (los valores no se guardan)"""
+    if parameters is None:
+        return "executemany"
+    if isinstance(parameters, dict):
+        return {name: type(value).__name__ for name, value in parameters.items()}
+    shape = [type(value).__name__ for value in parameters]
+    if len(shape) > 20:
+        return shape[:20] + [f"... {len(shape)} en total"]
+    return shape
+
+
+def is_scan(plan):
+    """True si algún paso recorre una tabla o índice completo"""
+    return any(step.startswith("SCAN ") and "CONSTANT ROW" not in step for step in plan)
+
+
+class SlowQueryLog:
+    """Observador de db.Connection que anota las sentencias por encima del umbral"""
+
+    def __init__(self, threshold_ms=100, path=LOG_PATH, max_bytes=LOG_MAX_BYTES, backups=LOG_BACKUPS,
+                 max_fingerprints=MAX_FINGERPRINTS):
+        self.threshold = threshold_ms / 1000
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.max_fingerprints = max_fingerprints
+        self._logger = None
+        self._summary = {}   # huella -> agregado con su plan; como mucho max_fingerprints
+        self._lock = threading.Lock()
+
+    def _log(self):
+        if self._logger is None:
+            with self._lock:
+                if self._logger is None:
+                    self.path.parent.mkdir(parents=True, exist_ok=True)
+                    logger = logging.getLogger(f"hotel.slow_queries.{self.path}")
+                    logger.setLevel(logging.INFO)
+                    logger.propagate = False
+                    handler = logging.handlers.RotatingFileHandler(self.path, maxBytes=self.max_bytes,
+                                                                   backupCount=self.backups, encoding="utf-8")
+                    handler.setFormatter(logging.Formatter("%(message)s"))
+                    logger.addHandler(handler)
+                    self._logger = logger
+        return self._logger
+
+    def __call__(self, conn, sql, parameters, seconds):
+        if seconds < self.threshold:
+            return
+        try:
+            self.record(conn, sql, parameters, seconds)
+        except Exception:
+            # Nunca romper la consulta que se está midiendo
+            pass
+
+    def record(self, conn, sql, parameters, seconds):
+        normalized = normalize(sql)
+        key = fingerprint(normalized)
+        with self._lock:
+            summary = self._summary.get(key)
+        plan = summary["plan"] if summary is not None else self.explain(conn, sql, parameters)
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "fingerprint": key,
+            "ms": round(seconds * 1000, 3),
+            "sql": normalized,
+            "params": parameter_shape(parameters),
+            "plan": plan,
+            "scan": is_scan(plan),
+        }
+        with self._lock:
+            summary = self._summary.get(key)
+            if summary is None:
+                if len(self._summary) >= self.max_fingerprints:
+                    # La huella menos frecuente deja sitio a la nueva
+                    del self._summary[min(self._summary, key=lambda k: self._summary[k]["count"])]
+                summary = self._summary[key] = {"sql": normalized, "count": 0, "total_ms": 0.0, "max_ms": 0.0,
+                                                "plan": plan, "scan": entry["scan"]}
+            summary["count"] += 1
+            summary["total_ms"] += entry["ms"]
+            summary["max_ms"] = max(summary["max_ms"], entry["ms"])
+        self._log().info(json.dumps(entry, ensure_ascii=False))
+
+    def explain(self, conn, sql, parameters):
+        """EXPLAIN QUERY PLAN de la sentencia en la misma conexión; [] si no aplica"""
+        if parameters is None or not sql.lstrip().upper().startswith(EXPLAINABLE):
+            return []
+        # Cursor base de sqlite3: el EXPLAIN no pasa por los observadores
+        cursor = conn.cursor(sqlite3.Cursor)
+        try:
+            return [row[3] for row in cursor.execute("EXPLAIN QUERY PLAN " + sql, parameters)]
+        except Exception:
+            return []
+        finally:
+            cursor.close()
+
+    def summary(self, limit=20):
+        """Huellas ordenadas por tiempo total"""
+        with self._lock:
+            items = [dict(entry, fingerprint=key) for key, entry in self._summary.items()]
+        items.sort(key=lambda entry: entry["total_ms"], reverse=True)
+        return items[:limit]
+
+
+_log = None
+
+
+def get_log():
+    global _log
+    if _log is None:
+        _log = SlowQueryLog(THRESHOLD_MS if THRESHOLD_MS is not None else 100)
+    return _log
+
+
+def install():
+    """Registra el log global como observador sólo si HOTEL_SLOW_QUERY_MS está definido"""
+    if THRESHOLD_MS is not None and THRESHOLD_MS >= 0:
+        db.add_statement_observer(get_log())
+
+
+def summarize(lines):
+    """Agrega líneas del log por huella: [(huella, {...})] por tiempo total"""
+    summary = {}
+    for line in lines:
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            continue
+        item = summary.setdefault(entry["fingerprint"], {"sql": entry["sql"], "count": 0, "total_ms": 0.0,
+                                                         "max_ms": 0.0, "plan": entry["plan"],
+                                                         "scan": entry["scan"]})
+        item["count"] += 1
+        item["total_ms"] += entry["ms"]
+        item["max_ms"] = max(item["max_ms"], entry["ms"])
+    return sorted(summary.items(), key=lambda pair: pair[1]["total_ms"], reverse=True)
+
+
+def main():
+    if not sys.argv[1:2] == ["summary"]:
+        print(__doc__)
+        return 1
+    path = Path(sys.argv[2]) if len(sys.argv) > 2 else LOG_PATH
+    files = sorted(path.parent.glob(path.name + "*"), reverse=True)
+    lines = (line for file in files for line in file.open(encoding="utf-8"))
+    for key, item in summarize(lines):
+        flag = "  SCAN" if item["scan"] else ""
+        print(f"{key}  {item['count']:6d}x  total {item['total_ms']:10.1f} ms  max {item['max_ms']:8.1f} ms{flag}")
+        print(f"    {item['sql'][:200]}")
+        for step in item["plan"]:
+            print(f"      {step}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+"""Compara el camino WSGI (hilo por conexión) con el ASGI (asgi.py) ante clientes lentos.
+
+Cada cliente tarda --client-delay segundos en enviar su formulario de búsqueda,
+como una conexión móvil lenta. En WSGI ese tiempo ocupa un hilo del servidor;
+en ASGI sólo una corrutina, y los hilos se usan para el trabajo real.
+
+    python bench/asgi_bench.py --clients 500 --client-delay 0.2 --threads 32
+"""
+import argparse
+import asyncio
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urlencode
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+
+from app import app as flask_app  # noqa: E402
+import asgi  # noqa: E402
+from db import init_db  # noqa: E402
+
+FORM = {"start_date": "2026-03-01", "end_date": "2026-03-04", "room_type": "doble"}
+
+
+def run_wsgi(clients, delay, threads):
+    """Servidor con un hilo por conexión: el hilo espera al cliente lento"""
+    local = threading.local()
+
+    def handle(_):
+        time.sleep(delay)
+        client = getattr(local, "client", None)
+        if client is None:
+            client = local.client = flask_app.test_client()
+        return client.post("/search", data=FORM).status_code
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        statuses = list(pool.map(handle, range(clients)))
+    return time.perf_counter() - started, statuses
+
+
+async def run_asgi(clients, delay):
+    """Clientes lentos como corrutinas; sólo la vista pasa por el executor"""
+    body = urlencode(FORM).encode()
+    scope = {
+        "type": "http", "method": "POST", "path": "/search", "query_string": b"",
+        "headers": [(b"content-type", b"application/x-www-form-urlencoded"),
+                    (b"content-length", str(len(body)).encode())],
+        "http_version": "1.1", "scheme": "http",
+    }
+
+    async def one():
+        async def receive():
+            await asyncio.sleep(delay)
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        status = {}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+
+        await asgi.application(dict(scope), receive, send)
+        return status.get("code")
+
+    started = time.perf_counter()
+    statuses = await asyncio.gather(*(one() for _ in range(clients)))
+    return time.perf_counter() - started, statuses
+
+
+def report(name, elapsed, statuses, clients):
+    ok = sum(1 for status in statuses if status == 200)
+    print(f"{name:5s} {elapsed:8.2f}s {clients / elapsed:10.1f} req/s   ok={ok}/{clients}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=500)
+    parser.add_argument("--client-delay", type=float, default=0.2)
+    parser.add_argument("--threads", type=int, default=asgi.ASGI_WORKERS,
+                        help="hilos del servidor WSGI (mismo tamaño que el executor ASGI)")
+    args = parser.parse_args()
+
+    init_db()
+    flask_app.config["SEARCH_STREAMING"] = False
+    print(f"{args.clients} clientes, {args.client_delay * 1000:.0f} ms de envío cada uno, "
+          f"{args.threads} hilos")
+    report("WSGI", *run_wsgi(args.clients, args.client_delay, args.threads), args.clients)
+    report("ASGI", *asyncio.run(run_asgi(args.clients, args.client_delay)), args.clients)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,329 @@
+"""Prueba de carga del flujo completo: registro/login → búsqueda → reserva → pago.
+
+Cada usuario virtual se registra, inicia sesión y repite acciones elegidas al
+azar según --mix (search: una búsqueda; book: búsqueda + reserva; pay:
+búsqueda + reserva + pago) sobre rangos de fechas aleatorios. Por defecto usa
+el cliente de pruebas de Flask dentro del proceso; con --url ataca un
+servidor ya arrancado.
+
+Informa, por ruta, peticiones/s, latencias p50/p95/p99 y tasa de errores
+(excepciones y respuestas 5xx). --save guarda el resultado en JSON y
+--compare lo contrasta con una ejecución anterior:
+
+    python bench/load_test.py --users 16 --duration 30 --save bench/baselines/main.json
+    python bench/load_test.py --users 16 --duration 30 --compare bench/baselines/main.json
+    python bench/load_test.py --url http://localhost:5000 --rate 50 --mix search=8,book=1,pay=1
+
+Escribe usuarios (load_*) y reservas reales en la base configurada; en modo
+local se borran al terminar salvo con --keep-data. --property manda las
+reservas al shard de un hotel concreto.
+"""
+import argparse
+import http.cookiejar
+import json
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+
+ROOM_TYPES = ("simple", "doble", "suite")
+FIRST_DAY = date(2027, 1, 1)
+HORIZON_DAYS = 365
+MAX_NIGHTS = 7
+ROOM_ID = re.compile(rb'name="room_id" value="(\d+)"')
+BOOKING_ID = re.compile(rb"name='booking_id' value='(\d+)'")
+
+
+class Response:
+    __slots__ = ("status", "body")
+
+    def __init__(self, status, body):
+        self.status = status
+        self.body = body
+
+
+class LocalSession:
+    """Cliente de pruebas de Flask: sin red, mide sólo la aplicación"""
+
+    def __init__(self, flask_app):
+        self.client = flask_app.test_client()
+
+    def request(self, method, path, data=None):
+        response = self.client.open(path, method=method, data=data)
+        try:
+            return Response(response.status_code, response.get_data())
+        finally:
+            response.close()
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HttpSession:
+    """Cliente HTTP con cookies propias (una sesión de usuario por instancia)"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip("/")
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect())
+
+    def request(self, method, path, data=None):
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        request = urllib.request.Request(self.base_url + path, data=body, method=method)
+        try:
+            with self.opener.open(request, timeout=30) as response:
+                return Response(response.status, response.read())
+        except urllib.error.HTTPError as e:
+            # 3xx (sin seguir), 4xx y 5xx llegan como excepción
+            return Response(e.code, e.read())
+
+
+class Recorder:
+    """Latencias y códigos de estado por ruta"""
+
+    def __init__(self):
+        self.routes = {}
+        self._lock = threading.Lock()
+
+    def record(self, route, seconds, status):
+        with self._lock:
+            entry = self.routes.setdefault(route, {"latencies": [], "statuses": {}, "errors": 0})
+            entry["latencies"].append(seconds)
+            entry["statuses"][str(status)] = entry["statuses"].get(str(status), 0) + 1
+            if status is None or status >= 500:
+                entry["errors"] += 1
+
+    def summary(self, elapsed):
+        routes = {}
+        for route, entry in sorted(self.routes.items()):
+            latencies = sorted(entry["latencies"])
+            count = len(latencies)
+            routes[route] = {
+                "requests": count,
+                "rps": count / elapsed,
+                "p50_ms": percentile(latencies, 50) * 1000,
+                "p95_ms": percentile(latencies, 95) * 1000,
+                "p99_ms": percentile(latencies, 99) * 1000,
+                "max_ms": latencies[-1] * 1000,
+                "error_rate": entry["errors"] / count,
+                "statuses": entry["statuses"],
+            }
+        total = sum(route["requests"] for route in routes.values())
+        errors = sum(entry["errors"] for entry in self.routes.values())
+        return {"elapsed": elapsed, "requests": total, "rps": total / elapsed,
+                "error_rate": errors / total if total else 0.0, "routes": routes}
+
+
+def percentile(values, pct):
+    """Percentil por el método del rango más cercano sobre una lista ya ordenada"""
+    if not values:
+        return 0.0
+    rank = max(1, -(-pct * len(values) // 100))
+    return values[int(rank) - 1]
+
+
+def parse_mix(text):
+    """'search=7,book=2,pay=1' -> ([acciones], [pesos])"""
+    actions, weights = [], []
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name not in ("search", "book", "pay"):
+            raise argparse.ArgumentTypeError(f"acción desconocida: {name}")
+        actions.append(name)
+        weights.append(float(weight or 1))
+    return actions, weights
+
+
+class Pacer:
+    """Limita la tasa global de llegadas (peticiones/s) entre todos los usuarios"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.next_at = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.perf_counter()
+            slot = self.next_at = max(self.next_at + self.interval, now)
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class VirtualUser:
+    def __init__(self, number, session, recorder, pacer, args, rng):
+        self.username = f"load_{args.run_id}_{number}"
+        self.session = session
+        self.recorder = recorder
+        self.pacer = pacer
+        self.args = args
+        self.rng = rng
+
+    def call(self, route, method, path, data=None):
+        self.pacer.wait()
+        started = time.perf_counter()
+        try:
+            response = self.session.request(method, path, data)
+        except Exception:
+            self.recorder.record(route, time.perf_counter() - started, None)
+            return None
+        self.recorder.record(route, time.perf_counter() - started, response.status)
+        return response
+
+    def login(self):
+        credentials = {"username": self.username, "password": "load-test"}
+        self.call("register", "POST", "/register", credentials)
+        response = self.call("login", "POST", "/login", credentials)
+        return response is not None and response.status == 302
+
+    def search(self):
+        start = FIRST_DAY + timedelta(days=self.rng.randrange(HORIZON_DAYS))
+        end = start + timedelta(days=self.rng.randint(1, MAX_NIGHTS))
+        params = {"start_date": start.isoformat(), "end_date": end.isoformat(),
+                  "room_type": self.rng.choice(ROOM_TYPES), "property": self.args.property}
+        response = self.call("search", "GET", "/search?" + urllib.parse.urlencode(params))
+        rooms = ROOM_ID.findall(response.body) if response is not None and response.status == 200 else []
+        return params, rooms
+
+    def book(self, params, rooms):
+        if not rooms:
+            return None
+        response = self.call("book", "POST", "/book", {
+            "room_id": self.rng.choice(rooms).decode(), "start_date": params["start_date"],
+            "end_date": params["end_date"], "property": self.args.property})
+        match = BOOKING_ID.search(response.body) if response is not None and response.status == 200 else None
+        return match.group(1).decode() if match else None
+
+    def pay(self, booking_id):
+        self.call("pay", "POST", "/pay", {"booking_id": booking_id, "property": self.args.property})
+
+    def run(self, deadline, actions, weights):
+        if not self.login():
+            return
+        while time.perf_counter() < deadline:
+            action = self.rng.choices(actions, weights)[0]
+            params, rooms = self.search()
+            if action != "search":
+                booking_id = self.book(params, rooms)
+                if action == "pay" and booking_id:
+                    self.pay(booking_id)
+            if self.args.think:
+                time.sleep(self.rng.expovariate(1 / self.args.think))
+
+
+def cleanup(run_id):
+    """Borra los usuarios de la ejecución y sus reservas (directorio y shards)"""
+    import db
+    import properties
+    pattern = f"load\\_{run_id}\\_%"
+    paths = {prop["path"] for prop in properties.get_router(db.DB_PATH).properties()}
+    for path in sorted(paths, key=lambda path: path == db.DB_PATH):
+        with db.get_writer(path).connection() as conn:
+            users = "SELECT id FROM users WHERE username LIKE ? ESCAPE '\\'"
+            conn.execute(f"DELETE FROM payments WHERE booking_id IN "
+                         f"(SELECT id FROM bookings WHERE user_id IN ({users}))", (pattern,))
+            conn.execute(f"DELETE FROM bookings WHERE user_id IN ({users})", (pattern,))
+            conn.execute("DELETE FROM users WHERE username LIKE ? ESCAPE '\\'", (pattern,))
+            conn.commit()
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def report(summary, baseline=None):
+    print(f"{summary['requests']} peticiones en {summary['elapsed']:.1f}s: {summary['rps']:.1f} req/s, "
+          f"errores {summary['error_rate']:.2%}")
+    print(f"{'ruta':10s} {'n':>7s} {'req/s':>8s} {'p50 ms':>8s} {'p95 ms':>8s} {'p99 ms':>8s} {'error':>7s}")
+    for route, stats in summary["routes"].items():
+        line = (f"{route:10s} {stats['requests']:7d} {stats['rps']:8.1f} {stats['p50_ms']:8.1f} "
+                f"{stats['p95_ms']:8.1f} {stats['p99_ms']:8.1f} {stats['error_rate']:7.2%}")
+        before = (baseline or {}).get("routes", {}).get(route)
+        if before:
+            line += "   p95 {:+.0%}  req/s {:+.0%}".format(
+                stats["p95_ms"] / before["p95_ms"] - 1 if before["p95_ms"] else 0.0,
+                stats["rps"] / before["rps"] - 1 if before["rps"] else 0.0)
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="servidor a probar (por defecto, cliente de Flask en proceso)")
+    parser.add_argument("--users", type=int, default=8, help="usuarios virtuales concurrentes")
+    parser.add_argument("--duration", type=float, default=20.0, help="segundos de carga")
+    parser.add_argument("--rate", type=float, default=0.0, help="máximo de peticiones/s (0: sin límite)")
+    parser.add_argument("--think", type=float, default=0.0, help="pausa media entre acciones (s)")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("search=7,book=2,pay=1"))
+    parser.add_argument("--property", default="central", help="hotel al que van las búsquedas y reservas")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--save", help="guarda el resultado en este JSON")
+    parser.add_argument("--compare", help="JSON de una ejecución anterior con la que comparar")
+    parser.add_argument("--keep-data", action="store_true", help="no borrar usuarios y reservas al terminar")
+    args = parser.parse_args()
+    args.run_id = f"{int(time.time()) % 100000:05d}"
+
+    if args.url:
+        make_session = lambda: HttpSession(args.url)  # noqa: E731
+    else:
+        from app import app as flask_app
+        from db import init_db
+        init_db()
+        flask_app.config["SEARCH_STREAMING"] = False
+        make_session = lambda: LocalSession(flask_app)  # noqa: E731
+
+    recorder = Recorder()
+    pacer = Pacer(args.rate)
+    actions, weights = args.mix
+    started = time.perf_counter()
+    deadline = started + args.duration
+    users = [VirtualUser(i, make_session(), recorder, pacer, args, random.Random(args.seed * 1000 + i))
+             for i in range(args.users)]
+    threads = [threading.Thread(target=user.run, args=(deadline, actions, weights)) for user in users]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    summary = recorder.summary(time.perf_counter() - started)
+
+    if not args.url and not args.keep_data:
+        cleanup(args.run_id)
+
+    baseline = None
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text())["summary"]
+    report(summary, baseline)
+
+    if args.save:
+        result = {
+            "commit": git_commit(),
+            "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "target": args.url or "local",
+            "config": {"users": args.users, "duration": args.duration, "rate": args.rate, "think": args.think,
+                       "mix": dict(zip(actions, weights)), "property": args.property, "seed": args.seed},
+            "summary": summary,
+        }
+        path = Path(args.save)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(result, indent=2))
+        print(f"Resultado guardado en {path}")
+
+
+if __name__ == "__main__":
+    main()
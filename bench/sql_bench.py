@@ -0,0 +1,190 @@
+"""Microbenchmarks de las consultas SQL de producción sobre datos sintéticos.
+
+Genera con app/seed.py bases de distinto tamaño (habitaciones × reservas) y
+mide por separado cada consulta tal como la ejecuta la aplicación: se llama a
+la función de producción (app.available_page, booking.has_conflict, ...) y se captura con
+set_trace_callback el SQL que lanza, para acompañar los tiempos con su
+EXPLAIN QUERY PLAN. Al final imprime una tabla de escalado (mediana en ms por
+consulta y tamaño).
+
+    python bench/sql_bench.py
+    python bench/sql_bench.py --sizes 1000x10000,50000x10000000 --repeat 200 --json bench/sql.json
+
+Las bases generadas se guardan en --dir y se reutilizan entre ejecuciones.
+"""
+import argparse
+import json
+import random
+import statistics
+import sys
+import time
+from datetime import date
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+
+import db  # noqa: E402
+import app as web  # noqa: E402
+import availability  # noqa: E402
+import booking  # noqa: E402
+import catalog as catalog_module  # noqa: E402
+import holds  # noqa: E402
+import occupancy  # noqa: E402
+from seed import FUTURE_DAYS, seed_database  # noqa: E402
+
+DATA_DIR = Path(__file__).resolve().parent / "data"
+DEFAULT_SIZES = "1000x10000,10000x100000,50000x1000000"
+TODAY = date(2026, 1, 1).toordinal()
+ROOM_TYPES = ("simple", "doble", "suite")
+
+
+def parse_sizes(text):
+    sizes = []
+    for part in text.split(","):
+        rooms, _, bookings = part.lower().partition("x")
+        sizes.append((int(rooms), int(bookings)))
+    return sizes
+
+
+def database(directory, rooms, bookings, seed):
+    path = Path(directory) / f"sql_{rooms}_{bookings}_{seed}.db"
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        started = time.perf_counter()
+        seed_database(path, rooms, bookings, seed=seed, today=date.fromordinal(TODAY))
+        print(f"  generada {path.name} en {time.perf_counter() - started:.1f}s")
+    return path
+
+
+def search_range(rng):
+    # Donde hay reservas vigentes: de hoy a FUTURE_DAYS
+    start = TODAY + rng.randrange(FUTURE_DAYS)
+    return start, start + rng.randint(1, 7)
+
+
+# Cada caso recibe (conn, catalog, rng) y ejecuta una vez la función de producción
+def case_search_free(conn, catalog, rng):
+    web.available_page(conn, catalog, None, rng.choice(ROOM_TYPES), *search_range(rng), "", 50)
+
+
+def case_search_occupied(conn, catalog, rng):
+    list(web.occupied_numbers(conn, catalog, None, *search_range(rng)))
+
+
+def case_book_conflict(conn, catalog, rng):
+    booking.has_conflict(conn, rng.randint(1, len(catalog.room_numbers) - 1), *search_range(rng))
+
+
+def case_batch_availability(conn, catalog, rng):
+    queries = []
+    for _ in range(20):
+        start_day, end_day = search_range(rng)
+        queries.append((rng.choice(ROOM_TYPES), None, None, start_day, end_day))
+    availability.batch_from_sql(conn.cursor(), queries)
+
+
+def case_calendar_month(conn, catalog, rng):
+    month = date.fromordinal(TODAY + rng.randrange(FUTURE_DAYS))
+    occupancy.month_grid(conn, month.year, month.month)
+
+
+def case_expired_holds(conn, catalog, rng):
+    conn.execute(holds.EXPIRED_HOLDS, (holds.SWEEP_BATCH,)).fetchall()
+
+
+def case_catalog_load(conn, catalog, rng):
+    catalog_module.load(conn)
+
+
+CASES = {
+    "search_free": case_search_free,
+    "search_occupied": case_search_occupied,
+    "book_conflict": case_book_conflict,
+    "batch_availability": case_batch_availability,
+    "calendar_month": case_calendar_month,
+    "expired_holds": case_expired_holds,
+    "catalog_load": case_catalog_load,
+}
+
+
+def query_plans(conn, run):
+    """EXPLAIN QUERY PLAN de cada SELECT que lanza run()"""
+    statements = []
+    conn.set_trace_callback(statements.append)
+    try:
+        run()
+    finally:
+        conn.set_trace_callback(None)
+    plans = []
+    for sql in statements:
+        if sql.lstrip().upper().startswith(("SELECT", "WITH")):
+            plans.append([row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql)])
+    return plans
+
+
+def measure(path, repeat, seed):
+    conn = db.connect(path, readonly=True)
+    try:
+        catalog = catalog_module.load(conn)
+        results = {}
+        for name, case in CASES.items():
+            rng = random.Random(seed)
+            plans = query_plans(conn, lambda: case(conn, catalog, rng))
+            times = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                case(conn, catalog, rng)
+                times.append((time.perf_counter() - started) * 1000)
+            times.sort()
+            results[name] = {"median_ms": statistics.median(times),
+                             "p95_ms": times[max(0, -(-95 * len(times) // 100) - 1)],
+                             "plans": plans}
+        return results
+    finally:
+        conn.close()
+
+
+def report(sizes, results):
+    labels = [f"{rooms}x{bookings}" for rooms, bookings in sizes]
+    width = max(12, *(len(label) + 2 for label in labels))
+    print("\nMediana en ms por consulta (habitaciones x reservas)")
+    print(f"{'consulta':20s}" + "".join(f"{label:>{width}s}" for label in labels))
+    for name in CASES:
+        print(f"{name:20s}" + "".join(f"{results[label][name]['median_ms']:{width}.3f}" for label in labels))
+
+    print("\nPlanes de consulta")
+    for name in CASES:
+        shown = None
+        for label in labels:
+            plans = results[label][name]["plans"]
+            if plans != shown:
+                print(f"{name} [{label}]")
+                for plan in plans:
+                    print("    " + " | ".join(plan))
+                shown = plans
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=parse_sizes, default=parse_sizes(DEFAULT_SIZES),
+                        help="habitacionesxreservas separados por comas")
+    parser.add_argument("--repeat", type=int, default=100, help="ejecuciones por consulta y tamaño")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--dir", default=str(DATA_DIR), help="carpeta de las bases generadas")
+    parser.add_argument("--json", help="guarda tiempos y planes en este fichero")
+    args = parser.parse_args()
+
+    results = {}
+    for rooms, bookings in args.sizes:
+        print(f"{rooms} habitaciones, {bookings} reservas")
+        path = database(args.dir, rooms, bookings, args.seed)
+        results[f"{rooms}x{bookings}"] = measure(path, args.repeat, args.seed)
+    report(args.sizes, results)
+
+    if args.json:
+        Path(args.json).write_text(json.dumps({"repeat": args.repeat, "seed": args.seed, "results": results},
+                                              indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -5,8 +5,12 @@ from pathlib import Path
 # Agregar el directorio app al path
 sys.path.insert(0, str(Path(__file__).parent.parent / "app"))
 
-from app import app
-from db import init_db, connect
+from app import app, DB_PATH
+import occupancy
+import booking as booking_engine
+import search_cache
+import inventory
+from db import init_db, connect, day_number, migrate_booking_days, ConnectionPool, forget
 from werkzeug.security import check_password_hash
 
 @pytest.fixture(scope="function")
@@ -14,6 +18,9 @@ def client():
     """Crea un cliente de prueba con base de datos limpia"""
     app.config["TESTING"] = True
     app.config["SECRET_KEY"] = "test-secret-key"
+    # Las respuestas en streaming mantienen el contexto hasta consumirse;
+    # los tests que sólo miran status_code usan el render normal
+    app.config["SEARCH_STREAMING"] = False
     
     # Inicializar BD de prueba
     init_db()
@@ -29,7 +36,10 @@ def client():
     cur.execute("DELETE FROM bookings")
     cur.execute("DELETE FROM payments")
     conn.commit()
+    # Como tras editar a mano: publicar la versión para que sync() descuente los DELETE
+    inventory.publish(conn, DB_PATH)
     conn.close()
+    search_cache.get_cache(DB_PATH).clear()
 
 
 @pytest.fixture
@@ -106,6 +116,285 @@ def test_initial_data_loaded():
     conn.close()
 
 
+def test_connection_pool_reuses_configured_connections(tmp_path):
+    """El pool debe reutilizar conexiones ya configuradas (WAL, foreign keys)"""
+    pool = ConnectionPool(tmp_path / "pool.db", size=2)
+    conn = pool.acquire()
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert conn.execute("PRAGMA foreign_keys").fetchone()[0] == 1
+    pool.release(conn)
+
+    assert pool.acquire() is conn
+    stats = pool.stats()
+    assert stats["created"] == 1
+    assert stats["reused"] == 1
+    assert stats["in_use"] == 1
+    pool.release(conn)
+    pool.close_all()
+
+
+def test_pool_stats_endpoint(client):
+    """/api/stats debe exponer las estadísticas del pool"""
+    client.get("/register")
+    response = client.post("/api/availability", json={"queries": [
+        ["simple", "2026-01-01", "2026-01-02"]
+    ]})
+    assert response.status_code == 200
+    pool = client.get("/api/stats").get_json()["pool"]
+    assert pool["in_use"] == 0
+    assert pool["idle"] >= 1
+
+
+def test_metrics_endpoint_exposes_routes_sql_and_gauges(client):
+    """/metrics publica latencias por ruta, sentencias SQL por petición y gauges de pools y cachés"""
+    import re
+    client.get("/search?start_date=2026-11-01&end_date=2026-11-02&room_type=suite")
+    client.get("/no-existe")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    text = response.get_data(as_text=True)
+
+    assert re.search(r'^hotel_http_requests_total\{route="/search",method="GET",status="200"\} [1-9]', text, re.M)
+    assert 'route="unmatched",method="GET",status="404"' in text
+    assert re.search(r'^hotel_http_request_duration_seconds_bucket\{route="/search",le="\+Inf"\} [1-9]', text, re.M)
+    statements = re.search(r'^hotel_request_sql_statements_sum\{route="/search"\} (\d+)', text, re.M)
+    assert int(statements.group(1)) >= 2
+    assert re.search(r'^hotel_sql_statements_total\{op="SELECT"\} [1-9]', text, re.M)
+    assert 'hotel_pool_connections{property="central",mode="read",state="in_use"} 0' in text
+    assert 'hotel_search_cache{property="central",stat="entries"}' in text
+
+
+def test_statement_observers_time_row_fetching(tmp_path):
+    """El tiempo de una sentencia incluye la lectura de sus filas, no sólo execute()"""
+    import time
+    import db
+    seen = []
+    def observer(conn, sql, parameters, seconds):
+        if "slow(x)" in sql:
+            seen.append((sql, seconds))
+    conn = connect(tmp_path / "observed.db")
+    conn.create_function("slow", 1, lambda value: time.sleep(0.01) or value)
+    conn.execute("CREATE TABLE t (x INTEGER)")
+    conn.executemany("INSERT INTO t VALUES (?)", [(i,) for i in range(10)])
+    db.add_statement_observer(observer)
+    try:
+        assert len(conn.execute("SELECT slow(x) FROM t").fetchall()) == 10
+        assert sum(1 for _ in conn.execute("SELECT slow(x) FROM t WHERE x < 5")) == 5
+        conn.execute("SELECT slow(x) FROM t").fetchone()
+    finally:
+        db._observers.remove(observer)
+        conn.close()
+    assert [sql for sql, _ in seen] == ["SELECT slow(x) FROM t", "SELECT slow(x) FROM t WHERE x < 5",
+                                        "SELECT slow(x) FROM t"]
+    assert seen[0][1] >= 0.09 and seen[1][1] >= 0.045
+
+
+def test_slow_query_log_records_plan_by_fingerprint(tmp_path):
+    """Las sentencias lentas se anotan normalizadas, con su plan, y se agregan por huella"""
+    import json
+    import slow_queries
+    log = slow_queries.SlowQueryLog(threshold_ms=50, path=tmp_path / "slow.log")
+    conn = connect(readonly=True)
+    sql = "SELECT id FROM bookings WHERE date(start_date) >= '2026-01-01' AND total_price IN (?, ?)"
+    log(conn, sql, (1, "2"), 0.001)
+    log(conn, sql, (1, "2"), 0.2)
+    log(conn, sql.replace("2026-01-01", "2027-03-05"), (3, 4), 0.1)
+    conn.close()
+
+    lines = [json.loads(line) for line in (tmp_path / "slow.log").read_text().splitlines()]
+    assert len(lines) == 2
+    first = lines[0]
+    assert first["sql"] == "SELECT id FROM bookings WHERE date(start_date) >= ? AND total_price IN (?, ...)"
+    assert first["params"] == ["int", "str"] and first["ms"] == 200.0
+    assert first["scan"] and any(step.startswith("SCAN bookings") for step in first["plan"])
+    assert lines[1]["fingerprint"] == first["fingerprint"]
+
+    [summary] = log.summary()
+    assert summary["count"] == 2 and summary["max_ms"] == 200.0 and summary["total_ms"] == 300.0
+    [(key, item)] = slow_queries.summarize((tmp_path / "slow.log").read_text().splitlines())
+    assert key == first["fingerprint"] and item["count"] == 2
+
+
+def test_slow_query_log_is_bounded_and_opt_in(tmp_path, monkeypatch):
+    """Las huellas (y sus planes) están acotadas; sin HOTEL_SLOW_QUERY_MS no se registra observador"""
+    import db
+    import slow_queries
+    log = slow_queries.SlowQueryLog(threshold_ms=0, path=tmp_path / "slow.log", max_fingerprints=2)
+    conn = connect(readonly=True)
+    for table in ("rooms", "rooms", "room_types", "users"):
+        log(conn, f"SELECT * FROM {table}", (), 0.01)
+    conn.close()
+    assert [entry["sql"] for entry in log.summary()] == ["SELECT * FROM rooms", "SELECT * FROM users"]
+
+    monkeypatch.setattr(slow_queries, "THRESHOLD_MS", None)
+    monkeypatch.setattr(db, "_observers", [])
+    slow_queries.install()
+    assert db._observers == []
+
+
+def test_readonly_connections_reject_writes():
+    """Las conexiones de lectura se abren con mode=ro"""
+    import sqlite3
+    conn = connect(readonly=True)
+    assert conn.execute("SELECT COUNT(*) FROM rooms").fetchone()[0] >= 10
+    with pytest.raises(sqlite3.OperationalError):
+        conn.execute("DELETE FROM rooms")
+    conn.close()
+
+
+def test_routes_declare_db_intent():
+    """Las vistas declaran si leen o escriben"""
+    assert app.view_functions["search"].db_intent == "read"
+    assert app.view_functions["api_availability"].db_intent == "read"
+    assert app.view_functions["book"].db_intent == "write"
+    assert app.view_functions["api_book_group"].db_intent == "write"
+
+
+def test_search_not_blocked_by_open_write(client):
+    """Una escritura en curso no bloquea la búsqueda, que ve la última instantánea confirmada"""
+    from db import get_writer
+    writer = get_writer(DB_PATH)
+    conn = writer.acquire()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("INSERT INTO users (username, password_hash) VALUES ('test_writer', 'x')")
+        user_id = conn.execute("SELECT id FROM users WHERE username = 'test_writer'").fetchone()[0]
+        conn.execute("""
+            INSERT INTO bookings (user_id, room_id, start_date, end_date, total_price, status, start_day, end_day)
+            VALUES (?, 8, '2026-08-01', '2026-08-03', 440, 'CONFIRMED', ?, ?)
+        """, (user_id, day_number("2026-08-01"), day_number("2026-08-03")))
+
+        response = client.post("/search", data={
+            "start_date": "2026-08-01", "end_date": "2026-08-03", "room_type": "suite"
+        })
+        assert response.status_code == 200
+        assert b'name="room_id" value="8"' in response.data
+    finally:
+        writer.release(conn)
+    assert not conn.in_transaction
+
+
+def test_booking_days_migration(tmp_path):
+    """Bases antiguas deben recibir start_day/end_day e índices de solapamiento"""
+    import sqlite3
+    conn = sqlite3.connect(str(tmp_path / "old.db"))
+    cur = conn.cursor()
+    cur.execute("""
+        CREATE TABLE bookings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL,
+            room_id INTEGER NOT NULL, start_date TEXT NOT NULL, end_date TEXT NOT NULL,
+            total_price REAL NOT NULL, status TEXT NOT NULL
+        )
+    """)
+    cur.execute("INSERT INTO bookings (user_id, room_id, start_date, end_date, total_price, status) "
+                "VALUES (1, 1, '2025-12-01', '2025-12-05', 320, 'CONFIRMED')")
+
+    migrate_booking_days(cur)
+
+    cur.execute("SELECT start_day, end_day FROM bookings")
+    assert tuple(cur.fetchone()) == (day_number("2025-12-01"), day_number("2025-12-05"))
+
+    cur.execute("EXPLAIN QUERY PLAN SELECT 1 FROM bookings WHERE room_id = ? AND end_day > ? AND start_day < ?",
+                (1, 0, 0))
+    plan = " ".join(row[3] for row in cur.fetchall())
+    assert "idx_bookings_room_days" in plan
+    conn.close()
+
+
+def test_init_db_versions_schema_and_seeds_once(tmp_path):
+    """Una base nueva queda en SCHEMA_VERSION; con la versión al día init_db no toca nada"""
+    from db import SCHEMA_VERSION, schema_version
+    path = tmp_path / "fresh.db"
+    init_db(path)
+    conn = connect(path)
+    assert schema_version(conn) == SCHEMA_VERSION
+    assert conn.execute("SELECT COUNT(*) FROM rooms").fetchone()[0] == 10
+    conn.execute("DELETE FROM rooms WHERE room_number = '110'")
+    conn.commit()
+    conn.close()
+
+    init_db(path)
+    conn = connect(path)
+    assert conn.execute("SELECT COUNT(*) FROM rooms").fetchone()[0] == 9
+    conn.close()
+
+
+def test_init_db_applies_only_pending_migrations(tmp_path):
+    """Una base en una versión anterior recibe sólo las migraciones que le faltan"""
+    from db import SCHEMA_VERSION, schema_version, migrate
+    path = tmp_path / "old.db"
+    init_db(path, directory=False)
+    conn = connect(path)
+    conn.execute("DROP INDEX idx_bookings_hold_expiry")
+    conn.execute("PRAGMA user_version = 5")
+    conn.commit()
+
+    assert migrate(conn, directory=False) == list(range(6, SCHEMA_VERSION + 1))
+    assert schema_version(conn) == SCHEMA_VERSION
+    indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert "idx_bookings_hold_expiry" in indexes
+    # Los shards no llevan la tabla del directorio
+    assert "properties" not in {row[0] for row in conn.execute("SELECT name FROM sqlite_master")}
+    assert migrate(conn) == []
+    conn.close()
+
+
+def test_seed_database_is_deterministic(tmp_path):
+    """El generador masivo es reproducible, no solapa reservas y deja índices y triggers"""
+    from datetime import date
+    from db import SCHEMA_VERSION, schema_version
+    from seed import seed_database
+    dumps = []
+    for name in ("a.db", "b.db"):
+        counts = seed_database(tmp_path / name, rooms=20, bookings=500, seed=5, today=date(2026, 6, 1),
+                               batch_size=128)
+        assert (counts["rooms"], counts["bookings"]) == (20, 500)
+        conn = connect(tmp_path / name)
+        dumps.append(conn.execute("SELECT * FROM bookings ORDER BY id").fetchall())
+        assert conn.execute("""
+            SELECT COUNT(*) FROM bookings x JOIN bookings y
+            ON x.room_id = y.room_id AND x.id < y.id AND x.end_day > y.start_day AND x.start_day < y.end_day
+        """).fetchone()[0] == 0
+        assert conn.execute("SELECT COUNT(*) FROM payments").fetchone()[0] == counts["payments"]
+        objects = {row[0] for row in conn.execute("SELECT name FROM sqlite_master")}
+        assert {"idx_bookings_room_days", "idx_payments_booking", "trg_bookings_insert_inventory"} <= objects
+        assert schema_version(conn) == SCHEMA_VERSION
+        conn.close()
+    assert [tuple(row) for row in dumps[0]] == [tuple(row) for row in dumps[1]]
+
+
+def test_seed_database_rejects_invalid_sizes(tmp_path):
+    """Tamaños nulos o negativos fallan con ValueError antes de crear el fichero"""
+    from seed import seed_database
+    for sizes in ({"rooms": 0}, {"bookings": -1}, {"users": 0}, {"batch_size": 0}):
+        with pytest.raises(ValueError):
+            seed_database(tmp_path / "x.db", **sizes)
+        assert not (tmp_path / "x.db").exists()
+
+
+def test_catalog_cache_follows_catalog_version(client):
+    """Editar room_types debe cambiar catalog_version y recargar la caché"""
+    from catalog import get_catalog
+    conn = connect()
+    catalog = get_catalog(conn, DB_PATH)
+    assert catalog.price(1) == 80.0
+    assert catalog.rooms_by_type["suite"].tolist() == [8, 9, 10]
+    assert get_catalog(conn, DB_PATH) is catalog
+
+    try:
+        conn.execute("UPDATE room_types SET price = 95.0 WHERE code = 'simple'")
+        conn.commit()
+        reloaded = get_catalog(conn, DB_PATH)
+        assert reloaded is not catalog
+        assert reloaded.version > catalog.version
+        assert reloaded.price(1) == 95.0
+    finally:
+        conn.execute("UPDATE room_types SET price = 80.0 WHERE code = 'simple'")
+        conn.commit()
+        conn.close()
+
+
 # ==============================================================================
 # TESTS DE REGISTRO (RF-001)
 # ==============================================================================
@@ -187,6 +476,33 @@ def test_register_empty_fields(client):
     assert b"requerido" in response.data.lower() or b"required" in response.data.lower()
 
 
+def test_bulk_user_import(client, tmp_path):
+    """La importación CSV debe insertar por lotes y contar duplicados"""
+    from import_users import import_users
+    client.post("/register", data={"username": "test_import_existing", "password": "password123"})
+
+    plain = tmp_path / "plain.csv"
+    plain.write_text("username,password\n"
+                     "test_import_a,secret1\n"
+                     "test_import_b,secret2\n"
+                     "test_import_a,again\n"
+                     "test_import_existing,secret3\n"
+                     ",missing\n", encoding="utf-8")
+    stats = import_users(plain, batch_size=2, workers=0, method="pbkdf2:sha256:1000")
+    assert (stats["read"], stats["inserted"], stats["duplicates"], stats["invalid"]) == (5, 2, 2, 1)
+
+    hashed = tmp_path / "hashed.csv"
+    hashed.write_text("username,password_hash\ntest_import_c,pbkdf2:sha256:1000$abc$def\n", encoding="utf-8")
+    assert import_users(hashed, workers=0)["inserted"] == 1
+
+    conn = connect()
+    rows = dict(conn.execute("SELECT username, password_hash FROM users "
+                             "WHERE username LIKE 'test_import_%'").fetchall())
+    conn.close()
+    assert check_password_hash(rows["test_import_a"], "secret1")
+    assert rows["test_import_c"] == "pbkdf2:sha256:1000$abc$def"
+
+
 # ==============================================================================
 # TESTS DE LOGIN (RF-002)
 # ==============================================================================
@@ -282,6 +598,70 @@ def test_login_stores_username_in_session(client):
         assert session["username"] == "test_username_session"
 
 
+def test_login_rehashes_outdated_password_hash(client):
+    """Un hash con parámetros antiguos debe actualizarse tras un login correcto"""
+    from werkzeug.security import generate_password_hash
+    from hashing import get_service
+    conn = connect()
+    conn.execute("INSERT INTO users (username, password_hash) VALUES (?, ?)",
+                 ("test_old_hash", generate_password_hash("password123", method="pbkdf2:sha256:1000")))
+    conn.commit()
+    conn.close()
+
+    response = client.post("/login", data={"username": "test_old_hash", "password": "password123"},
+                           follow_redirects=True)
+    assert b"Bienvenido" in response.data
+
+    conn = connect()
+    stored = conn.execute("SELECT password_hash FROM users WHERE username = 'test_old_hash'").fetchone()[0]
+    conn.close()
+    assert stored.startswith(get_service().method + "$")
+    assert check_password_hash(stored, "password123")
+
+
+def test_hashing_service_fails_fast_when_saturated():
+    """Con todos los huecos ocupados el servicio debe rechazar al momento"""
+    from hashing import HashingService, HashingBusy
+    service = HashingService(workers=0, queue_limit=0, method="pbkdf2:sha256:1000")
+    assert service.verify(service.hash("secret"), "secret")
+
+    service._slots.acquire()
+    with pytest.raises(HashingBusy):
+        service.hash("secret")
+    service._slots.release()
+    assert service.stats()["rejected"] == 1
+
+
+def test_needs_rehash_accepts_method_without_parameters():
+    """HOTEL_HASH_METHOD sin parámetros ("scrypt") no debe rehashear en cada login"""
+    from hashing import HashingService
+    for method in ("scrypt", "pbkdf2:sha256", "pbkdf2:sha256:1000"):
+        service = HashingService(workers=0, method=method)
+        assert not service.needs_rehash(service.hash("secret"))
+    old_hash = HashingService(workers=0, method="pbkdf2:sha256:1000").hash("secret")
+    assert HashingService(workers=0, method="scrypt").needs_rehash(old_hash)
+
+
+def test_hashing_slot_held_until_work_finishes(monkeypatch):
+    """Un trabajo que supera HASH_TIMEOUT sigue ocupando su hueco hasta que el proceso termina"""
+    import time
+    import hashing
+    monkeypatch.setattr(hashing, "HASH_TIMEOUT", 0.1)
+    service = hashing.HashingService(workers=1, queue_limit=0)
+    try:
+        with pytest.raises(TimeoutError):
+            service._run(time.sleep, 3)
+        with pytest.raises(hashing.HashingBusy):
+            service._run(time.sleep, 0)
+        deadline = time.monotonic() + 10
+        while not service._slots.acquire(blocking=False):
+            assert time.monotonic() < deadline
+            time.sleep(0.05)
+        service._slots.release()
+    finally:
+        service.shutdown()
+
+
 # ==============================================================================
 # TESTS DE LOGOUT (RF-003)
 # ==============================================================================
@@ -360,6 +740,46 @@ def test_search_excludes_occupied_rooms(authenticated_client):
     assert response.status_code == 200
 
 
+def test_search_paginates_by_room_number(client):
+    """La búsqueda debe paginar por room_number con un enlace a la página siguiente"""
+    app.config["SEARCH_PAGE_SIZE"] = 2
+    try:
+        first = client.post("/search", data={
+            "start_date": "2026-07-01", "end_date": "2026-07-03", "room_type": "simple"
+        }).data
+        second = client.post("/search", data={
+            "start_date": "2026-07-01", "end_date": "2026-07-03", "room_type": "simple", "after": "102"
+        }).data
+    finally:
+        app.config["SEARCH_PAGE_SIZE"] = 50
+
+    assert b'name="room_id" value="1"' in first and b'name="room_id" value="2"' in first
+    assert b'name="room_id" value="3"' not in first
+    assert b'name="after" value="102"' in first
+    assert b'name="room_id" value="3"' in second and b'name="room_id" value="4"' in second
+    assert b'name="after"' not in second
+
+
+def test_search_streaming_releases_connection(authenticated_client):
+    """El render en streaming debe devolver la conexión al pool al terminar"""
+    from db import get_pool
+    client = authenticated_client
+    client.post("/book", data={"room_id": "2", "start_date": "2026-07-01", "end_date": "2026-07-04"})
+
+    app.config["SEARCH_STREAMING"] = True
+    try:
+        response = client.post("/search", data={
+            "start_date": "2026-07-02", "end_date": "2026-07-03", "room_type": "simple"
+        })
+        assert response.is_streamed
+        body = response.get_data()
+    finally:
+        app.config["SEARCH_STREAMING"] = False
+
+    assert "Habitación 102 - Ocupada".encode() in body
+    assert get_pool(DB_PATH, readonly=True).stats()["in_use"] == 0
+
+
 def test_search_shows_available_rooms(client):
     """TC-017: Búsqueda debe mostrar lista de habitaciones disponibles"""
     response = client.post("/search", data={
@@ -373,6 +793,222 @@ def test_search_shows_available_rooms(client):
     assert b"10" in response.data or b"Habitaciones" in response.data
 
 
+def test_api_availability_batch(authenticated_client):
+    """La API por lotes debe responder varias consultas en una llamada"""
+    client = authenticated_client
+    client.post("/book", data={
+        "room_id": "1",
+        "start_date": "2026-02-10",
+        "end_date": "2026-02-12"
+    })
+
+    response = client.post("/api/availability", json={"queries": [
+        {"room_type": "simple", "start_date": "2026-02-10", "end_date": "2026-02-12"},
+        ["simple", "2026-02-12", "2026-02-14"],
+        ["suite", "2026-02-10", "2026-02-12"],
+    ]})
+
+    assert response.status_code == 200
+    results = response.get_json()["results"]
+    assert len(results) == 3
+    assert "101" not in results[0]["available"]
+    assert "101" in results[1]["available"]
+    assert results[2]["available"] == ["108", "109", "110"]
+    assert results[2]["total"] == 440.0
+
+
+def test_api_availability_rejects_invalid_range(client):
+    """La API por lotes debe rechazar rangos inválidos con 400"""
+    response = client.post("/api/availability", json=[["simple", "2026-02-12", "2026-02-10"]])
+    assert response.status_code == 400
+    assert "error" in response.get_json()
+
+
+SEARCH_QUERY = "/search?start_date=2026-09-01&end_date=2026-09-03&room_type=doble"
+
+
+def test_search_get_revalidates_with_etag(authenticated_client):
+    """GET /search lleva ETag y Last-Modified; sin cambios responde 304"""
+    client = authenticated_client
+    first = client.get(SEARCH_QUERY)
+    assert first.status_code == 200
+    assert first.headers["ETag"] and first.headers["Last-Modified"]
+    assert "no-cache" in first.headers["Cache-Control"]
+
+    again = client.get(SEARCH_QUERY, headers={"If-None-Match": first.headers["ETag"]})
+    assert again.status_code == 304
+    assert again.data == b""
+
+    # Reservar cambia la versión de inventario y con ella el ETag
+    client.post("/book", data={"room_id": "5", "start_date": "2026-09-01", "end_date": "2026-09-02"})
+    changed = client.get(SEARCH_QUERY, headers={"If-None-Match": first.headers["ETag"]})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != first.headers["ETag"]
+    assert b'name="room_id" value="5"' not in changed.data
+
+
+def test_not_modified_skips_database_and_templates(client, monkeypatch):
+    """El 304 se decide sin abrir conexiones ni renderizar"""
+    import app as app_module
+    etag = client.get(SEARCH_QUERY).headers["ETag"]
+
+    def fail(*args, **kwargs):
+        raise AssertionError("no debería usarse")
+
+    monkeypatch.setattr(app_module, "get_db", fail)
+    monkeypatch.setattr(app_module, "render_template", fail)
+    assert client.get(SEARCH_QUERY, headers={"If-None-Match": etag}).status_code == 304
+
+
+def test_search_cache_invalidates_only_overlapping_ranges():
+    """Una reserva expulsa sólo las entradas de su tipo (y ALL_TYPES) que se solapan"""
+    cache = search_cache.SearchCache(size=10, ttl=60)
+    keys = [("doble", 10, 12), ("doble", 20, 22), ("suite", 10, 12), (search_cache.ALL_TYPES, 10, 12),
+            (search_cache.ALL_TYPES, 12, 14)]
+    token = cache.token()
+    for key in keys:
+        cache.put(*key, "page", 1, ["x"], token)
+
+    assert cache.invalidate("doble", 11, 12) == 2
+    assert cache.get("doble", 10, 12, "page", 1) is None
+    assert cache.get(search_cache.ALL_TYPES, 10, 12, "page", 1) is None
+    for key in [("doble", 20, 22), ("suite", 10, 12), (search_cache.ALL_TYPES, 12, 14)]:
+        assert cache.get(*key, "page", 1) == ["x"]
+
+    # Un resultado leído antes de la invalidación no se guarda
+    cache.put("doble", 10, 12, "page", 1, ["viejo"], token)
+    assert cache.get("doble", 10, 12, "page", 1) is None
+    cache.put("doble", 30, 32, "page", 1, ["x"], token)
+    assert cache.get("doble", 30, 32, "page", 1) == ["x"]
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["invalidations"]) == (4, 3, 2)
+
+
+def test_search_cache_lru_and_ttl():
+    """Tamaño máximo con expulsión LRU y caducidad por TTL o cambio de catálogo"""
+    now = [0.0]
+    cache = search_cache.SearchCache(size=2, ttl=30, clock=lambda: now[0])
+    token = cache.token()
+    cache.put("simple", 1, 2, "page", 1, ["a"], token)
+    cache.put("simple", 2, 3, "page", 1, ["b"], token)
+    assert cache.get("simple", 1, 2, "page", 1) == ["a"]
+    cache.put("simple", 3, 4, "page", 1, ["c"], token)
+    assert cache.get("simple", 2, 3, "page", 1) is None
+    assert cache.stats()["evictions"] == 1
+
+    assert cache.get("simple", 3, 4, "page", 2) is None
+    now[0] = 31
+    assert cache.get("simple", 1, 2, "page", 1) is None
+    assert cache.stats()["expirations"] == 2
+
+
+def test_search_served_from_cache_until_booking(authenticated_client):
+    """La segunda búsqueda sale de la caché; reservar en el rango la invalida"""
+    client = authenticated_client
+    cache = search_cache.get_cache(DB_PATH)
+    client.get(SEARCH_QUERY)
+    hits = cache.stats()["hits"]
+    assert b'name="room_id" value="5"' in client.get(SEARCH_QUERY).data
+    assert cache.stats()["hits"] == hits + 1
+
+    client.post("/book", data={"room_id": "5", "start_date": "2026-09-02", "end_date": "2026-09-04"})
+    assert cache.stats()["invalidations"] >= 1
+    assert b'name="room_id" value="5"' not in client.get(SEARCH_QUERY).data
+    stats = client.get("/api/stats").get_json()["search_cache"]
+    assert stats["entries"] >= 1
+
+
+def test_search_cache_stays_warm_for_unrelated_bookings(authenticated_client):
+    """Reservas de otro tipo o de otras fechas, de este proceso o de otro, no expulsan la búsqueda cacheada"""
+    import inventory
+    client = authenticated_client
+    cache = search_cache.get_cache(DB_PATH)
+    client.get(SEARCH_QUERY)
+
+    def hits_after_search():
+        hits = cache.stats()["hits"]
+        data = client.get(SEARCH_QUERY).data
+        return cache.stats()["hits"] - hits, data
+
+    client.post("/book", data={"room_id": "1", "start_date": "2026-09-01", "end_date": "2026-09-03"})
+    assert hits_after_search()[0] == 1
+    client.post("/book", data={"room_id": "5", "start_date": "2026-10-01", "end_date": "2026-10-03"})
+    assert hits_after_search()[0] == 1
+
+    # Otro worker reserva una doble en otras fechas: el trigger lo anota y sync() no la expulsa
+    conn = connect()
+    user_id = conn.execute("SELECT id FROM users WHERE username = 'test_user'").fetchone()[0]
+    conn.execute("""INSERT INTO bookings (user_id, room_id, start_date, end_date, start_day, end_day,
+                                          total_price, status)
+                    VALUES (?, 6, '2026-11-01', '2026-11-02', ?, ?, 120, 'CONFIRMED')""",
+                 (user_id, day_number("2026-11-01"), day_number("2026-11-02")))
+    conn.commit()
+    inventory.publish(conn, DB_PATH)
+    conn.close()
+    assert hits_after_search()[0] == 1
+
+    client.post("/book", data={"room_id": "5", "start_date": "2026-09-02", "end_date": "2026-09-04"})
+    hits, data = hits_after_search()
+    assert hits == 0
+    assert b'name="room_id" value="5"' not in data
+
+
+def test_search_cache_misses_after_write_from_another_worker(authenticated_client):
+    """Una reserva de otro proceso (sin invalidar esta caché) se ve en la siguiente búsqueda y cambia el ETag"""
+    import inventory
+    client = authenticated_client
+    first = client.get(SEARCH_QUERY)
+    assert b'name="room_id" value="6"' in first.data
+
+    # Otro worker: escribe (el trigger anota el tramo) y publica la versión, sin tocar la caché de este proceso
+    conn = connect()
+    user_id = conn.execute("SELECT id FROM users WHERE username = 'test_user'").fetchone()[0]
+    conn.execute("""INSERT INTO bookings (user_id, room_id, start_date, end_date, start_day, end_day,
+                                          total_price, status)
+                    VALUES (?, 6, '2026-09-01', '2026-09-02', ?, ?, 80, 'CONFIRMED')""",
+                 (user_id, day_number("2026-09-01"), day_number("2026-09-02")))
+    conn.commit()
+    inventory.publish(conn, DB_PATH)
+    conn.close()
+
+    second = client.get(SEARCH_QUERY, headers={"If-None-Match": first.headers["ETag"]})
+    assert second.status_code == 200
+    assert b'name="room_id" value="6"' not in second.data
+    assert second.headers["ETag"] != first.headers["ETag"]
+
+
+def test_room_fragments_and_render_timings(client):
+    """Las filas por habitación se reutilizan entre búsquedas y el render queda medido"""
+    import rendering
+    query = "/search?start_date=2026-10-01&end_date=2026-10-02&room_type=simple"
+    first = client.get(query).data
+    before = rendering.fragments.stats()
+    second = client.get(query).data
+    after = rendering.fragments.stats()
+    assert second == first
+    assert after["hits"] >= before["hits"] + 4
+    assert after["misses"] == before["misses"]
+    assert b'name="room_id" value="1"' in second
+
+    templates = client.get("/api/stats").get_json()["rendering"]["templates"]
+    assert templates["search_results.html"]["renders"] >= 2
+    assert any(rendering.TEMPLATE_CACHE_DIR.iterdir())
+
+
+def test_static_assets_are_fingerprinted(client):
+    """Los estáticos llevan huella en la URL y caché de larga duración"""
+    import re
+    page = client.get("/").get_data(as_text=True)
+    href = re.search(r'href="(/static/style\.css\?v=[0-9a-f]+)"', page).group(1)
+
+    response = client.get(href)
+    assert response.status_code == 200
+    assert "max-age=31536000" in response.headers["Cache-Control"]
+    assert "immutable" in response.headers["Cache-Control"]
+    response.close()
+
+
 # ==============================================================================
 # TESTS DE RESERVAS (RF-005)
 # ==============================================================================
@@ -475,6 +1111,143 @@ def test_book_sets_pending_payment_status(authenticated_client):
     assert status == "PENDING_PAYMENT"
 
 
+def test_book_rejects_overlapping_booking(authenticated_client):
+    """Una segunda reserva solapada de la misma habitación debe rechazarse"""
+    client = authenticated_client
+    client.post("/book", data={"room_id": "6", "start_date": "2026-05-01", "end_date": "2026-05-04"})
+    response = client.post("/book", data={
+        "room_id": "6", "start_date": "2026-05-03", "end_date": "2026-05-06"
+    }, follow_redirects=True)
+
+    assert b"ya no est" in response.data
+    conn = connect()
+    assert conn.execute("SELECT COUNT(*) FROM bookings WHERE room_id = 6").fetchone()[0] == 1
+    conn.close()
+
+
+def test_concurrent_bookings_never_overlap(client):
+    """Miles de reservas solapadas desde muchos hilos: cero dobles reservas"""
+    import random
+    import threading
+    from db import get_pool
+
+    client.post("/register", data={"username": "test_concurrency", "password": "password123"})
+    conn = connect()
+    user_id = conn.execute("SELECT id FROM users WHERE username = 'test_concurrency'").fetchone()[0]
+    conn.close()
+
+    attempts_per_thread, threads = 125, 16
+    base = day_number("2027-01-01")
+    pool = get_pool(DB_PATH)
+    created = []
+
+    def worker(seed):
+        rng = random.Random(seed)
+        conn = pool.acquire()
+        try:
+            for _ in range(attempts_per_thread):
+                room_id = rng.randint(1, 4)
+                start = base + rng.randint(0, 60)
+                end = start + rng.randint(1, 5)
+                booking_id = booking_engine.reserve(conn, user_id, room_id, "2027-01-01", "2027-01-02",
+                                                    start, end, 100.0)
+                if booking_id is not None:
+                    created.append(booking_id)
+        finally:
+            pool.release(conn)
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+
+    conn = connect()
+    overlaps = conn.execute("""
+        SELECT COUNT(*) FROM bookings a JOIN bookings b
+        ON a.room_id = b.room_id AND a.id < b.id
+        AND a.end_day > b.start_day AND a.start_day < b.end_day
+    """).fetchone()[0]
+    stored = conn.execute("SELECT COUNT(*) FROM bookings WHERE user_id = ?", (user_id,)).fetchone()[0]
+    conn.close()
+
+    assert overlaps == 0
+    assert stored == len(created) > 0
+
+
+def test_with_retry_repeats_whole_transaction_when_busy(tmp_path, monkeypatch):
+    """Un busy/locked dentro de la transacción la deshace y la repite entera"""
+    import sqlite3
+    monkeypatch.setattr(booking_engine, "RETRY_DELAY", 0)
+    conn = connect(tmp_path / "retry.db")
+    conn.execute("CREATE TABLE t (x INTEGER)")
+    attempts = []
+
+    def work(conn):
+        attempts.append(1)
+        conn.execute("INSERT INTO t VALUES (?)", (len(attempts),))
+        if len(attempts) == 1:
+            raise sqlite3.OperationalError("database is locked")
+        return "ok"
+
+    assert booking_engine.with_retry(conn, work) == "ok"
+    assert [row[0] for row in conn.execute("SELECT x FROM t")] == [2]
+
+    def fails(conn):
+        raise sqlite3.OperationalError("no such table: nada")
+
+    with pytest.raises(sqlite3.OperationalError):
+        booking_engine.with_retry(conn, fails)
+    assert not conn.in_transaction
+    conn.close()
+
+
+def test_group_booking_by_room_type(authenticated_client):
+    """La reserva de grupo debe asignar y tarifar varias habitaciones a la vez"""
+    response = authenticated_client.post("/api/book/group", json={
+        "room_type": "simple", "quantity": 3,
+        "start_date": "2026-06-01", "end_date": "2026-06-03"
+    })
+
+    assert response.status_code == 201
+    data = response.get_json()
+    assert [b["room_number"] for b in data["bookings"]] == ["101", "102", "103"]
+    assert data["total"] == 3 * 2 * 80.0
+
+
+def test_group_booking_rejects_boolean_quantity(authenticated_client):
+    """JSON true/false no es una cantidad ni una habitación válida"""
+    dates = {"start_date": "2026-06-01", "end_date": "2026-06-03"}
+    for body in ({"room_type": "simple", "quantity": True}, {"room_type": "simple", "quantity": False},
+                 {"room_ids": [True]}):
+        response = authenticated_client.post("/api/book/group", json=dict(body, **dates))
+        assert response.status_code == 400
+
+    conn = connect()
+    assert conn.execute("SELECT COUNT(*) FROM bookings").fetchone()[0] == 0
+    conn.close()
+
+
+def test_group_booking_is_all_or_nothing(authenticated_client):
+    """Si falta una habitación no debe crearse ninguna reserva del grupo"""
+    client = authenticated_client
+    client.post("/book", data={"room_id": "9", "start_date": "2026-06-10", "end_date": "2026-06-12"})
+
+    response = client.post("/api/book/group", json={
+        "room_ids": [8, 9, 10], "start_date": "2026-06-11", "end_date": "2026-06-13"
+    })
+    assert response.status_code == 409
+
+    response = client.post("/api/book/group", json={
+        "room_type": "suite", "quantity": 3, "start_date": "2026-06-11", "end_date": "2026-06-13"
+    })
+    assert response.status_code == 409
+
+    conn = connect()
+    assert conn.execute("SELECT COUNT(*) FROM bookings").fetchone()[0] == 1
+    conn.close()
+
+
 # ==============================================================================
 # TESTS DE PAGOS (RF-006)
 # ==============================================================================
@@ -541,6 +1314,477 @@ def test_pay_updates_booking_status(authenticated_client):
     assert status == "CONFIRMED"
 
 
+def test_pay_twice_charges_once(authenticated_client):
+    """Doble envío del pago: un solo registro en payments"""
+    client = authenticated_client
+    client.post("/book", data={"room_id": "6", "start_date": "2025-12-10", "end_date": "2025-12-12"})
+
+    conn = connect()
+    booking_id = conn.execute("SELECT id FROM bookings ORDER BY id DESC LIMIT 1").fetchone()[0]
+    conn.close()
+
+    client.post("/pay", data={"booking_id": str(booking_id)})
+    response = client.post("/pay", data={"booking_id": str(booking_id)}, follow_redirects=True)
+    assert "ya estaba pagada" in response.get_data(as_text=True)
+
+    conn = connect()
+    rows = conn.execute("SELECT amount FROM payments WHERE booking_id = ?", (booking_id,)).fetchall()
+    conn.close()
+    assert [row[0] for row in rows] == [240.0]
+
+
+def test_pay_reports_failed_batch(authenticated_client, monkeypatch):
+    """Si el lote de pagos falla (p. ej. base bloqueada) la petición avisa y redirige, sin 500"""
+    import sqlite3
+    from concurrent.futures import Future
+    import payments
+
+    class FailingPipeline:
+        def submit(self, booking_id):
+            future = Future()
+            future.set_exception(sqlite3.OperationalError("database is locked"))
+            return future
+
+    client = authenticated_client
+    client.post("/book", data={"room_id": "2", "start_date": "2026-09-10", "end_date": "2026-09-12"})
+    conn = connect()
+    booking_id = conn.execute("SELECT id FROM bookings ORDER BY id DESC LIMIT 1").fetchone()[0]
+    conn.close()
+
+    monkeypatch.setattr(payments, "get_pipeline", lambda path: FailingPipeline())
+    response = client.post("/pay", data={"booking_id": str(booking_id)})
+    assert response.status_code == 302
+    assert "El pago no se ha procesado" in client.get("/").get_data(as_text=True)
+
+    conn = connect()
+    assert conn.execute("SELECT status FROM bookings WHERE id = ?", (booking_id,)).fetchone()[0] == "PENDING_PAYMENT"
+    conn.close()
+
+
+def test_payment_pipeline_concurrent_submits(client):
+    """Envíos concurrentes de las mismas reservas se agrupan sin cobrar dos veces"""
+    import payments
+    from concurrent.futures import ThreadPoolExecutor
+
+    conn = connect()
+    user_id = conn.execute("INSERT INTO users (username, password_hash) VALUES ('test_pagador', 'x')").lastrowid
+    booking_ids = [
+        conn.execute("""
+            INSERT INTO bookings (user_id, room_id, start_date, end_date, total_price, status, start_day, end_day)
+            VALUES (?, ?, '2026-05-01', '2026-05-02', 80, 'PENDING_PAYMENT', ?, ?)
+        """, (user_id, room_id, day_number("2026-05-01"), day_number("2026-05-02"))).lastrowid
+        for room_id in (1, 2, 3)
+    ]
+    conn.commit()
+    conn.close()
+
+    pipeline = payments.PaymentPipeline(DB_PATH)
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda b: pipeline.submit(b).result(timeout=5), booking_ids * 4))
+
+    # Los envíos simultáneos comparten el resultado del pago en curso
+    assert set(results) <= {payments.CONFIRMED, payments.ALREADY_PAID}
+    conn = connect()
+    assert conn.execute("SELECT COUNT(*) FROM payments WHERE booking_id IN (?, ?, ?)",
+                        booking_ids).fetchone()[0] == 3
+    conn.close()
+    stats = pipeline.stats()
+    assert stats["confirmed"] == 3 and stats["batches"] <= 12
+
+
+def test_pay_status_endpoint(authenticated_client):
+    """El estado del pago se puede consultar por reserva"""
+    client = authenticated_client
+    client.post("/book", data={"room_id": "7", "start_date": "2025-12-10", "end_date": "2025-12-11"})
+
+    conn = connect()
+    booking_id = conn.execute("SELECT id FROM bookings ORDER BY id DESC LIMIT 1").fetchone()[0]
+    conn.close()
+
+    assert client.get(f"/pay/status/{booking_id}").get_json()["payment"] is None
+    client.post("/pay", data={"booking_id": str(booking_id)})
+    data = client.get(f"/pay/status/{booking_id}").get_json()
+    assert data["status"] == "CONFIRMED"
+    assert data["payment"]["status"] == "APPROVED"
+    assert data["queued"] is False
+    assert client.get("/pay/status/999999").status_code == 404
+
+
+def test_migration_moves_duplicate_payments_to_audit_table(tmp_path, capsys):
+    """init_db deja un pago por reserva antes del índice único y guarda los demás en payments_duplicates"""
+    import sqlite3
+    path = tmp_path / "pagos.db"
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE payments (id INTEGER PRIMARY KEY AUTOINCREMENT, booking_id INTEGER NOT NULL,
+                               amount REAL NOT NULL, status TEXT NOT NULL, created_at TEXT NOT NULL);
+        INSERT INTO payments (booking_id, amount, status, created_at) VALUES (1, 0, 'APPROVED', 'a');
+        INSERT INTO payments (booking_id, amount, status, created_at) VALUES (1, 0, 'APPROVED', 'b');
+        INSERT INTO payments (booking_id, amount, status, created_at) VALUES (2, 0, 'APPROVED', 'c');
+    """)
+    conn.close()
+
+    init_db(path)
+
+    conn = sqlite3.connect(path)
+    assert conn.execute("SELECT booking_id, created_at FROM payments ORDER BY id").fetchall() == [(1, "a"), (2, "c")]
+    assert conn.execute("SELECT payment_id, booking_id, created_at FROM payments_duplicates").fetchall() == \
+        [(2, 1, "b")]
+    assert "reservas 1)" in capsys.readouterr().err
+    with pytest.raises(sqlite3.IntegrityError):
+        conn.execute("INSERT INTO payments (booking_id, amount, status, created_at) VALUES (2, 0, 'APPROVED', 'd')")
+    conn.close()
+
+
+# ==============================================================================
+# TESTS DE RETENCIONES (PENDING_PAYMENT CON CADUCIDAD)
+# ==============================================================================
+
+def insert_expired_holds(room_ids, start="2026-06-01", end="2026-06-03"):
+    conn = connect()
+    user_id = conn.execute("INSERT INTO users (username, password_hash) VALUES ('test_holds', 'x')").lastrowid
+    ids = [
+        conn.execute("""
+            INSERT INTO bookings (user_id, room_id, start_date, end_date, total_price, status,
+                                  start_day, end_day, hold_expires_at)
+            VALUES (?, ?, ?, ?, 80, 'PENDING_PAYMENT', ?, ?, strftime('%s', 'now') - 60)
+        """, (user_id, room_id, start, end, day_number(start), day_number(end))).lastrowid
+        for room_id in room_ids
+    ]
+    conn.commit()
+    conn.close()
+    return user_id, ids
+
+
+def test_expired_hold_does_not_block_room(client):
+    """Una retención caducada no bloquea la habitación aunque no haya pasado el barrido"""
+    import time
+    user_id, _ = insert_expired_holds([1])
+    response = client.post("/api/availability", json={"queries": [["simple", "2026-06-01", "2026-06-03"]]})
+    assert len(response.get_json()["results"][0]["available"]) == 4
+
+    conn = connect()
+    booking_id = booking_engine.reserve(conn, user_id, 1, "2026-06-02", "2026-06-04",
+                                        day_number("2026-06-02"), day_number("2026-06-04"), 160)
+    hold = conn.execute("SELECT hold_expires_at FROM bookings WHERE id = ?", (booking_id,)).fetchone()[0] - time.time()
+    conn.close()
+    assert booking_id is not None
+    assert 0 < hold <= 15 * 60
+
+
+def test_expired_hold_cannot_be_paid(client):
+    """Pagar una retención caducada no genera cobro"""
+    import payments
+    _, (booking_id,) = insert_expired_holds([2])
+    result = payments.PaymentPipeline(DB_PATH).submit(booking_id).result(timeout=5)
+    assert result == payments.NOT_PAYABLE
+
+    conn = connect()
+    assert conn.execute("SELECT COUNT(*) FROM payments WHERE booking_id = ?", (booking_id,)).fetchone()[0] == 0
+    conn.close()
+
+
+def test_hold_sweeper_releases_in_batches(client):
+    """El barrido pasa a EXPIRED por lotes usando el índice parcial"""
+    import holds
+    _, ids = insert_expired_holds([1, 2, 3, 4, 5])
+    sweeper = holds.HoldSweeper(DB_PATH, batch=2)
+
+    conn = connect()
+    plan = " ".join(row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + holds.EXPIRED_HOLDS, (2,)))
+    assert "idx_bookings_hold_expiry (hold_expires_at<?)" in plan
+
+    assert sweeper.sweep(conn) == 5
+    assert sweeper.sweep(conn) == 0
+    placeholders = ",".join("?" * len(ids))
+    statuses = {row[0] for row in conn.execute(f"SELECT status FROM bookings WHERE id IN ({placeholders})", ids)}
+    conn.close()
+    assert statuses == {"EXPIRED"}
+
+    stats = sweeper.stats()
+    assert stats["runs"] == 2 and stats["released"] == 5
+    assert stats["max_released"] == 5 and stats["last_released"] == 0
+
+
+def test_search_only_worker_starts_hold_sweeper(client):
+    """Un worker que sólo sirve búsquedas también barre: si no, su ETag no cambiaría al vencer una retención"""
+    import holds
+    sweeper = holds.get_sweeper(DB_PATH)
+    sweeper.start()
+    sweeper.stop()
+    sweeper._thread.join(timeout=5)
+    assert not sweeper.stats()["running"]
+
+    client.get(SEARCH_QUERY)
+    assert sweeper.stats()["running"]
+
+
+def test_hold_release_from_any_process_refreshes_cached_search(authenticated_client):
+    """Un barrido de otro proceso (sin on_release) publica la versión y la caché de búsqueda no sirve la página vieja"""
+    import time
+    import holds
+    import inventory
+    client = authenticated_client
+    conn = connect()
+    user_id = conn.execute("SELECT id FROM users WHERE username = 'test_user'").fetchone()[0]
+    conn.execute("""
+        INSERT INTO bookings (user_id, room_id, start_date, end_date, total_price, status,
+                              start_day, end_day, hold_expires_at)
+        VALUES (?, 5, '2026-09-01', '2026-09-03', 240, 'PENDING_PAYMENT', ?, ?, strftime('%s', 'now') + 1)
+    """, (user_id, day_number("2026-09-01"), day_number("2026-09-03")))
+    conn.commit()
+    inventory.publish(conn, DB_PATH)
+    conn.close()
+
+    assert b'name="room_id" value="5"' not in client.get(SEARCH_QUERY).data
+    time.sleep(1.1)
+    assert holds.HoldSweeper(DB_PATH).sweep() == 1
+    assert b'name="room_id" value="5"' in client.get(SEARCH_QUERY).data
+
+
+# ==============================================================================
+# TESTS DE HOTELES (SHARDS)
+# ==============================================================================
+
+def test_provision_property_creates_shard(tmp_path):
+    """Un hotel nuevo recibe su propio fichero con esquema y habitaciones"""
+    import properties
+    directory = tmp_path / "directorio.db"
+    init_db(directory)
+    router = properties.Router(directory)
+    path = router.provision("norte", "Hotel Norte", "Lima")
+
+    assert path == tmp_path / "shards" / "hotel_norte.db"
+    conn = connect(path)
+    assert conn.execute("SELECT COUNT(*) FROM rooms").fetchone()[0] == 10
+    conn.close()
+    assert [prop["code"] for prop in router.properties(city="lima")] == ["norte"]
+    assert router.path_for("central") == directory
+
+    # Volver a inicializar el directorio migra los shards registrados sin duplicar datos
+    init_db(directory)
+    with pytest.raises(properties.UnknownProperty):
+        router.get("sur")
+    with pytest.raises(ValueError):
+        router.provision("Con Espacios", "Hotel", None)
+
+
+def test_router_caches_directory_until_provision(tmp_path, monkeypatch):
+    """properties() no relee el directorio en cada llamada; sí tras provision() o reload()"""
+    import properties
+    directory = tmp_path / "directorio.db"
+    init_db(directory)
+    router = properties.Router(directory)
+    loads = []
+    load = router._load
+    monkeypatch.setattr(router, "_load", lambda: loads.append(1) or load())
+
+    for _ in range(3):
+        assert [prop["code"] for prop in router.properties()] == ["central"]
+    assert len(loads) == 1
+    router.provision("norte", "Hotel Norte", "Lima")
+    assert [prop["code"] for prop in router.properties(city="Lima")] == ["norte"]
+    assert len(loads) == 2
+    forget(tmp_path / "shards" / "hotel_norte.db")
+    forget(directory)
+
+
+@pytest.fixture
+def shard_client(authenticated_client):
+    """Dos hoteles de prueba en la misma ciudad, dados de baja al terminar"""
+    from app import get_router
+    router = get_router()
+    paths = [router.provision(code, f"Hotel {code}", "Testville") for code in ("test-norte", "test-sur")]
+    yield authenticated_client
+    conn = connect()
+    conn.execute("DELETE FROM properties WHERE code LIKE 'test-%'")
+    conn.commit()
+    conn.close()
+    router.reload()
+    for path in paths:
+        forget(path)
+        for suffix in ("", "-wal", "-shm"):
+            Path(f"{path}{suffix}").unlink(missing_ok=True)
+
+
+def test_booking_goes_to_property_shard(shard_client):
+    """La reserva se guarda en el shard del hotel indicado, no en el directorio"""
+    from app import get_router
+    response = shard_client.post("/book?property=test-norte", data={
+        "room_id": "1", "start_date": "2026-07-01", "end_date": "2026-07-03"
+    })
+    assert response.status_code == 200
+
+    conn = connect(get_router().path_for("test-norte"))
+    assert conn.execute("SELECT COUNT(*) FROM bookings WHERE room_id = 1").fetchone()[0] == 1
+    conn.close()
+    conn = connect()
+    assert conn.execute("SELECT COUNT(*) FROM bookings").fetchone()[0] == 0
+    conn.close()
+
+    assert shard_client.get("/property/test-sur").status_code == 302
+    assert shard_client.get("/api/stats").get_json()["property"] == "test-sur"
+    assert shard_client.get("/api/stats?property=no-existe").status_code == 404
+
+
+def test_city_availability_rejects_non_object_body(client):
+    """Un cuerpo JSON que no es un objeto (o sin city de texto) es un 400, no un 500"""
+    assert client.post("/api/availability/city", json=["testville"]).status_code == 400
+    assert client.post("/api/availability/city", json={"city": 5}).status_code == 400
+
+
+def test_city_availability_fans_out_across_shards(shard_client):
+    """La búsqueda por ciudad consulta todos los shards y combina los resultados"""
+    shard_client.post("/book?property=test-norte", data={
+        "room_id": "1", "start_date": "2026-07-01", "end_date": "2026-07-03"
+    })
+    response = shard_client.post("/api/availability/city", json={
+        "city": "testville", "room_type": "simple", "start_date": "2026-07-01", "end_date": "2026-07-03"
+    })
+    assert response.status_code == 200
+    results = {result["property"]: result for result in response.get_json()["results"]}
+    assert set(results) == {"test-norte", "test-sur"}
+    assert len(results["test-norte"]["available"]) == 3
+    assert len(results["test-sur"]["available"]) == 4
+    assert shard_client.post("/api/availability/city", json={"room_type": "simple"}).status_code == 400
+
+
+# ==============================================================================
+# TESTS DE ÍNDICE DE OCUPACIÓN
+# ==============================================================================
+
+@pytest.fixture
+def occupancy_client(authenticated_client):
+    """Cliente con el índice de ocupación compartido activado"""
+    occupancy.drop_index(DB_PATH)
+    app.config["OCCUPANCY_INDEX"] = True
+    yield authenticated_client
+    app.config["OCCUPANCY_INDEX"] = False
+    occupancy.drop_index(DB_PATH)
+
+
+def test_occupancy_index_excludes_booked_room(occupancy_client):
+    """El índice debe marcar la reserva y la búsqueda no debe ofrecer la habitación"""
+    from datetime import date, timedelta
+    start = date.today() + timedelta(days=30)
+    end = start + timedelta(days=3)
+
+    occupancy_client.post("/book", data={
+        "room_id": "1",
+        "start_date": start.isoformat(),
+        "end_date": end.isoformat()
+    })
+
+    index = occupancy.get_index(DB_PATH)
+    mask = index.available([1, 2], start.toordinal(), end.toordinal())
+    assert mask.tolist() == [False, True]
+
+    response = occupancy_client.post("/search", data={
+        "start_date": start.isoformat(),
+        "end_date": end.isoformat(),
+        "room_type": "simple"
+    })
+    assert b'name="room_id" value="1"' not in response.data
+    assert b'name="room_id" value="2"' in response.data
+
+
+def test_occupancy_index_consistent_with_database(occupancy_client):
+    """check() no debe encontrar diferencias tras reservar y pagar"""
+    from datetime import date, timedelta
+    start = date.today() + timedelta(days=60)
+
+    occupancy_client.post("/book", data={
+        "room_id": "3",
+        "start_date": start.isoformat(),
+        "end_date": (start + timedelta(days=2)).isoformat()
+    })
+    conn = connect()
+    booking_id = conn.execute("SELECT id FROM bookings ORDER BY id DESC LIMIT 1").fetchone()[0]
+    occupancy_client.post("/pay", data={"booking_id": str(booking_id)})
+
+    index = occupancy.get_index(DB_PATH)
+    assert index.grid[3, start.toordinal() - index.origin] == occupancy.CONFIRMED
+    assert index.check(conn) == []
+    conn.close()
+
+
+def test_expired_hold_does_not_block_room_with_occupancy_index(occupancy_client):
+    """Con el índice activo, una retención que caduca deja la habitación libre aunque no pase el barrido"""
+    import time
+    from datetime import date, timedelta
+    start = date.today() + timedelta(days=45)
+    end = start + timedelta(days=2)
+    conn = connect()
+    user_id = conn.execute("SELECT id FROM users WHERE username = 'test_user'").fetchone()[0]
+    conn.execute("""
+        INSERT INTO bookings (user_id, room_id, start_date, end_date, total_price, status,
+                              start_day, end_day, hold_expires_at)
+        VALUES (?, 1, ?, ?, 160, 'PENDING_PAYMENT', ?, ?, strftime('%s', 'now') + 1)
+    """, (user_id, start.isoformat(), end.isoformat(), start.toordinal(), end.toordinal()))
+    conn.commit()
+
+    index = occupancy.get_index(DB_PATH)
+    assert index.available([1, 2], start.toordinal(), end.toordinal()).tolist() == [False, True]
+    time.sleep(1.1)
+    assert index.available([1, 2], start.toordinal(), end.toordinal()).tolist() == [True, True]
+    assert 1 not in index.occupied(start.toordinal(), end.toordinal()).tolist()
+    assert index.check(conn) == []
+    conn.close()
+
+    response = occupancy_client.post("/api/availability", json={
+        "queries": [["simple", start.isoformat(), end.isoformat()]]
+    })
+    assert len(response.get_json()["results"][0]["available"]) == 4
+
+
+def test_occupancy_index_window_rolls_forward(occupancy_client):
+    """Con el paso de los días la ventana se reconstruye y sigue cubriendo el horizonte completo"""
+    from datetime import date
+    today = date.today().toordinal()
+    index = occupancy.get_index(DB_PATH)
+    assert index.origin == today - occupancy.PAST_DAYS
+    later = today + occupancy.ROLL_DAYS + 100
+    far = today + occupancy.HORIZON_DAYS + 50
+    assert not index.covers(far, far + 2)
+
+    occupancy_client.post("/book", data={"room_id": "2", "start_date": date.fromordinal(far).isoformat(),
+                                         "end_date": date.fromordinal(far + 2).isoformat()})
+    # Antes de ROLL_DAYS la ventana no se mueve
+    assert occupancy.get_index(DB_PATH, today=today + occupancy.ROLL_DAYS - 1) is index
+
+    rolled = occupancy.get_index(DB_PATH, today=later)
+    assert rolled is not index
+    assert rolled.origin == later - occupancy.PAST_DAYS
+    assert rolled.covers(far, far + 2)
+    assert rolled.available([1, 2], far, far + 2).tolist() == [True, False]
+    conn = connect()
+    assert rolled.check(conn) == []
+    conn.close()
+
+
+def test_calendar_month_grid(authenticated_client):
+    """El calendario debe reflejar reservas pendientes y confirmadas por noche"""
+    client = authenticated_client
+    client.post("/book", data={"room_id": "1", "start_date": "2026-03-30", "end_date": "2026-04-02"})
+    client.post("/book", data={"room_id": "2", "start_date": "2026-04-05", "end_date": "2026-04-07"})
+    conn = connect()
+    booking_id = conn.execute("SELECT id FROM bookings ORDER BY id DESC LIMIT 1").fetchone()[0]
+    conn.close()
+    client.post("/pay", data={"booking_id": str(booking_id)})
+
+    data = client.get("/calendar?month=2026-04&format=json").get_json()
+    assert len(data["days"]) == 30
+    assert data["rooms"]["101"].startswith("10000")
+    assert data["rooms"]["102"][3:7] == "0220"
+    assert set(data["rooms"]["110"]) == {"0"}
+
+    csv_response = client.get("/calendar?month=2026-04&format=csv")
+    assert csv_response.mimetype == "text/csv"
+    assert csv_response.data.splitlines()[1].startswith(b"101,1,0,0")
+
+    assert client.get("/calendar?month=2026-04").status_code == 200
+
+
 # ==============================================================================
 # TESTS DE COBERTURA Y CALIDAD
 # ==============================================================================
@@ -551,6 +1795,7 @@ def test_all_routes_exist(client):
         ("/", 200),
         ("/register", 200),
         ("/login", 200),
+        ("/calendar", 200),
     ]
     
     for route, expected_status in routes:
@@ -572,6 +1817,103 @@ def test_database_connection_closes():
         assert True
 
 
+def test_asgi_entry_point_serves_search(client):
+    """El punto de entrada ASGI debe servir las mismas vistas que WSGI"""
+    import asyncio
+    import asgi
+    body = b"start_date=2026-08-01&end_date=2026-08-03&room_type=suite"
+    scope = {
+        "type": "http", "method": "POST", "path": "/search", "query_string": b"",
+        "headers": [(b"content-type", b"application/x-www-form-urlencoded"),
+                    (b"content-length", str(len(body)).encode())],
+    }
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(asgi.application(scope, receive, send))
+
+    assert messages[0]["status"] == 200
+    assert b'name="room_id" value="8"' in b"".join(message["body"] for message in messages[1:])
+    assert messages[-1]["more_body"] is False
+
+
+def test_asgi_streams_chunks_and_rejects_large_bodies(client, monkeypatch):
+    """La búsqueda en streaming sale en varios mensajes; un cuerpo demasiado grande recibe 413"""
+    import asyncio
+    import asgi
+    app.config["SEARCH_STREAMING"] = True
+    scope = {"type": "http", "method": "GET", "path": "/search", "headers": [],
+             "query_string": b"start_date=2026-08-01&end_date=2026-08-03&room_type=suite"}
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(asgi.application(scope, receive, send))
+    bodies = [message for message in messages[1:] if message["body"]]
+    assert len(bodies) > 1 and all(message["more_body"] for message in bodies)
+    assert b'name="room_id" value="8"' in b"".join(message["body"] for message in bodies)
+
+    monkeypatch.setattr(asgi, "ASGI_MAX_BODY", 10)
+    chunks = iter([b"x" * 8, b"x" * 8])
+
+    async def receive_large():
+        return {"type": "http.request", "body": next(chunks), "more_body": True}
+
+    messages.clear()
+    asyncio.run(asgi.application(dict(scope, method="POST"), receive_large, send))
+    assert messages[0]["status"] == 413
+
+
+def test_asgi_slow_reader_does_not_hold_a_thread(client, monkeypatch):
+    """Con un único hilo, un cliente que no lee su respuesta en streaming no bloquea otra petición"""
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+    import asgi
+    executor = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(asgi, "_executor", executor)
+    app.config["SEARCH_STREAMING"] = True
+    scope = {"type": "http", "method": "GET", "path": "/search", "headers": [],
+             "query_string": b"start_date=2026-08-01&end_date=2026-08-03&room_type=suite"}
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def main():
+        reading = asyncio.Event()
+        slow, fast = [], []
+
+        async def slow_send(message):
+            slow.append(message)
+            if message.get("body"):
+                await reading.wait()
+
+        async def fast_send(message):
+            fast.append(message)
+
+        slow_task = asyncio.create_task(asgi.application(scope, receive, slow_send))
+        while not any(message.get("body") for message in slow):
+            await asyncio.sleep(0.01)
+        await asyncio.wait_for(asgi.application(scope, receive, fast_send), timeout=10)
+        assert fast[0]["status"] == 200 and fast[-1]["more_body"] is False
+        reading.set()
+        await asyncio.wait_for(slow_task, timeout=10)
+        assert slow[-1]["more_body"] is False
+
+    try:
+        asyncio.run(main())
+    finally:
+        executor.shutdown(wait=True)
+
+
 # ==============================================================================
 # TESTS DE INTEGRACIÓN
 # ==============================================================================